@@ -1,79 +1,128 @@
-from flask import Flask, redirect, url_for
+"""
+应用入口：create_app 创建应用（flask --app app ... 会自动调用）
+- web=True：注册页面与接口蓝图、请求统计、/metrics；web=False 只初始化数据库，供后台任务、命令行和脚本使用
+- 蓝图和服务模块在创建应用时才导入，启动时不访问数据库；建表和演示数据改为显式执行 flask --app app init-db [--demo]
+"""
+from flask import Flask, redirect, url_for, Response
+from sqlalchemy.engine import make_url
 from config import Config
 from database import db
-from routes.energy_routes import energy_bp
-from models import FactoryArea, EnergyMeter, EnergyMonitor, PeakValleyEnergy
-import datetime
+from commands import register_commands
+import os
 
-app = Flask(__name__, 
-            template_folder='../frontend/templates',
-            static_folder='../frontend/static')
-app.config.from_object(Config)
+# 只有连接池（QueuePool）支持的参数，SQLite（StaticPool 等）不接受
+QUEUE_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout")
 
-# 绑定数据库
-db.init_app(app)
 
-# 注册蓝图
-app.register_blueprint(energy_bp, url_prefix='/energy')
+def create_app(config_object=Config, web: bool = True) -> Flask:
+    """
+    创建应用
+    :param config_object: 配置类（需在调用前修改数据库连接等配置）
+    :param web: 是否注册页面、接口和请求统计（后台任务传 False）
+    """
+    app = Flask(__name__,
+                template_folder='../frontend/templates',
+                static_folder='../frontend/static')
+    app.config.from_object(config_object)
+    configure_engines(app)
+
+    # 绑定数据库
+    db.init_app(app)
+    register_commands(app)
+    if web:
+        register_web(app)
+    return app
+
+
+def engine_options(uri, options: dict) -> dict:
+    """按数据库类型筛选连接选项：SQLite 去掉连接池大小相关的参数"""
+    if make_url(uri).get_backend_name() == "sqlite":
+        return {key: value for key, value in options.items() if key not in QUEUE_POOL_OPTIONS}
+    return dict(options)
+
+
+def configure_engines(app) -> None:
+    """主库与只读副本分别按各自的连接串设置连接选项（SQLALCHEMY_ENGINE_OPTIONS 原样不适用于 SQLite）"""
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    if app.config.get("SQLALCHEMY_DATABASE_URI"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"], options)
+    binds = {}
+    for key, value in app.config.get("SQLALCHEMY_BINDS", {}).items():
+        bind = {"url": value} if isinstance(value, str) else dict(value)
+        binds[key] = {**engine_options(bind["url"], options), **bind}
+    app.config["SQLALCHEMY_BINDS"] = binds
+
+
+def register_web(app) -> None:
+    """注册蓝图、首页、/metrics 与请求耗时、SQL条数统计"""
+    from routes.energy_routes import energy_bp
+    from utils.instrumentation import init_instrumentation
+    from utils.tariff_engine import get_tariff_engine
+    # 启动时编译默认电价方案，PEAK_VALLEY_PERIODS 配置有误时直接报错
+    get_tariff_engine()
+    app.register_blueprint(energy_bp, url_prefix='/energy')
+    app.add_url_rule('/', 'index', index)
+    app.add_url_rule('/metrics', 'prometheus_metrics', prometheus_metrics)
+    init_instrumentation(app)
+
 
-@app.route('/')
 def index():
     return redirect(url_for('energy.meter_manage'))
 
-# --- 造数据函数 (仅在数据库为空时执行) ---
-def init_db_data():
-    # 创建所有表
-    db.create_all()
-    
-    # 检查是否已有数据
-    if FactoryArea.query.first():
-        return
-
-    print("正在初始化测试数据...")
-    
-    # 1. 创建厂区
-    f1 = FactoryArea(factory_id="F001", factory_name="真旺厂", address="北京市海淀区", manager="张三")
-    f2 = FactoryArea(factory_id="F002", factory_name="豆果厂", address="北京市朝阳区", manager="李四")
-    db.session.add_all([f1, f2])
-    db.session.commit()
-    
-    # 2. 创建设备
-    m1 = EnergyMeter(
-        meter_id="M_WATER_01", factory_id="F001", energy_type="水", 
-        install_location="污水处理站", pipe_spec="DN100", comm_protocol="RS485", 
-        calib_cycle=12, manufacturer="西门子"
-    )
-    m2 = EnergyMeter(
-        meter_id="M_ELEC_01", factory_id="F001", energy_type="天然气", 
-        install_location="锅炉房", pipe_spec="DN50", comm_protocol="Lora", 
-        run_status="故障", calib_cycle=24, manufacturer="施耐德"
-    )
-    db.session.add_all([m1, m2])
-    db.session.commit()
-    
-    # 3. 创建监测数据
-    d1 = EnergyMonitor(
-        data_id="D001", meter_id="M_WATER_01", collect_time=datetime.datetime.now(),
-        energy_value=120.5, unit="m³", data_quality="优", factory_id="F001", is_verified=True
-    )
-    d2 = EnergyMonitor(
-        data_id="D002", meter_id="M_ELEC_01", collect_time=datetime.datetime.now(),
-        energy_value=50.2, unit="m³", data_quality="差", factory_id="F001", is_verified=False
-    )
-    db.session.add_all([d1, d2])
-    
-    # 4. 创建峰谷数据 (用于报表)
-    pv1 = PeakValleyEnergy(
-        record_id="PV001", energy_type="电", factory_id="F001", stat_date=datetime.date.today(),
-        peak_energy=100, high_energy=200, flat_energy=150, valley_energy=50,
-        total_energy=500, peak_valley_price=0.8, energy_cost=400
-    )
-    db.session.add(pv1)
-    db.session.commit()
-    
-    print("测试数据初始化完成！")
+
+def prometheus_metrics():
+    """Prometheus 指标（请求/服务方法耗时与SQL统计、N+1、缓存命中、写入队列、异常检测、后台汇总）"""
+    from services.report_cache import report_cache
+    from services.ingest_queue import ingest_queue
+    from services.anomaly_detector import anomaly_detector
+    from services.rollup_worker import rollup_worker
+    from utils.instrumentation import render_prometheus
+    cache = report_cache.stats()
+    queue = ingest_queue.metrics()
+    anomaly = anomaly_detector.summary()
+    counters = {
+        "energy_cache_hits": ("报表缓存命中次数", cache["hits"]),
+        "energy_cache_misses": ("报表缓存未命中次数", cache["misses"]),
+        "energy_ingest_written": ("写入队列已写入的条数", queue["written"]),
+        "energy_ingest_rejected": ("写入队列拒绝的条数", queue["rejected"]),
+        "energy_ingest_dead_lettered": ("写入队列无法写入而丢弃的条数", queue["dead_lettered"]),
+        "energy_anomaly_readings": ("异常检测已处理的读数", anomaly["readings"]),
+        "energy_anomaly_flagged": ("异常检测判为可疑的读数", anomaly["flagged"]),
+    }
+    gauges = {
+        "energy_cache_entries": ("报表缓存条目数", cache["size"]),
+        "energy_ingest_queue_depth": ("写入队列中待写入的条数", queue["depth"]),
+        "energy_ingest_last_flush_ms": ("最近一批写入耗时（毫秒）", queue["last_flush_ms"]),
+        "energy_ingest_avg_flush_ms": ("平均每批写入耗时（毫秒）", queue["avg_flush_ms"]),
+    }
+    if Config.PEAK_VALLEY_UPDATE_MODE == "deferred":
+        rollup = rollup_worker.metrics()
+        pending = rollup_worker.pending()
+        counters.update({
+            "energy_rollup_recomputed": ("本进程后台汇总已重算的键数", rollup["recomputed"]),
+            "energy_rollup_conflicts": ("本进程后台汇总冲突或失败的次数", rollup["conflicts"]),
+            "energy_rollup_failed": ("本进程后台汇总重算失败的次数", rollup["failed"]),
+        })
+        gauges.update({
+            "energy_rollup_pending_keys": ("待重算的峰谷日报表键数", pending["total"]),
+            "energy_rollup_due_keys": ("已到期未重算的峰谷日报表键数", pending["due"]),
+            "energy_rollup_last_run_ms": ("最近一轮后台汇总耗时（毫秒）", rollup["last_run_ms"]),
+        })
+    # 各连接池（主库、只读副本）已借出的连接数
+    for bind_key, engine in db.engines.items():
+        if hasattr(engine.pool, "checkedout"):
+            gauges[f"energy_db_pool_checked_out_{bind_key or 'primary'}"] = ("连接池已借出的连接数", engine.pool.checkedout())
+    return Response(render_prometheus(gauges, counters), mimetype='text/plain; version=0.0.4')
+
 
 if __name__ == '__main__':
-    with app.app_context():
-        init_db_data() # 启动前先检查并造数据
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    app = create_app()
+    # 异步写入模式：启动后台写库线程并补写预写日志（debug 重载时只在实际提供服务的子进程中启动）
+    if Config.INGEST_MODE == "async" and (os.environ.get("WERKZEUG_RUN_MAIN") or not app.debug):
+        from services.energy_service import EnergyService
+        EnergyService.start_ingest_queue(app)
+    # 延迟汇总模式：在应用进程内启动后台汇总线程（也可用 flask --app app run-rollups 单独运行）
+    if Config.PEAK_VALLEY_UPDATE_MODE == "deferred" and (os.environ.get("WERKZEUG_RUN_MAIN") or not app.debug):
+        from services.rollup_worker import rollup_worker
+        rollup_worker.start(app)
+    app.run(debug=True, port=5000)
@@ -0,0 +1,86 @@
+"""
+列式归档读取性能对比：同一段历史数据分别从数据库（ORM / SQL 汇总）和内存映射的归档文件读取
+- 取一个厂区一种能源类型的全部读数：ORM 查询对象 vs 归档数组
+- 峰谷日汇总（query_period_sums）：数据库分组汇总 vs 归档查表汇总
+- 厂区能耗曲线（LTTB）：数据库按时间求和 vs 归档数组求和
+运行方式（在 backend 目录下）：python -m benchmarks.bench_archive --factories 4 --meters 10 --days 60 --interval 5
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from config import Config
+
+
+def measure(fn, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列式归档读取性能对比")
+    parser.add_argument("--factories", type=int, default=4, help="厂区数")
+    parser.add_argument("--meters", type=int, default=10, help="每个厂区的设备数")
+    parser.add_argument("--days", type=int, default=60, help="天数")
+    parser.add_argument("--interval", type=int, default=5, help="采集间隔（分钟）")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    args = parser.parse_args()
+
+    temp_dir = tempfile.mkdtemp(prefix="energy_bench_")
+    Config.SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(temp_dir, "archive.db")
+    Config.ARCHIVE_DIR = os.path.join(temp_dir, "archive")
+    Config.SLOW_REQUEST_MS = None
+    from app import create_app
+    app = create_app(web=False)
+    from database import db
+    from models import EnergyMeter, EnergyMonitor
+    from benchmarks.datagen import generate_dataset
+    from services.archive_service import archive_store, archive_days, read_archive
+    from services.rollup_service import query_period_sums
+    from services.timeseries_service import get_timeseries
+
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        dataset = generate_dataset(args.factories, args.meters, args.days, args.interval)
+        print(f"数据生成完成：{dataset['readings']:,} 条监测数据，耗时 {time.perf_counter() - started:.1f}s")
+        first_day = datetime.fromisoformat(dataset["start_date"]).date()
+        last_day = datetime.fromisoformat(dataset["end_date"]).date()
+        start_time = datetime.combine(first_day, datetime.min.time())
+        end_time = datetime.combine(last_day + timedelta(days=1), datetime.min.time())
+        factory_id, energy_type = db.session.query(EnergyMeter.factory_id, EnergyMeter.energy_type).first()
+
+        started = time.perf_counter()
+        summary = archive_days(first_day, last_day, progress=lambda message: None)
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(Config.ARCHIVE_DIR) for name in names)
+        print(f"归档完成：{summary['days']}天 {summary['readings']:,}条，{size / 1024 / 1024:.1f}MB，耗时 {time.perf_counter() - started:.1f}s")
+
+        def orm_rows():
+            return EnergyMonitor.query.join(EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id).filter(
+                EnergyMonitor.factory_id == factory_id, EnergyMeter.energy_type == energy_type,
+                EnergyMonitor.collect_time >= start_time, EnergyMonitor.collect_time < end_time
+            ).all()
+
+        cases = {
+            "取厂区全部读数": (orm_rows, lambda: read_archive(
+                sorted(archive_store.archived_days()), start_time, end_time, factory_id=factory_id, energy_type=energy_type)),
+            "峰谷日汇总 query_period_sums": (lambda: query_period_sums(energy_type, factory_id, first_day, last_day),) * 2,
+            "厂区能耗曲线 LTTB": (lambda: get_timeseries(start_time, end_time, 500, "lttb", factory_id=factory_id),) * 2,
+        }
+        root = archive_store.root
+        for name, (db_fn, archive_fn) in cases.items():
+            archive_store.root = None  # 不启用归档时全部查询数据库
+            db_ms = measure(db_fn, args.repeat)
+            archive_store.root = root
+            archive_ms = measure(archive_fn, args.repeat)
+            print(f"{name:<28} 数据库 {db_ms:>10.2f}ms  归档 {archive_ms:>10.2f}ms  ({db_ms / archive_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+厂区能耗排名性能测试：直接生成 N 厂区 × K 天的峰谷日报表与月报表（不生成监测数据），对比
+- 原实现方式：日报表按天与平均值子查询关联（只能查单日）
+- 不走月表：整个区间读日报表分组求和
+- rank_factories：完整月份读月表、零散日期读日表，一次分组查询后数组排名（冷缓存 / 热缓存）
+运行方式（在 backend 目录下）：python -m benchmarks.bench_ranking --factories 2000 --days 365
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+import numpy as np
+from config import Config
+
+ENERGY_TYPES = ("水", "蒸汽", "天然气")
+
+
+def generate_rollups(n_factories: int, days: int, n_types: int, start_date: date, seed: int = 42) -> int:
+    """生成日报表和对应的月报表（在应用上下文中调用）"""
+    from sqlalchemy import insert
+    from database import db
+    from models import PeakValleyEnergy, PeakValleyMonthly
+    rng = np.random.default_rng(seed)
+    # 每个厂区的能耗规模不同，便于排名有区分度
+    scale = rng.lognormal(0, 0.6, (n_factories, n_types)) * 1000
+    monthly = {}
+    count = 0
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        parts = rng.dirichlet((2, 4, 3, 3), (n_factories, n_types)) * scale[..., None] * rng.uniform(0.8, 1.2, (n_factories, n_types, 1))
+        cost = parts @ np.array([Config.PEAK_VALLEY_PRICES[p] for p in ("peak", "high", "flat", "valley")])
+        rows = []
+        for f in range(n_factories):
+            for t in range(n_types):
+                peak, high, flat, valley = (round(float(v), 2) for v in parts[f, t])
+                total = round(peak + high + flat + valley, 2)
+                rows.append({
+                    "record_id": f"PV{count:012d}", "energy_type": ENERGY_TYPES[t], "factory_id": f"BF{f:05d}",
+                    "stat_date": day, "peak_energy": peak, "high_energy": high, "flat_energy": flat, "valley_energy": valley,
+                    "total_energy": total, "peak_valley_price": round(float(cost[f, t]) / total, 4), "energy_cost": round(float(cost[f, t]), 2),
+                })
+                sums = monthly.setdefault((f"BF{f:05d}", ENERGY_TYPES[t], day.replace(day=1)), np.zeros(6))
+                sums += (peak, high, flat, valley, total, cost[f, t])
+                count += 1
+        db.session.execute(insert(PeakValleyEnergy), rows)
+    db.session.execute(insert(PeakValleyMonthly), [{
+        "factory_id": f, "energy_type": e, "stat_month": m, "peak_energy": s[0], "high_energy": s[1], "flat_energy": s[2],
+        "valley_energy": s[3], "total_energy": s[4], "energy_cost": s[5],
+    } for (f, e, m), s in monthly.items()])
+    db.session.commit()
+    return count
+
+
+def legacy_high_consumption(stat_date: date, threshold: float = 30) -> list:
+    """原实现：日报表与当天各能源类型平均值子查询关联"""
+    from sqlalchemy import func, and_
+    from database import db
+    from models import PeakValleyEnergy
+    avg_subquery = db.session.query(
+        PeakValleyEnergy.energy_type, func.avg(PeakValleyEnergy.total_energy).label("avg_energy")
+    ).filter(PeakValleyEnergy.stat_date == stat_date).group_by(PeakValleyEnergy.energy_type).subquery()
+    rows = db.session.query(PeakValleyEnergy, avg_subquery.c.avg_energy).join(
+        avg_subquery, PeakValleyEnergy.energy_type == avg_subquery.c.energy_type
+    ).filter(and_(
+        PeakValleyEnergy.stat_date == stat_date,
+        PeakValleyEnergy.total_energy > avg_subquery.c.avg_energy * (1 + threshold / 100)
+    )).all()
+    return [(item.factory_id, item.energy_type, item.total_energy, avg) for item, avg in rows]
+
+
+def daily_only_totals(start_date: date, end_date: date) -> list:
+    """不走月表：整个区间读日报表分组求和"""
+    from sqlalchemy import func
+    from database import db
+    from models import PeakValleyEnergy
+    return db.session.query(
+        PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type,
+        func.sum(PeakValleyEnergy.total_energy), func.sum(PeakValleyEnergy.energy_cost)
+    ).filter(PeakValleyEnergy.stat_date.between(start_date, end_date)).group_by(
+        PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type
+    ).all()
+
+
+def measure(fn, repeat: int, setup=None) -> float:
+    durations = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - started) * 1000)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="厂区能耗排名性能测试")
+    parser.add_argument("--db", help="数据库连接串（默认使用临时 SQLite 文件）")
+    parser.add_argument("--factories", type=int, default=2000, help="厂区数")
+    parser.add_argument("--days", type=int, default=365, help="天数")
+    parser.add_argument("--types", type=int, default=1, choices=(1, 2, 3), help="每个厂区的能源类型数")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    args = parser.parse_args()
+
+    if not args.db:
+        args.db = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="energy_bench_"), "ranking.db")
+    Config.SQLALCHEMY_DATABASE_URI = args.db
+    Config.SLOW_REQUEST_MS = None
+    from app import create_app
+    app = create_app(web=False)
+    from database import db
+    from services.ranking_service import rank_factories
+    from services.report_cache import report_cache
+
+    start_date = date(2025, 1, 1)
+    end_date = start_date + timedelta(days=args.days - 1)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        count = generate_rollups(args.factories, args.days, args.types, start_date)
+        print(f"生成日报表 {count:,} 条，耗时 {time.perf_counter() - started:.1f}s")
+
+        # 区间首尾各留半个月，使查询同时读月表和日表
+        range_start, range_end = start_date + timedelta(days=14), end_date - timedelta(days=14)
+        cases = {
+            "原实现（单日，关联平均值子查询）": (lambda: legacy_high_consumption(end_date), None),
+            "整个区间读日报表分组": (lambda: daily_only_totals(range_start, range_end), None),
+            "rank_factories 单日（冷缓存）": (lambda: rank_factories(end_date, end_date, threshold=30), report_cache.clear),
+            "rank_factories 全区间（冷缓存）": (lambda: rank_factories(range_start, range_end), report_cache.clear),
+            "rank_factories 全区间 p90 成本（冷缓存）": (
+                lambda: rank_factories(range_start, range_end, metric="cost", baseline="p90"), report_cache.clear),
+            "rank_factories 全区间（热缓存）": (lambda: rank_factories(range_start, range_end, page=3), None),
+        }
+        for name, (fn, setup) in cases.items():
+            print(f"{name:<40} 中位数 {measure(fn, args.repeat, setup):>10.2f}ms")
+        top = rank_factories(range_start, range_end, page_size=3)
+        print(f"前3名：{[(item['factory_id'], item['value'], item['exceed_rate']) for item in top['items']]}，"
+              f"共{top['total']}个厂区，基准 {top['baselines']}")
+
+
+if __name__ == "__main__":
+    main()
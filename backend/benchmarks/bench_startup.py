@@ -0,0 +1,90 @@
+"""
+启动耗时测试：每次在新的 Python 进程中分别统计
+- Web 进程：导入 app 模块、create_app()、第一个请求（监测数据列表）的耗时
+- 后台任务：导入 app 模块、create_app(web=False)、第一轮后台汇总（rollup_worker.run_once）的耗时
+同时记录已加载的模块数，便于发现新增的全局导入
+运行方式（在 backend 目录下）：python -m benchmarks.bench_startup --repeat 10 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# 子进程代码：计时从解释器启动后的第一条导入开始（不含解释器自身启动）
+_PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+from config import Config
+Config.SQLALCHEMY_DATABASE_URI = sys.argv[1]
+Config.SLOW_REQUEST_MS = None
+import app as app_module
+imported = time.perf_counter()
+mode = sys.argv[2]
+if mode == "setup":
+    app = app_module.create_app(web=False)
+    with app.app_context():
+        from migrations import upgrade_schema
+        from commands import seed_demo_data
+        upgrade_schema()
+        seed_demo_data()
+    sys.exit(0)
+app = app_module.create_app(web=mode == "web")
+created = time.perf_counter()
+if mode == "web":
+    response = app.test_client().get("/energy/api/monitor/list?page=1")
+    assert response.status_code == 200, response.status_code
+else:
+    with app.app_context():
+        from services.rollup_worker import rollup_worker
+        rollup_worker.run_once()
+finished = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_ms": (created - imported) * 1000,
+    "first_ms": (finished - created) * 1000,
+    "total_ms": (finished - started) * 1000,
+    "modules": len(sys.modules),
+}))
+"""
+
+MODES = {"web": "Web 进程（第一个请求）", "worker": "后台任务（第一轮汇总）"}
+FIELDS = ("import_ms", "create_ms", "first_ms", "total_ms", "modules")
+
+
+def run_probe(database_uri: str, mode: str) -> dict:
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE, database_uri, mode], cwd=backend_dir, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1]) if mode != "setup" else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="应用启动耗时测试")
+    parser.add_argument("--db", help="数据库连接串（默认使用临时 SQLite 文件）")
+    parser.add_argument("--repeat", type=int, default=10, help="每种进程启动的次数")
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    if not args.db:
+        args.db = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="energy_bench_"), "startup.db")
+    run_probe(args.db, "setup")
+
+    report = {}
+    for mode, name in MODES.items():
+        samples = [run_probe(args.db, mode) for _ in range(args.repeat)]
+        report[mode] = {field: round(statistics.median(s[field] for s in samples), 2) for field in FIELDS}
+        item = report[mode]
+        print(f"{name:<20} 导入 {item['import_ms']:>8.1f}ms  创建应用 {item['create_ms']:>8.1f}ms  "
+              f"首次执行 {item['first_ms']:>8.1f}ms  合计 {item['total_ms']:>8.1f}ms  模块 {int(item['modules'])}个")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
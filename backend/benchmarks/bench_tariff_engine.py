@@ -0,0 +1,110 @@
+"""
+峰谷时段汇总性能对比：
+- 逐条判断（原 get_period_type 的 if/elif 写法）vs 查找表 + numpy 批量汇总
+- 跨越多次电价调整的一年数据：按天逐日查找版本后汇总 vs TariffTimeline 一次数组运算
+运行方式（在 backend 目录下）：python -m benchmarks.bench_tariff_engine --rows 2000000
+"""
+import argparse
+import time as timer
+from datetime import date, datetime, time
+import numpy as np
+from utils.tariff_engine import get_tariff_engine, compile_tariff, TariffTimeline
+
+
+def legacy_period_type(collect_time: datetime) -> str:
+    """原实现：构造 time 对象后逐段比较"""
+    current_time = time(collect_time.hour, collect_time.minute)
+    if (time(10, 0) <= current_time < time(12, 0)) or (time(16, 0) <= current_time < time(18, 0)):
+        return "peak"
+    elif (time(8, 0) <= current_time < time(10, 0)) or (time(12, 0) <= current_time < time(16, 0)) or (time(18, 0) <= current_time < time(22, 0)):
+        return "high"
+    elif (time(6, 0) <= current_time < time(8, 0)) or (time(22, 0) <= current_time <= time(23, 59)):
+        return "flat"
+    else:
+        return "valley"
+
+
+def legacy_aggregate(times: list, values: list) -> dict:
+    sums = {"peak": 0, "high": 0, "flat": 0, "valley": 0}
+    for collect_time, value in zip(times, values):
+        sums[legacy_period_type(collect_time)] += value
+    return sums
+
+
+def main():
+    parser = argparse.ArgumentParser(description="峰谷时段汇总性能对比")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="一天内的读数条数")
+    parser.add_argument("--legacy-rows", type=int, default=200_000, help="逐条判断方式参与计时的条数（按比例折算）")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    day = np.datetime64("2025-01-01T00:00:00", "s")
+    timestamps = day + rng.integers(0, 86400, args.rows).astype("timedelta64[s]")
+    values = rng.uniform(0, 500, args.rows)
+    engine = get_tariff_engine()
+
+    start = timer.perf_counter()
+    result = engine.aggregate(timestamps, values)
+    vector_elapsed = timer.perf_counter() - start
+
+    legacy_rows = min(args.legacy_rows, args.rows)
+    legacy_times = timestamps[:legacy_rows].astype(datetime).tolist()
+    legacy_values = values[:legacy_rows].tolist()
+    start = timer.perf_counter()
+    legacy = legacy_aggregate(legacy_times, legacy_values)
+    legacy_elapsed = (timer.perf_counter() - start) * args.rows / legacy_rows
+
+    # 在相同样本上校验两种方式结果一致
+    check = engine.aggregate(timestamps[:legacy_rows], values[:legacy_rows])
+    for name, value in legacy.items():
+        assert abs(check[name] - value) < 1e-6 * max(1.0, abs(value)), f"{name} 时段汇总结果不一致"
+
+    print(f"读数条数：{args.rows:,}，总能耗：{result['total']:,.2f}，总成本：{result['cost']:,.2f}")
+    print(f"逐条判断（按 {legacy_rows:,} 条折算）：{legacy_elapsed:.3f}s")
+    print(f"查找表批量汇总：{vector_elapsed:.3f}s，提速 {legacy_elapsed / vector_elapsed:,.1f} 倍")
+    bench_timeline(rng, args.rows)
+
+
+def bench_timeline(rng, rows: int) -> None:
+    """一年内每月调整一次电价：逐日分组后按当天版本汇总 vs 二维查找表一次汇总"""
+    config = get_tariff_engine()
+    versions = [(date(2025, month, 1), compile_tariff(config.periods, {
+        name: float(price) * (1 + month / 100) for name, price in zip(("peak", "high", "flat", "valley"), config.prices)
+    })) for month in range(1, 13)]
+    timeline = TariffTimeline(versions)
+    start = np.datetime64("2025-01-01T00:00:00", "s")
+    timestamps = np.sort(start + rng.integers(0, 365 * 86400, rows).astype("timedelta64[s]"))
+    values = rng.uniform(0, 500, rows)
+
+    begin = timer.perf_counter()
+    days = timestamps.astype("datetime64[D]")
+    bounds = np.flatnonzero(np.diff(days.astype(np.int64))) + 1
+    cost = 0.0
+    for day_times, day_values in zip(np.split(timestamps, bounds), np.split(values, bounds)):
+        engine = timeline.engine_on(day_times[0].astype("datetime64[D]").astype(date))
+        cost += engine.aggregate(day_times, day_values)["cost"]
+    per_day_elapsed = timer.perf_counter() - begin
+
+    # 逐条查找当天版本再判断时段（按样本折算）
+    sample = min(rows, 200_000)
+    sample_times = timestamps[:sample].astype(datetime).tolist()
+    sample_values = values[:sample].tolist()
+    begin = timer.perf_counter()
+    row_cost = 0.0
+    for collect_time, value in zip(sample_times, sample_values):
+        engine = timeline.engine_on(collect_time.date())
+        row_cost += value * engine.price_table[collect_time.hour * 60 + collect_time.minute]
+    per_row_elapsed = (timer.perf_counter() - begin) * rows / sample
+
+    begin = timer.perf_counter()
+    result = timeline.aggregate(timestamps, values)
+    timeline_elapsed = timer.perf_counter() - begin
+    assert abs(result["cost"] - cost) < 1e-6 * abs(cost), "跨版本成本汇总结果不一致"
+    check = timeline.aggregate(timestamps[:sample], values[:sample])["cost"]
+    assert abs(check - row_cost) < 1e-6 * abs(row_cost), "逐条计算与数组汇总结果不一致"
+    print(f"一年{len(versions)}个电价版本，{rows:,}条读数：逐条查找版本 {per_row_elapsed:.3f}s，"
+          f"逐日分组汇总 {per_day_elapsed:.3f}s，TariffTimeline 一次汇总 {timeline_elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+命令行命令（flask --app app <命令>）：建库与演示数据、结构升级、汇总重建与重算、分区与归档、后台汇总、索引检查
+各命令执行时才导入所需的服务模块，不影响应用启动和其他命令
+"""
+from datetime import datetime
+import os
+import time
+import click
+from flask.cli import with_appcontext
+from database import db
+
+
+def seed_demo_data() -> bool:
+    """写入演示用的厂区、设备和监测数据（已有厂区时跳过），按监测数据生成峰谷报表，返回是否写入"""
+    from models import FactoryArea, EnergyMeter
+    from services.energy_service import EnergyService
+    from services.rollup_service import recompute_peak_valley
+    # 检查是否已有数据
+    if FactoryArea.query.first():
+        return False
+
+    # 1. 创建厂区
+    f1 = FactoryArea(factory_id="F001", factory_name="真旺厂", address="北京市海淀区", manager="张三")
+    f2 = FactoryArea(factory_id="F002", factory_name="豆果厂", address="北京市朝阳区", manager="李四")
+    db.session.add_all([f1, f2])
+    db.session.commit()
+    
+    # 2. 创建设备
+    m1 = EnergyMeter(
+        meter_id="M_WATER_01", factory_id="F001", energy_type="水", 
+        install_location="污水处理站", pipe_spec="DN100", comm_protocol="RS485", 
+        calib_cycle=12, manufacturer="西门子"
+    )
+    m2 = EnergyMeter(
+        meter_id="M_ELEC_01", factory_id="F001", energy_type="天然气", 
+        install_location="锅炉房", pipe_spec="DN50", comm_protocol="Lora", 
+        run_status="故障", calib_cycle=24, manufacturer="施耐德"
+    )
+    db.session.add_all([m1, m2])
+    db.session.commit()
+    
+    # 3. 创建监测数据（与接口写入走同一路径，同时更新小时汇总和峰谷报表）
+    now = datetime.now().replace(microsecond=0)
+    rows = [
+        {"data_id": "D001", "meter_id": "M_WATER_01", "collect_time": now, "energy_value": 120.5, "unit": "m³",
+         "data_quality": "优", "factory_id": "F001", "is_verified": True},
+        {"data_id": "D002", "meter_id": "M_ELEC_01", "collect_time": now, "energy_value": 50.2, "unit": "m³",
+         "data_quality": "差", "factory_id": "F001", "is_verified": False},
+    ]
+    EnergyService.write_monitor_rows(rows)
+    
+    # 4. 按监测数据重算当天的峰谷报表（延迟汇总模式下写入时只登记待重算的键）
+    for energy_type in ("水", "天然气"):
+        recompute_peak_valley(energy_type, "F001", now.date(), now.date())
+    db.session.commit()
+    return True
+
+
+@click.command("init-db")
+@click.option("--demo", is_flag=True, help="数据库为空时写入演示数据")
+@with_appcontext
+def init_db_command(demo):
+    """建表（已有数据库时补建新增的表、列和索引），可选写入演示数据；首次部署前执行一次"""
+    from migrations import upgrade_schema, backfill_rollup_tables
+    for action in upgrade_schema():
+        print(action)
+    if demo:
+        if seed_demo_data():
+            # 补齐写入路径未覆盖的汇总表（如月度汇总）
+            backfill_rollup_tables()
+            print("演示数据初始化完成！")
+        else:
+            print("已有厂区数据，跳过演示数据")
+    print("数据库初始化完成！")
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db_command():
+    """为已有数据库补建新增的表和索引，并按明细重算旧版本生成的峰谷报表"""
+    from migrations import upgrade_schema
+    actions = upgrade_schema()
+    for action in actions:
+        print(action)
+    print("数据库结构已是最新！" if not actions else f"数据库升级完成，共执行{len(actions)}项操作！")
+
+
+@click.command("rebuild-rollups")
+@click.option("--start", "start_date", required=True, type=click.DateTime(["%Y-%m-%d"]), help="开始日期")
+@click.option("--end", "end_date", required=True, type=click.DateTime(["%Y-%m-%d"]), help="结束日期")
+@click.option("--factory", "factory_id", default=None, help="只重建指定厂区")
+@with_appcontext
+def rebuild_rollups_command(start_date, end_date, factory_id):
+    """按日期区间重建小时汇总和月度汇总"""
+    from migrations import rebuild_rollups
+    hourly, monthly = rebuild_rollups(start_date.date(), end_date.date(), factory_id)
+    print(f"重建完成：小时汇总{hourly}条，月度汇总{monthly}条！")
+
+
+@click.command("backfill-rollups")
+@click.option("--start", "start_date", required=True, type=click.DateTime(["%Y-%m-%d"]), help="开始日期")
+@click.option("--end", "end_date", required=True, type=click.DateTime(["%Y-%m-%d"]), help="结束日期")
+@click.option("--factory", "factory_id", default=None, help="只重算指定厂区")
+@click.option("--energy-type", default=None, type=click.Choice(["水", "蒸汽", "天然气"]), help="只重算指定能源类型")
+@click.option("--workers", default=None, type=click.IntRange(1), help="并行进程数（默认CPU核数）")
+@click.option("--state", "state_path", default="backfill_state.json", help="断点续算状态文件")
+@click.option("--restart", is_flag=True, help="忽略状态文件，从头重算")
+@with_appcontext
+def backfill_rollups_command(start_date, end_date, factory_id, energy_type, workers, state_path, restart):
+    """按厂区、能源类型、月份并行重算峰谷报表（中断后以相同参数重新执行可继续）"""
+    from services.backfill_service import run_backfill
+    if restart and os.path.exists(state_path):
+        os.remove(state_path)
+    summary = run_backfill(start_date.date(), end_date.date(), factory_id, energy_type, workers, state_path)
+    print(f"重算完成：任务块{summary['chunks']}个（跳过{summary['skipped']}个），新增{summary['created']}天，"
+          f"覆盖{summary['replaced']}天，删除{summary['removed']}天，耗时{summary['seconds']}s！")
+
+
+@click.command("partition-db")
+@click.option("--months-ahead", default=None, type=click.IntRange(0), help="预先建好的后续月份分区数")
+@with_appcontext
+def partition_db_command(months_ahead):
+    """把监测数据表转为按月分区（仅 MySQL，已分区时补建后续月份）"""
+    from services.partition_service import supports_native_partitions, partition_table, list_partitions
+    if not supports_native_partitions():
+        print("当前数据库不支持原生分区，过期数据将按月份范围分批删除")
+    for action in partition_table(months_ahead):
+        print(action)
+    for partition in list_partitions():
+        print(f"{partition['name']}\t{partition['rows']}")
+
+
+@click.command("apply-retention")
+@click.option("--days", "retention_days", default=None, type=click.IntRange(1), help="原始数据保留天数（默认 MONITOR_RETENTION_DAYS）")
+@click.option("--dry-run", is_flag=True, help="只列出将要压缩的月份")
+@with_appcontext
+def apply_retention_command(retention_days, dry_run):
+    """把早于保留期的整月监测数据压缩为小时汇总，并整月删除原始数据"""
+    from services.partition_service import apply_retention
+    try:
+        summary = apply_retention(retention_days, dry_run)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if dry_run:
+        print(f"保留 {summary['cutoff']} 及之后的数据，将压缩的月份：{', '.join(summary['months']) or '无'}")
+        return
+    print(f"压缩完成：{len(summary['months'])}个月，删除原始数据{summary['readings']}条，生成小时汇总{summary['hourly']}条！")
+
+
+@click.command("archive-days")
+@click.option("--start", "start_date", required=True, type=click.DateTime(["%Y-%m-%d"]), help="开始日期")
+@click.option("--end", "end_date", required=True, type=click.DateTime(["%Y-%m-%d"]), help="结束日期（最晚到昨天）")
+@click.option("--overwrite", is_flag=True, help="重新导出已归档的日期")
+@with_appcontext
+def archive_days_command(start_date, end_date, overwrite):
+    """把已结束日期的监测数据导出为列式归档文件（ARCHIVE_DIR）"""
+    from services.archive_service import archive_days
+    try:
+        summary = archive_days(start_date.date(), end_date.date(), overwrite)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print(f"归档完成：导出{summary['days']}天（跳过已归档{summary['skipped']}天），共{summary['readings']}条！")
+
+
+@click.command("run-rollups")
+@click.option("--once", is_flag=True, help="处理完当前已到期的键后退出")
+@with_appcontext
+def run_rollups_command(once):
+    """重算延迟汇总模式下登记的峰谷日报表键（可与应用进程、其他任务同时运行）"""
+    from services.rollup_worker import rollup_worker
+    while True:
+        summary = rollup_worker.run_pending()
+        if summary["claimed"] or once:
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} 重算{summary['recomputed']}个（最终重算{summary['closed']}个），"
+                  f"冲突{summary['conflicts']}个")
+        if once:
+            return
+        time.sleep(rollup_worker.interval)
+
+
+@click.command("check-indexes")
+@with_appcontext
+def check_indexes_command():
+    """用 EXPLAIN 检查主要查询是否命中索引"""
+    from migrations import check_index_usage
+    failed = 0
+    for name, index_name, used, plan in check_index_usage():
+        failed += not used
+        print(f"[{'OK' if used else 'MISS'}] {name}（{index_name}）：{plan}")
+    if failed:
+        raise SystemExit(f"{failed}个查询未命中预期索引，请先执行 flask --app app upgrade-db")
+
+
+COMMANDS = (
+    init_db_command,
+    upgrade_db_command,
+    rebuild_rollups_command,
+    backfill_rollups_command,
+    partition_db_command,
+    apply_retention_command,
+    archive_days_command,
+    run_rollups_command,
+    check_indexes_command,
+)
+
+
+def register_commands(app) -> None:
+    """把全部命令注册到应用"""
+    for command in COMMANDS:
+        app.cli.add_command(command)
@@ -1,4 +1,112 @@
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, event
+from sqlalchemy.engine import Engine
+from config import Config
+
+# 只读副本在 SQLALCHEMY_BINDS 中的名称
+REPLICA_BIND = "replica"
+_WROTE = "routing_session_wrote"
+
+# 当前上下文是否把只读查询发往副本、当前上下文的语句超时（毫秒）
+_use_replica = ContextVar("use_replica", default=False)
+_statement_timeout = ContextVar("statement_timeout", default=None)
+
+
+class RoutingSession(Session):
+    """
+    在 read_replica() 范围内把只读查询（SELECT）发往只读副本，写入和 flush 仍走主库
+    - 本事务已有写入时读也走主库，保证读到自己刚写的数据
+    - SELECT ... FOR UPDATE 走主库
+    - 未配置副本时全部走主库
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and _use_replica.get() and not self._flushing and not self.info.get(_WROTE)
+                and isinstance(clause, Select) and clause._for_update_arg is None):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _mark_wrote(session, flush_context):
+    session.info[_WROTE] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _clear_after_commit(session):
+    session.info.pop(_WROTE, None)
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _clear_after_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_WROTE, None)
+
 
 # 初始化 SQLAlchemy，但不绑定 app，稍后在 app.py 中绑定
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+@contextmanager
+def read_replica(timeout_ms: float = None):
+    """
+    范围内的只读查询走只读副本（副本数据可能略有延迟，只用于报表、列表等可接受延迟的查询）
+    :param timeout_ms: 范围内语句的超时（毫秒），默认 Config.REPORT_STATEMENT_TIMEOUT_MS
+    """
+    replica_token = _use_replica.set(True)
+    timeout_token = _statement_timeout.set(timeout_ms or Config.REPORT_STATEMENT_TIMEOUT_MS or _statement_timeout.get())
+    try:
+        yield
+    finally:
+        _statement_timeout.reset(timeout_token)
+        _use_replica.reset(replica_token)
+
+
+def replica_reads(func):
+    """装饰器：函数内的只读查询走只读副本"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with read_replica():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def statement_timeout(timeout_ms: float):
+    """范围内每条语句的执行超时（毫秒），覆盖 Config.DB_STATEMENT_TIMEOUT_MS"""
+    token = _statement_timeout.set(timeout_ms)
+    try:
+        yield
+    finally:
+        _statement_timeout.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _apply_statement_timeout(conn, cursor, statement, parameters, context, executemany):
+    # 超时设置保存在连接上，只有与上次不同时才重新设置
+    timeout = _statement_timeout.get() or Config.DB_STATEMENT_TIMEOUT_MS
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        # SQLite 没有语句超时，用进度回调在超过截止时间后中断（抛出 OperationalError: interrupted）
+        if timeout:
+            deadline = time.perf_counter() + timeout / 1000
+            conn.connection.driver_connection.set_progress_handler(lambda: time.perf_counter() > deadline, 1000)
+            conn.info["statement_timeout"] = timeout
+        elif conn.info.pop("statement_timeout", None):
+            conn.connection.driver_connection.set_progress_handler(None, 0)
+        return
+    if conn.info.get("statement_timeout") == timeout:
+        return
+    if dialect == "mysql":
+        # 只对 SELECT 生效，0 表示不限
+        cursor.execute(f"SET SESSION max_execution_time = {int(timeout or 0)}")
+    elif dialect == "postgresql":
+        cursor.execute(f"SET statement_timeout = {int(timeout or 0)}")
+    conn.info["statement_timeout"] = timeout
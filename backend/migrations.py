@@ -0,0 +1,230 @@
+"""
+数据库结构升级与索引检查
+- upgrade_schema：为已有数据库补建新增的表、可空列和索引，按明细重算旧版本生成的峰谷报表，并回填空的汇总表（重复执行无副作用）
+- rebuild_rollups：按日期区间重建小时汇总与月度汇总
+- check_index_usage：调用主要查询的服务方法，对实际执行的 SQL 执行 EXPLAIN，确认命中了预期索引
+"""
+from datetime import date, datetime
+from sqlalchemy import event, inspect, func, text
+from sqlalchemy.engine import Engine
+from database import db
+from models import EnergyMeter, EnergyMonitor, PeakValleyEnergy, EnergyHourly, PeakValleyMonthly, RegistryVersion
+from services.rollup_service import backfill_peak_valley, recompute_peak_valley
+from services.rollup_hierarchy import rebuild_hourly, rebuild_monthly
+
+
+def dedupe_peak_valley() -> int:
+    """
+    合并重复的峰谷报表（旧版本每个键可能生成多条），为唯一索引让路
+    每个（厂区, 能源类型, 日期）只保留最新一条，随后按明细数据重算
+    :return: 删除的记录数
+    """
+    duplicates = db.session.query(
+        PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type, PeakValleyEnergy.stat_date
+    ).group_by(
+        PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type, PeakValleyEnergy.stat_date
+    ).having(func.count() > 1).all()
+    removed = 0
+    for factory_id, energy_type, stat_date in duplicates:
+        records = PeakValleyEnergy.query.filter_by(
+            factory_id=factory_id, energy_type=energy_type, stat_date=stat_date
+        ).order_by(PeakValleyEnergy.create_time.desc()).all()
+        for record in records[1:]:
+            db.session.delete(record)
+            removed += 1
+        db.session.flush()
+        backfill_peak_valley(energy_type, factory_id, stat_date, stat_date, replace=True)
+    db.session.commit()
+    return removed
+
+
+# 峰谷报表的计算版本：每次写入都在已有日报上累加增量，旧版本整批重算留下的错误结果须先按明细重算一次
+PEAK_VALLEY_VERSION_NAME = "peak_valley_rollup"
+PEAK_VALLEY_VERSION = 1
+
+
+def recompute_legacy_peak_valley() -> list:
+    """
+    按明细数据重算旧版本生成的峰谷报表（覆盖全部厂区、能源类型在明细或报表中出现过的日期范围）
+    完成后在 registry_version 中记录计算版本，重复执行时跳过；新建的数据库没有报表，直接记录版本
+    :return: 执行过的操作说明列表
+    """
+    marker = db.session.get(RegistryVersion, PEAK_VALLEY_VERSION_NAME)
+    if marker is not None and marker.version >= PEAK_VALLEY_VERSION:
+        return []
+    ranges = {}
+    monitor_ranges = db.session.query(
+        EnergyMonitor.factory_id, EnergyMeter.energy_type,
+        func.min(EnergyMonitor.collect_time), func.max(EnergyMonitor.collect_time)
+    ).join(EnergyMeter, EnergyMeter.meter_id == EnergyMonitor.meter_id).group_by(
+        EnergyMonitor.factory_id, EnergyMeter.energy_type
+    ).all()
+    for factory_id, energy_type, first, last in monitor_ranges:
+        ranges[(factory_id, energy_type)] = (first.date(), last.date())
+    report_ranges = db.session.query(
+        PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type,
+        func.min(PeakValleyEnergy.stat_date), func.max(PeakValleyEnergy.stat_date)
+    ).group_by(PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type).all()
+    for factory_id, energy_type, first, last in report_ranges:
+        known = ranges.get((factory_id, energy_type))
+        ranges[(factory_id, energy_type)] = (min(first, known[0]), max(last, known[1])) if known else (first, last)
+
+    actions = []
+    for (factory_id, energy_type), (start_date, end_date) in sorted(ranges.items()):
+        counts = recompute_peak_valley(energy_type, factory_id, start_date, end_date)
+        db.session.commit()
+        actions.append(
+            f"重算峰谷报表 {factory_id}/{energy_type} {start_date}~{end_date}："
+            f"新增{counts['created']}天，覆盖{counts['replaced']}天，删除{counts['removed']}天"
+        )
+    if marker is None:
+        marker = RegistryVersion(name=PEAK_VALLEY_VERSION_NAME, version=0)
+        db.session.add(marker)
+    marker.version = PEAK_VALLEY_VERSION
+    db.session.commit()
+    return actions
+
+
+def rebuild_rollups(start_date: date, end_date: date, factory_id: str = None) -> tuple[int, int]:
+    """
+    按日期区间重建小时汇总（来自监测数据）与月度汇总（来自每日峰谷报表）并提交
+    :return: (小时记录数, 月度记录数)
+    """
+    hourly = rebuild_hourly(start_date, end_date, factory_id)
+    monthly = rebuild_monthly(start_date, end_date, factory_id)
+    db.session.commit()
+    return hourly, monthly
+
+
+def backfill_rollup_tables() -> list:
+    """汇总表为空而源数据不为空时（刚建表或由 create_all 建出空表），按源数据的完整时间范围回填"""
+    actions = []
+    if not db.session.query(EnergyHourly.meter_id).first():
+        first, last = db.session.query(func.min(EnergyMonitor.collect_time), func.max(EnergyMonitor.collect_time)).one()
+        if first:
+            written = rebuild_hourly(first.date(), last.date())
+            actions.append(f"回填小时汇总 {written} 条")
+    if not db.session.query(PeakValleyMonthly.factory_id).first():
+        first, last = db.session.query(func.min(PeakValleyEnergy.stat_date), func.max(PeakValleyEnergy.stat_date)).one()
+        if first:
+            written = rebuild_monthly(first, last)
+            actions.append(f"回填月度汇总 {written} 条")
+    db.session.commit()
+    return actions
+
+
+def upgrade_schema() -> list:
+    """
+    补建缺失的表、可空列和索引
+    :return: 执行过的操作说明列表
+    """
+    actions = []
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    missing_tables = [t for t in db.metadata.sorted_tables if t.name not in existing_tables]
+    if missing_tables:
+        db.metadata.create_all(db.engine, tables=missing_tables)
+        actions.extend(f"创建表 {t.name}" for t in missing_tables)
+
+    for table in db.metadata.sorted_tables:
+        if table in missing_tables:
+            continue
+        # 补建新增的可空列
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            actions.append(f"添加列 {table.name}.{column.name}")
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing_indexes:
+                continue
+            if table.name == PeakValleyEnergy.__tablename__ and index.unique:
+                removed = dedupe_peak_valley()
+                if removed:
+                    actions.append(f"合并重复峰谷报表 {removed} 条")
+            index.create(db.engine)
+            actions.append(f"创建索引 {table.name}.{index.name}")
+    actions.extend(recompute_legacy_peak_valley())
+    actions.extend(backfill_rollup_tables())
+    return actions
+
+
+def _explain(engine, statement: str, parameters) -> str:
+    """对一条已执行的语句（原样带参数）执行 EXPLAIN，把执行计划拼成一行文本"""
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+            return " | ".join(str(row[-1]) for row in rows)
+        rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters).mappings().all()
+    # 分区表同时列出实际扫描的分区，便于确认分区裁剪生效
+    return " | ".join(
+        f"{row.get('table')}{'[' + row['partitions'] + ']' if row.get('partitions') else ''}:{row.get('key')}" for row in rows
+    )
+
+
+def captured_selects(call) -> list:
+    """
+    执行 call()，记录其间执行的 SELECT 语句（含只读副本上的）
+    :return: [(引擎, SQL, 参数)]
+    """
+    captured = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((conn.engine, statement, parameters))
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        call()
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+    return captured
+
+
+def index_usage_checks() -> list:
+    """
+    主要查询及其预期索引：直接调用服务方法，检查的是应用实际执行的 SQL
+    :return: [(查询名称, 数据表, 预期索引, 调用)]
+    """
+    from services.energy_service import EnergyService
+    from services.rollup_service import query_period_sums
+    from utils.common_utils import encode_cursor
+    today = date.today()
+    cursor = encode_cursor(datetime.combine(today, datetime.min.time()), "~")
+    monitor, peak_valley = EnergyMonitor.__tablename__, PeakValleyEnergy.__tablename__
+    return [
+        ("监测数据列表按厂区分页", monitor, "idx_monitor_factory_time",
+         lambda: EnergyService.get_monitor_page({"factory_id": "F001"})),
+        ("监测数据列表按设备翻页", monitor, "idx_monitor_meter_time",
+         lambda: EnergyService.get_monitor_page({"meter_id": "M001"}, cursor=cursor)),
+        ("监测数据列表按时间分页", monitor, "idx_monitor_time",
+         lambda: EnergyService.get_monitor_page({})),
+        ("峰谷日汇总", monitor, "idx_monitor_factory_time",
+         lambda: query_period_sums("水", "F001", today, today)),
+        ("峰谷报表按厂区查询", peak_valley, "uq_peak_valley_factory_type_date",
+         lambda: EnergyService.get_peak_valley_daily("F001", today, "水")),
+        ("峰谷报表按日期汇总", peak_valley, "idx_peak_valley_date_type",
+         lambda: EnergyService.get_high_consumption_factories(today)),
+    ]
+
+
+def check_index_usage() -> list:
+    """
+    调用监测列表、峰谷统计、报表查询的服务方法，对其中访问目标表的语句执行 EXPLAIN，检查是否都命中预期索引
+    :return: [(查询名称, 预期索引, 是否命中, 执行计划)]
+    """
+    from services.report_cache import report_cache
+    report_cache.clear()  # 命中缓存时不会执行查询
+    results = []
+    for name, table, index_name, call in index_usage_checks():
+        plans = [
+            _explain(engine, statement, parameters)
+            for engine, statement, parameters in captured_selects(call) if table in statement
+        ]
+        used = bool(plans) and all(index_name in plan for plan in plans)
+        results.append((name, index_name, used, " || ".join(plans) or "未执行查询"))
+    return results
@@ -34,6 +34,12 @@ class EnergyMeter(db.Model):
 
 class EnergyMonitor(db.Model):
     __tablename__ = "energy_monitor"
+    # 列表按厂区/设备筛选并按时间排序，峰谷统计按厂区+时间范围扫描
+    __table_args__ = (
+        db.Index("idx_monitor_factory_time", "factory_id", "collect_time"),
+        db.Index("idx_monitor_meter_time", "meter_id", "collect_time"),
+        db.Index("idx_monitor_time", "collect_time"),
+    )
     data_id = db.Column(db.String(30), primary_key=True)
     meter_id = db.Column(db.String(20), db.ForeignKey("energy_meter.meter_id"), nullable=False)
     collect_time = db.Column(db.DateTime, nullable=False)
@@ -42,6 +48,7 @@ class EnergyMonitor(db.Model):
     data_quality = db.Column(db.Enum("优", "良", "中", "差"), default="良")
     factory_id = db.Column(db.String(20), nullable=False)
     is_verified = db.Column(db.Boolean, default=False)
+    anomaly_reason = db.Column(db.String(100), comment="异常检测判为可疑的原因")
     peak_valley = db.relationship("PeakValleyEnergy", backref="monitor_data", lazy=True, uselist=False)
 
     # 【新增】序列化方法
@@ -54,11 +61,17 @@ class EnergyMonitor(db.Model):
             "unit": self.unit,
             "data_quality": self.data_quality,
             "factory_id": self.factory_id,
-            "is_verified": self.is_verified
+            "is_verified": self.is_verified,
+            "anomaly_reason": self.anomaly_reason
         }
 
 class PeakValleyEnergy(db.Model):
     __tablename__ = "peak_valley_energy"
+    # 每个厂区、能源类型每天只有一条报表；高耗能排名按日期+能源类型汇总
+    __table_args__ = (
+        db.Index("uq_peak_valley_factory_type_date", "factory_id", "energy_type", "stat_date", unique=True),
+        db.Index("idx_peak_valley_date_type", "stat_date", "energy_type"),
+    )
     record_id = db.Column(db.String(30), primary_key=True)
     energy_type = db.Column(db.Enum("水", "蒸汽", "天然气"), nullable=False)
     factory_id = db.Column(db.String(20), nullable=False)
@@ -73,6 +86,57 @@ class PeakValleyEnergy(db.Model):
     create_time = db.Column(db.DateTime, default=datetime.now)
     monitor_data_id = db.Column(db.String(30), db.ForeignKey("energy_monitor.data_id"))
 
+class EnergyHourly(db.Model):
+    """设备小时汇总表（由监测数据维护，供长周期曲线查询）"""
+    __tablename__ = "energy_hourly"
+    __table_args__ = (
+        db.Index("idx_hourly_factory_hour", "factory_id", "hour_start"),
+    )
+    meter_id = db.Column(db.String(20), primary_key=True)
+    hour_start = db.Column(db.DateTime, primary_key=True, comment="整点时间")
+    factory_id = db.Column(db.String(20), nullable=False)
+    energy_type = db.Column(db.Enum("水", "蒸汽", "天然气"), nullable=False)
+    energy_sum = db.Column(db.Float, nullable=False, default=0)
+    min_value = db.Column(db.Float)
+    max_value = db.Column(db.Float)
+    reading_count = db.Column(db.Integer, nullable=False, default=0)
+
+class PeakValleyMonthly(db.Model):
+    """厂区月度峰谷汇总表（由每日峰谷报表维护，供月/年报表查询）"""
+    __tablename__ = "peak_valley_monthly"
+    factory_id = db.Column(db.String(20), primary_key=True)
+    energy_type = db.Column(db.Enum("水", "蒸汽", "天然气"), primary_key=True)
+    stat_month = db.Column(db.Date, primary_key=True, comment="统计月份（当月1日）")
+    peak_energy = db.Column(db.Float, default=0)
+    high_energy = db.Column(db.Float, default=0)
+    flat_energy = db.Column(db.Float, default=0)
+    valley_energy = db.Column(db.Float, default=0)
+    total_energy = db.Column(db.Float, nullable=False, default=0)
+    energy_cost = db.Column(db.Float, nullable=False, default=0)
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+class MonitorCompaction(db.Model):
+    """已压缩的监测数据月份（原始数据已删除或删除中，只保留小时汇总与峰谷报表）"""
+    __tablename__ = "monitor_compaction"
+    stat_month = db.Column(db.Date, primary_key=True, comment="压缩的月份（当月1日）")
+    reading_count = db.Column(db.Integer, nullable=False, default=0, comment="压缩时的原始数据条数")
+    hourly_count = db.Column(db.Integer, nullable=False, default=0, comment="生成的小时汇总条数")
+    compact_time = db.Column(db.DateTime, default=datetime.now)
+
+class RollupDirtyKey(db.Model):
+    """待重算的峰谷日报表键（延迟汇总模式下由写入监测数据时登记，后台汇总任务领取并重算）"""
+    __tablename__ = "rollup_dirty_key"
+    __table_args__ = (
+        db.Index("idx_rollup_dirty_due", "due_time"),
+    )
+    factory_id = db.Column(db.String(20), primary_key=True)
+    energy_type = db.Column(db.Enum("水", "蒸汽", "天然气"), primary_key=True)
+    stat_date = db.Column(db.Date, primary_key=True)
+    due_time = db.Column(db.DateTime, nullable=False, comment="最早重算时间")
+    version = db.Column(db.Integer, nullable=False, default=1, comment="登记次数，重算期间有新数据时与领取时不一致")
+    claimed_by = db.Column(db.String(100), comment="领取该键的汇总任务")
+    claim_until = db.Column(db.DateTime, comment="领取有效期，过期后其他任务可重新领取")
+
 class FactoryArea(db.Model):
     __tablename__ = "factory_area"
     factory_id = db.Column(db.String(20), primary_key=True)
@@ -80,4 +144,35 @@ class FactoryArea(db.Model):
     address = db.Column(db.String(200))
     manager = db.Column(db.String(50))
     create_time = db.Column(db.DateTime, default=datetime.now)
-    meters = db.relationship("EnergyMeter", backref="factory", lazy=True)
\ No newline at end of file
+    meters = db.relationship("EnergyMeter", backref="factory", lazy=True)
+
+class TariffSchedule(db.Model):
+    """峰谷电价方案（按能源类型、生效日期分版本；factory_id 为空表示适用于全部厂区）"""
+    __tablename__ = "tariff_schedule"
+    __table_args__ = (
+        db.UniqueConstraint("energy_type", "factory_id", "effective_date", name="uk_tariff_version"),
+    )
+    schedule_id = db.Column(db.String(30), primary_key=True)
+    energy_type = db.Column(db.Enum("水", "蒸汽", "天然气"), nullable=False, comment="能源类型")
+    factory_id = db.Column(db.String(20), comment="适用厂区，为空表示全部厂区")
+    effective_date = db.Column(db.Date, nullable=False, comment="生效日期")
+    periods = db.Column(db.JSON, nullable=False, comment="时段配置，格式同 Config.PEAK_VALLEY_PERIODS")
+    prices = db.Column(db.JSON, nullable=False, comment="各时段单价，格式同 Config.PEAK_VALLEY_PRICES")
+    create_time = db.Column(db.DateTime, default=datetime.now)
+
+    def to_dict(self):
+        return {
+            "schedule_id": self.schedule_id,
+            "energy_type": self.energy_type,
+            "factory_id": self.factory_id,
+            "effective_date": self.effective_date.strftime("%Y-%m-%d"),
+            "periods": self.periods,
+            "prices": self.prices
+        }
+
+class RegistryVersion(db.Model):
+    """进程内缓存的数据版本号（数据变更时加一，各进程据此判断本地缓存是否过期）"""
+    __tablename__ = "registry_version"
+    name = db.Column(db.String(30), primary_key=True, comment="缓存名称")
+    version = db.Column(db.Integer, nullable=False, default=0)
+    update_time = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
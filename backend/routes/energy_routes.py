@@ -1,8 +1,19 @@
-from flask import Blueprint, render_template, request, jsonify
-from database import db
-from models import EnergyMeter, EnergyMonitor, PeakValleyEnergy, FactoryArea
-from sqlalchemy import func
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context
+from database import db, replica_reads
+from models import EnergyMeter, FactoryArea
+from services.energy_service import EnergyService
+from services.report_cache import report_cache, get_report_totals, get_factory_ids
+from services.meter_registry import meter_registry
+from services.ingest_queue import ingest_queue, IngestBusyError
+from services.anomaly_detector import anomaly_detector
+from services.export_service import export_stream, EXPORT_FORMATS
+from services.timeseries_service import get_timeseries
+from utils.common_utils import generate_data_id, parse_datetime
+from config import Config
 from datetime import datetime
+import csv
+import io
+import json
 
 energy_bp = Blueprint('energy', __name__)
 
@@ -10,8 +21,15 @@ energy_bp = Blueprint('energy', __name__)
 def success_resp(msg="操作成功", data=None):
     return jsonify({"success": True, "message": msg, "data": data})
 
-def error_resp(msg="操作失败"):
-    return jsonify({"success": False, "message": msg})
+def error_resp(msg="操作失败", status=200):
+    return jsonify({"success": False, "message": msg}), status
+
+@energy_bp.errorhandler(IngestBusyError)
+def ingest_busy(e):
+    # 异步写入队列满（429）或后台写库异常（503），网关按 Retry-After 稍后重试
+    resp, status = error_resp(str(e), e.status_code)
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp, status
 
 # --- 1. 能耗计量设备管理 ---
 @energy_bp.route('/meter_manage')
@@ -32,33 +50,17 @@ def meter_manage():
 
 # --- 2. 能耗监测数据 ---
 @energy_bp.route('/monitor_data')
+@replica_reads
 def monitor_data():
     # 获取筛选参数
     meter_id = request.args.get('meter_id')
     factory_id = request.args.get('factory_id')
     quality = request.args.get('data_quality')
     start_time = request.args.get('start_time')
+    cursor = request.args.get('cursor')
     
-    # 查询所有厂区用于下拉框
-    factories = [f.factory_id for f in FactoryArea.query.all()]
-    
-    query = EnergyMonitor.query
-    if meter_id:
-        query = query.filter(EnergyMonitor.meter_id.like(f"%{meter_id}%"))
-    if factory_id:
-        query = query.filter_by(factory_id=factory_id)
-    if quality:
-        query = query.filter_by(data_quality=quality)
-    if start_time:
-        # 转换时间字符串
-        try:
-            dt = datetime.strptime(start_time, "%Y-%m-%dT%H:%M")
-            query = query.filter(EnergyMonitor.collect_time >= dt)
-        except:
-            pass
-            
-    # 按时间倒序
-    datas = query.order_by(EnergyMonitor.collect_time.desc()).all()
+    # 查询所有厂区用于下拉框（带缓存）
+    factories = get_factory_ids()
     
     # 回显参数
     filters = {
@@ -66,12 +68,22 @@ def monitor_data():
         "data_quality": quality, "start_time": start_time
     }
     
-    return render_template('monitor_data.html', monitor_datas=datas, factories=factories, filters=filters)
+    # 按时间倒序，游标分页（设备编号为模糊匹配）
+    query_filters = dict(filters, meter_id=None, meter_keyword=meter_id)
+    try:
+        datas, next_cursor = EnergyService.get_monitor_page(query_filters, cursor)
+    except ValueError:
+        # 时间或游标格式错误时忽略该条件
+        query_filters["start_time"] = None
+        datas, next_cursor = EnergyService.get_monitor_page(query_filters)
+    
+    return render_template('monitor_data.html', monitor_datas=datas, factories=factories, filters=filters,
+                           next_cursor=next_cursor, is_first_page=not cursor)
 
 # --- 3. 峰谷能耗报表 ---
 @energy_bp.route('/peak_valley')
 def peak_valley():
-    factories = [f.factory_id for f in FactoryArea.query.all()]
+    factories = get_factory_ids()
     today = datetime.now().strftime('%Y-%m-%d')
     return render_template('peak_valley.html', factories=factories, today_date=today)
 
@@ -128,39 +140,100 @@ def update_meter():
 
 @energy_bp.route('/api/meter/delete', methods=['POST'])
 def delete_meter():
+    # 连同监测数据一起删除（分批提交），并从报表中扣减
+    meter_id = request.form.get('meter_id')
+    ok, msg = EnergyService.delete_meter(meter_id)
+    return success_resp("删除成功") if ok else error_resp(msg)
+
+def parse_bulk_meters():
+    """解析批量导入的设备：支持上传 CSV 文件（file 字段）、CSV 请求体（表头为字段名）、JSON 数组（或 {"meters": [...]}）"""
+    upload = request.files.get('file')
+    if upload or request.mimetype == 'text/csv':
+        text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True).lstrip('\ufeff')
+        return list(csv.DictReader(io.StringIO(text)))
+    payload = request.get_json(force=True)
+    if isinstance(payload, dict):
+        payload = payload.get('meters')
+    if not isinstance(payload, list):
+        raise ValueError("请求体必须是设备数组")
+    return payload
+
+def parse_meter_ids():
+    """批量操作的设备编号：JSON {"meter_ids": [...]}"""
+    meter_ids = (request.get_json(force=True) or {}).get('meter_ids')
+    if not isinstance(meter_ids, list) or not meter_ids:
+        raise ValueError("meter_ids 必须是非空的设备编号数组")
+    if len(meter_ids) > Config.METER_BULK_MAX:
+        raise ValueError(f"单次最多操作{Config.METER_BULK_MAX}台设备")
+    return [str(meter_id) for meter_id in meter_ids]
+
+@energy_bp.route('/api/meter/bulk', methods=['POST'])
+def bulk_upsert_meters():
+    """批量导入设备（编号已存在时更新）"""
+    try:
+        meters = parse_bulk_meters()
+    except Exception as e:
+        return error_resp(f"数据解析失败：{str(e)}")
+    if not meters:
+        return error_resp("没有设备数据")
+    if len(meters) > Config.METER_BULK_MAX:
+        return error_resp(f"单次最多导入{Config.METER_BULK_MAX}台设备")
+    
+    ok, msg, results = EnergyService.upsert_meters(meters)
+    data = {
+        "created": sum(1 for item in results if item.get("action") == "created"),
+        "updated": sum(1 for item in results if item.get("action") == "updated"),
+        "rejected": sum(1 for item in results if not item["success"]),
+        "results": results
+    }
+    return jsonify({"success": ok, "message": msg, "data": data})
+
+@energy_bp.route('/api/meter/bulk_status', methods=['POST'])
+def bulk_update_meter_status():
+    """批量修改设备运行状态：{"meter_ids": [...], "run_status": "故障"}"""
+    try:
+        meter_ids = parse_meter_ids()
+    except Exception as e:
+        return error_resp(str(e))
+    ok, msg, matched = EnergyService.update_meters_status(meter_ids, request.get_json(force=True).get('run_status'))
+    return success_resp(msg, {"updated": matched}) if ok else error_resp(msg)
+
+@energy_bp.route('/api/meter/bulk_delete', methods=['POST'])
+def bulk_delete_meters():
+    """批量删除设备及其监测数据：{"meter_ids": [...]}"""
     try:
-        meter_id = request.form.get('meter_id')
-        meter = EnergyMeter.query.get(meter_id)
-        if meter:
-            db.session.delete(meter)
-            db.session.commit()
-        return success_resp("删除成功")
+        meter_ids = parse_meter_ids()
     except Exception as e:
-        return error_resp("删除失败，可能存在关联数据")
+        return error_resp(str(e))
+    ok, msg, results = EnergyService.delete_meters(meter_ids)
+    return jsonify({"success": ok, "message": msg, "data": results})
 
 @energy_bp.route('/api/monitor/verify', methods=['POST'])
 def verify_data():
     try:
         data_id = request.form.get('data_id')
-        item = EnergyMonitor.query.get(data_id)
-        if item:
-            item.is_verified = True
-            db.session.commit()
-            return success_resp()
-        return error_resp("数据不存在")
+        # 由服务层统一处理核实后的峰谷报表调整
+        ok, msg = EnergyService.verify_monitor_data(data_id)
+        return success_resp(msg) if ok else error_resp(msg)
     except Exception as e:
         return error_resp(str(e))
 
+@energy_bp.route('/api/monitor/delete', methods=['POST'])
+def delete_data():
+    data_id = request.form.get('data_id')
+    ok, msg = EnergyService.delete_monitor_data(data_id)
+    return success_resp(msg) if ok else error_resp(msg)
+
 @energy_bp.route('/api/monitor/collect', methods=['POST'])
 def collect_data():
     # 模拟：插入一条新数据
     import random
     try:
-        meter = EnergyMeter.query.first()
+        meter = meter_registry.first()
         if not meter: return error_resp("无设备")
         
-        new_data = EnergyMonitor(
-            data_id=f"D{int(datetime.now().timestamp())}",
+        new_data = dict(
+            data_id=generate_data_id("monitor"),
             meter_id=meter.meter_id,
             collect_time=datetime.now(),
             energy_value=round(random.uniform(10, 500), 2),
@@ -169,54 +242,206 @@ def collect_data():
             factory_id=meter.factory_id,
             is_verified=False
         )
-        db.session.add(new_data)
-        db.session.commit()
-        return success_resp("采集成功")
+        # 写入明细并增量累加到小时汇总和当天峰谷报表（异步模式下进入写入队列）
+        saved = EnergyService.save_monitor_rows([new_data])
+        return success_resp("采集成功" if saved else "采集数据已接收")
+    except IngestBusyError:
+        raise
     except Exception as e:
+        db.session.rollback()
         return error_resp(str(e))
 
+def parse_bulk_readings():
+    """解析批量上报的数据：支持 JSON 数组（或 {"readings": [...]}）与 NDJSON（每行一条）"""
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        text = request.get_data(as_text=True)
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    payload = request.get_json(force=True)
+    if isinstance(payload, dict):
+        payload = payload.get('readings')
+    if not isinstance(payload, list):
+        raise ValueError("请求体必须是监测数据数组")
+    return payload
+
+@energy_bp.route('/api/monitor/bulk', methods=['POST'])
+def bulk_collect():
+    """网关批量上报监测数据"""
+    try:
+        readings = parse_bulk_readings()
+    except Exception as e:
+        return error_resp(f"数据解析失败：{str(e)}")
+    if not readings:
+        return error_resp("没有监测数据")
+    if len(readings) > Config.BULK_MAX_READINGS:
+        return error_resp(f"单次最多上报{Config.BULK_MAX_READINGS}条数据")
+    
+    ok, msg, results = EnergyService.add_energy_monitor_batch(readings)
+    accepted = sum(1 for item in results if item["success"])
+    data = {"accepted": accepted, "rejected": len(results) - accepted, "results": results}
+    return jsonify({"success": ok, "message": msg, "data": data})
+
+@energy_bp.route('/api/monitor/list', methods=['GET'])
+@replica_reads
+def list_monitor_data():
+    """监测数据分页接口：逐条流式输出本页数据，末尾附下一页游标"""
+    filters = {key: request.args.get(key) for key in ('meter_id', 'factory_id', 'start_time', 'end_time', 'data_quality')}
+    try:
+        limit = int(request.args.get('limit', Config.MONITOR_PAGE_SIZE))
+        rows, next_cursor = EnergyService.get_monitor_page(filters, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return error_resp(str(e))
+    
+    def generate():
+        yield '{"success": true, "message": "操作成功", "data": ['
+        for i, row in enumerate(rows):
+            item = dict(row.to_dict(), energy_type=row.meter.energy_type)
+            yield (',' if i else '') + json.dumps(item, ensure_ascii=False)
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+    
+    return Response(generate(), mimetype='application/json')
+
+@energy_bp.route('/api/export/<dataset>', methods=['GET'])
+def export_data(dataset):
+    """流式导出监测数据（monitor）或峰谷报表（peak_valley），format=csv/parquet/arrow"""
+    fmt = request.args.get('format', 'csv')
+    try:
+        stream = export_stream(dataset, fmt, request.args.to_dict())
+    except ValueError as e:
+        return error_resp(str(e))
+    
+    mimetype, suffix = EXPORT_FORMATS[fmt]
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{suffix}"
+    return Response(stream_with_context(stream), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@energy_bp.route('/api/timeseries', methods=['GET'])
+@replica_reads
+def get_timeseries_data():
+    """能耗曲线：按设备或厂区、时间段和目标点数返回分桶聚合（bucket）或降采样（lttb）结果"""
+    factory_id = request.args.get('factory_id')
+    try:
+        data = get_timeseries(
+            start_time=parse_datetime(request.args['start_time']),
+            end_time=parse_datetime(request.args['end_time']),
+            points=int(request.args.get('points', Config.TIMESERIES_DEFAULT_POINTS)),
+            mode=request.args.get('mode', 'bucket'),
+            meter_id=request.args.get('meter_id'),
+            factory_id=factory_id if factory_id != 'all' else None,
+            energy_type=request.args.get('energy_type')
+        )
+    except KeyError as e:
+        return error_resp(f"缺少参数：{e.args[0]}")
+    except ValueError as e:
+        return error_resp(str(e))
+    return success_resp(data=data)
+
 @energy_bp.route('/api/report/peak_valley', methods=['GET'])
+@replica_reads
 def get_peak_valley_data():
     factory_id = request.args.get('factory_id')
     date_str = request.args.get('date')
     e_type = request.args.get('energy_type')
     
-    query = PeakValleyEnergy.query
+    # 单日（date）或日期区间（start_date/end_date），区间内的完整月份直接读月度汇总表
+    try:
+        start_str = request.args.get('start_date') or date_str
+        end_str = request.args.get('end_date') or date_str
+        start_date = datetime.strptime(start_str, '%Y-%m-%d').date() if start_str else None
+        end_date = datetime.strptime(end_str, '%Y-%m-%d').date() if end_str else None
+    except ValueError:
+        return error_resp("日期格式错误（应为YYYY-mm-dd）")
+    if (start_date is None) != (end_date is None):
+        start_date = start_date or end_date
+        end_date = end_date or start_date
+    if start_date and end_date < start_date:
+        return error_resp("结束日期不能早于开始日期")
     
-    if factory_id and factory_id != 'all':
-        query = query.filter_by(factory_id=factory_id)
-    if date_str:
-        # 字符串转日期对象
-        d = datetime.strptime(date_str, '%Y-%m-%d').date()
-        query = query.filter_by(stat_date=d)
-    if e_type:
-        query = query.filter_by(energy_type=e_type)
-        
-    # 聚合统计
-    stats = query.with_entities(
-        func.sum(PeakValleyEnergy.peak_energy).label('sharp'),
-        func.sum(PeakValleyEnergy.high_energy).label('peak'),
-        func.sum(PeakValleyEnergy.flat_energy).label('flat'),
-        func.sum(PeakValleyEnergy.valley_energy).label('valley'),
-        func.sum(PeakValleyEnergy.total_energy).label('total'),
-        func.sum(PeakValleyEnergy.energy_cost).label('cost')
-    ).first()
+    # 结果按规范化后的筛选条件缓存，相关数据写入并提交后自动失效
+    stats = get_report_totals(factory_id, start_date, end_date, e_type)
     
     # 防止 None
     def safe_val(v): return round(v, 2) if v else 0
     
-    total = safe_val(stats.total)
-    peak_part = safe_val(stats.sharp) + safe_val(stats.peak)
+    total = safe_val(stats["total"])
+    peak_part = safe_val(stats["peak"]) + safe_val(stats["high"])
     ratio = round((peak_part / total * 100), 2) if total > 0 else 0
     
     data = {
-        "sharp": safe_val(stats.sharp),
-        "peak": safe_val(stats.peak),
-        "flat": safe_val(stats.flat),
-        "valley": safe_val(stats.valley),
+        "sharp": safe_val(stats["peak"]),
+        "peak": safe_val(stats["high"]),
+        "flat": safe_val(stats["flat"]),
+        "valley": safe_val(stats["valley"]),
         "total_usage": total,
-        "total_cost": safe_val(stats.cost),
+        "total_cost": safe_val(stats["cost"]),
         "peak_ratio": ratio
     }
     
-    return success_resp(data=data)
\ No newline at end of file
+    return success_resp(data=data)
+
+@energy_bp.route('/api/report/ranking', methods=['GET'])
+def get_factory_ranking():
+    """
+    厂区能耗排名：日期区间（start_date/end_date 或 date）内按 metric（total/peak_ratio/cost）排序，
+    与同类厂区的 baseline（mean/median/p90 等）比较；threshold 只返回超基准率大于该值（%）的厂区
+    """
+    try:
+        start_str = request.args.get('start_date') or request.args['date']
+        end_str = request.args.get('end_date') or start_str
+        start_date = datetime.strptime(start_str, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end_str, '%Y-%m-%d').date()
+        threshold = request.args.get('threshold')
+        data = EnergyService.get_factory_ranking(
+            start_date, end_date,
+            energy_type=request.args.get('energy_type') or None,
+            metric=request.args.get('metric', 'total'),
+            baseline=request.args.get('baseline', 'mean'),
+            threshold=float(threshold) if threshold else None,
+            page=int(request.args.get('page', 1)),
+            page_size=int(request.args.get('page_size', Config.RANKING_PAGE_SIZE))
+        )
+    except KeyError as e:
+        return error_resp(f"缺少参数：{e.args[0]}")
+    except ValueError as e:
+        return error_resp(str(e))
+    return success_resp(data=data)
+
+@energy_bp.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """报表缓存命中统计"""
+    return success_resp(data=report_cache.stats())
+
+@energy_bp.route('/api/ingest/metrics', methods=['GET'])
+def get_ingest_metrics():
+    """异步写入队列状态（队列深度、写入批次耗时等）"""
+    return success_resp(data=dict(ingest_queue.metrics(), mode=Config.INGEST_MODE))
+
+@energy_bp.route('/api/anomaly/state', methods=['GET'])
+def get_anomaly_state():
+    """异常检测状态：指定 meter_id 时返回该设备的统计量，否则返回汇总"""
+    meter_id = request.args.get('meter_id')
+    if not meter_id:
+        return success_resp(data=dict(anomaly_detector.summary(), enabled=Config.ANOMALY_DETECTION_ENABLED))
+    state = anomaly_detector.state(meter_id)
+    if state is None:
+        return error_resp(f"设备{meter_id}暂无检测数据")
+    return success_resp(data=state)
+
+# --- 峰谷电价方案 ---
+@energy_bp.route('/api/tariff/list', methods=['GET'])
+def list_tariff_schedules():
+    schedules = EnergyService.get_tariff_schedules(request.args.get('energy_type'), request.args.get('factory_id'))
+    return success_resp(data=[item.to_dict() for item in schedules])
+
+@energy_bp.route('/api/tariff/save', methods=['POST'])
+def save_tariff_schedule():
+    """新增或覆盖电价方案（JSON：energy_type, factory_id, effective_date, periods, prices）"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return error_resp("请求体必须是JSON对象")
+    ok, msg = EnergyService.save_tariff_schedule(payload)
+    return success_resp(msg) if ok else error_resp(msg)
+
+@energy_bp.route('/api/tariff/delete', methods=['POST'])
+def delete_tariff_schedule():
+    ok, msg = EnergyService.delete_tariff_schedule(request.form.get('schedule_id'))
+    return success_resp(msg) if ok else error_resp(msg)
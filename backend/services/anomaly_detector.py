@@ -0,0 +1,176 @@
+"""
+监测数据在线异常检测（进程内，不访问数据库）
+- 每台设备维护能耗值的指数加权均值与方差（EWMA），每台设备只占固定的几个数组元素
+- 新读数偏离均值超过 Config.ANOMALY_Z_THRESHOLD 倍标准差时判为可疑：标记为未核实并记录原因
+- 可疑读数按截断后的值更新统计量，避免单个离群值把均值和方差带偏
+- 连续 Config.ANOMALY_REBASELINE_AFTER 条可疑时视为工况变化（如停机后开机），按新读数重新学习
+- 一批读数按设备分轮向量化处理：第 k 轮同时处理每台设备的第 k 条读数
+- 写入前只在统计量的副本上打分（score_rows(rows, commit=False)），数据入库或进入写入队列后再用 learn_rows 更新，
+  被拒绝或回滚的读数不影响统计量
+- 统计量只保存在本进程内，多进程部署时各进程分别学习（网关按设备固定路由时效果最好）
+"""
+import threading
+from datetime import datetime
+import numpy as np
+from config import Config
+
+# 标准差的下限（相对均值）：读数长期不变的设备方差接近0，避免微小波动也被判为可疑
+MIN_RELATIVE_STD = 0.01
+# 每台设备的统计量数组
+STATE_FIELDS = ("mean", "var", "count", "flagged", "streak", "last_time")
+
+
+class AnomalyDetector:
+    def __init__(self, alpha: float, z_threshold: float, warmup: int, rebaseline_after: int = 20, capacity: int = 1024):
+        """
+        :param alpha: EWMA 平滑系数（越大越偏重最近的读数）
+        :param z_threshold: 判为可疑的偏离倍数（按标准差计）
+        :param warmup: 设备累计读数达到该条数后才开始判定
+        :param rebaseline_after: 连续可疑达到该条数时丢弃旧统计量，从当前读数重新预热
+        """
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.rebaseline_after = rebaseline_after
+        self._slots = {}  # meter_id -> 数组下标
+        self._lock = threading.Lock()
+        self.mean = np.zeros(capacity)
+        self.var = np.zeros(capacity)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.flagged = np.zeros(capacity, dtype=np.int64)
+        self.streak = np.zeros(capacity, dtype=np.int64)  # 连续可疑条数
+        self.last_time = np.zeros(capacity, dtype="datetime64[s]")
+
+    def _slot_indexes(self, meter_ids: list) -> np.ndarray:
+        """设备对应的数组下标（新设备分配下标，容量不足时成倍扩容）"""
+        slots = self._slots
+        for meter_id in meter_ids:
+            if meter_id not in slots:
+                slots[meter_id] = len(slots)
+        if len(slots) > len(self.mean):
+            size = max(len(slots), len(self.mean) * 2)
+            for name in STATE_FIELDS:
+                old = getattr(self, name)
+                new = np.zeros(size, dtype=old.dtype)
+                new[:len(old)] = old
+                setattr(self, name, new)
+        return np.fromiter((slots[meter_id] for meter_id in meter_ids), dtype=np.int64, count=len(meter_ids))
+
+    def score(self, meter_ids: list, collect_times: list, values: list,
+              commit: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        """
+        为一批读数打分（同一设备按采集时间先后处理）
+        :param commit: 是否更新统计量；为 False 时只在统计量的副本上计算
+        :return: (偏离倍数数组, 是否可疑数组)，顺序与输入一致；预热期内偏离倍数为0
+        """
+        n = len(values)
+        scores = np.zeros(n)
+        suspicious = np.zeros(n, dtype=bool)
+        if not n:
+            return scores, suspicious
+        values = np.asarray(values, dtype=np.float64)
+        times = np.array(collect_times, dtype="datetime64[s]")
+        with self._lock:
+            slots = self._slot_indexes(meter_ids)
+            if commit:
+                state = {name: getattr(self, name) for name in STATE_FIELDS}
+            else:
+                # 只复制本批涉及的设备，下标换成副本中的位置
+                unique, slots = np.unique(slots, return_inverse=True)
+                state = {name: getattr(self, name)[unique] for name in STATE_FIELDS}
+            # 按（设备, 采集时间）排序，计算每条读数是本设备的第几条
+            order = np.lexsort((times, slots))
+            sorted_slots = slots[order]
+            starts = np.flatnonzero(np.r_[True, sorted_slots[1:] != sorted_slots[:-1]])
+            ranks = np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+            alpha, threshold = self.alpha, self.z_threshold
+            for k in range(int(ranks.max()) + 1):
+                idx = order[ranks == k]
+                s, x = slots[idx], values[idx]
+                mean, var, count = state["mean"][s], state["var"][s], state["count"][s]
+                # 判定与截断使用同一个带下限的标准差
+                std = np.maximum(np.sqrt(var), MIN_RELATIVE_STD * np.abs(mean) + 1e-9)
+                z = np.abs(x - mean) / std
+                ready = count >= self.warmup
+                z[~ready] = 0.0
+                flagged = z > threshold
+                # 可疑值截断到阈值边界后再参与更新；首条读数直接作为初始均值
+                clamped = np.where(flagged, mean + np.sign(x - mean) * threshold * std, x)
+                diff = clamped - mean
+                first = count == 0
+                new_mean = np.where(first, clamped, mean + alpha * diff)
+                new_var = np.where(first, 0.0, (1 - alpha) * (var + alpha * diff * diff))
+                # 连续可疑过多：以当前读数为新的初始均值重新预热
+                streak = np.where(flagged, state["streak"][s] + 1, 0)
+                rebase = streak >= self.rebaseline_after
+                state["mean"][s] = np.where(rebase, x, new_mean)
+                state["var"][s] = np.where(rebase, 0.0, new_var)
+                state["count"][s] = np.where(rebase, 1, count + 1)
+                state["streak"][s] = np.where(rebase, 0, streak)
+                state["flagged"][s] += flagged
+                state["last_time"][s] = np.maximum(state["last_time"][s], times[idx])
+                scores[idx], suspicious[idx] = z, flagged
+        return scores, suspicious
+
+    def score_rows(self, rows: list, commit: bool = True) -> int:
+        """
+        为待写入的监测数据行打分，可疑的行标记为未核实并写入 anomaly_reason
+        :param commit: 是否同时更新统计量；写入前打分传 False，写入成功后再调用 learn_rows
+        :return: 可疑行数
+        """
+        scores, suspicious = self.score(
+            [row["meter_id"] for row in rows], [row["collect_time"] for row in rows], [row["energy_value"] for row in rows],
+            commit
+        )
+        for i in np.flatnonzero(suspicious):
+            row = rows[i]
+            row["is_verified"] = False
+            row["anomaly_reason"] = f"能耗值偏离近期均值{scores[i]:.1f}倍标准差"
+        return int(suspicious.sum())
+
+    def learn_rows(self, rows: list) -> None:
+        """用已写入（或已进入写入队列）的监测数据行更新统计量（按当前统计量重新计算，并发写入时不会互相覆盖）"""
+        self.score(
+            [row["meter_id"] for row in rows], [row["collect_time"] for row in rows], [row["energy_value"] for row in rows]
+        )
+
+    def state(self, meter_id: str) -> dict:
+        """某设备当前的统计量（未见过的设备返回None）"""
+        slot = self._slots.get(meter_id)
+        if slot is None:
+            return None
+        with self._lock:
+            last_time = self.last_time[slot].astype(datetime)
+            return {
+                "meter_id": meter_id,
+                "count": int(self.count[slot]),
+                "mean": round(float(self.mean[slot]), 4),
+                "std": round(float(np.sqrt(self.var[slot])), 4),
+                "flagged": int(self.flagged[slot]),
+                "warmed_up": bool(self.count[slot] >= self.warmup),
+                "last_time": last_time.strftime("%Y-%m-%d %H:%M:%S") if self.count[slot] else None,
+            }
+
+    def summary(self) -> dict:
+        """全部设备的汇总：设备数、累计读数、累计可疑读数"""
+        with self._lock:
+            size = len(self._slots)
+            return {
+                "meters": size,
+                "readings": int(self.count[:size].sum()),
+                "flagged": int(self.flagged[:size].sum()),
+            }
+
+    def forget(self, meter_id: str) -> None:
+        """清除某设备的统计量（设备删除或更换后重新学习）"""
+        with self._lock:
+            slot = self._slots.get(meter_id)
+            if slot is not None:
+                self.mean[slot] = self.var[slot] = 0
+                self.count[slot] = self.flagged[slot] = self.streak[slot] = 0
+                self.last_time[slot] = np.datetime64(0, "s")
+
+
+anomaly_detector = AnomalyDetector(
+    Config.ANOMALY_EWMA_ALPHA, Config.ANOMALY_Z_THRESHOLD, Config.ANOMALY_WARMUP, Config.ANOMALY_REBASELINE_AFTER
+)
@@ -0,0 +1,294 @@
+"""
+历史监测数据列式归档：已结束的日期按（厂区, 能源类型）导出为 .npy 列文件，读取时内存映射，不经过 ORM
+- 目录结构：{ARCHIVE_DIR}/{日期}/{厂区}.{能源类型代码}/ 下的 time.npy（int64 秒数）、value.npy（float64/float32）、
+  meter.npy（设备编号字典下标）、verified.npy（是否已核实）和 meters.json（设备编号字典）
+- 一天的全部文件先写入临时目录再整体改名，日期目录存在即表示该天已完整归档
+- 已归档且仍有原始数据的日期：读取只走归档文件，不再查询数据库；该天的监测数据有变更时提交后删除归档，下次归档时重新导出
+- 已归档且已压缩的日期（原始数据已删除）：读取归档文件，再加上压缩后补录的少量原始数据
+"""
+import json
+import os
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+from itertools import groupby
+import numpy as np
+from sqlalchemy import event, select, and_, or_
+from sqlalchemy.orm import Session
+from database import db
+from models import EnergyMeter, EnergyMonitor
+from services.rollup_hierarchy import compacted_until
+from utils.sql_functions import to_epoch
+from config import Config
+
+# 能源类型对应的目录代码（避免目录名中出现中文）
+ENERGY_TYPE_CODES = {"水": "water", "蒸汽": "steam", "天然气": "gas"}
+CODE_ENERGY_TYPES = {code: energy_type for energy_type, code in ENERGY_TYPE_CODES.items()}
+COLUMNS = ("time", "value", "meter", "verified")
+_STALE_DAYS = "archive_stale_days"
+
+
+class ArchivedSeries:
+    """一个（日期, 厂区, 能源类型）的归档数据，各列为只读内存映射数组，按采集时间升序"""
+
+    def __init__(self, path: str):
+        self.path = path
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        with open(os.path.join(path, "meters.json"), encoding="utf-8") as f:
+            self.meters = json.load(f)
+
+    def __len__(self):
+        return len(self.time)
+
+    def meter_mask(self, meter_id: str) -> np.ndarray:
+        """某设备的读数掩码（设备不在字典中时全为 False）"""
+        if meter_id not in self.meters:
+            return np.zeros(len(self), dtype=bool)
+        return self.meter == self.meters.index(meter_id)
+
+
+class ArchiveStore:
+    def __init__(self, root: str, value_dtype: str = "float64"):
+        """
+        :param root: 归档根目录，为空表示不启用归档
+        :param value_dtype: 能耗值的存储类型（float64 或 float32）
+        """
+        self.root = root
+        self.value_dtype = np.dtype(value_dtype)
+        self._days = frozenset()
+        self._listed_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def day_path(self, day: date) -> str:
+        return os.path.join(self.root, day.isoformat())
+
+    def archived_days(self) -> frozenset:
+        """已完整归档的日期（根目录内容未变化时使用上次的列表）"""
+        if not self.enabled or not os.path.isdir(self.root):
+            return frozenset()
+        mtime = os.stat(self.root).st_mtime_ns
+        if mtime != self._listed_mtime:
+            days = set()
+            for name in os.listdir(self.root):
+                try:
+                    days.add(date.fromisoformat(name))
+                except ValueError:
+                    continue  # 临时目录等
+            self._days, self._listed_mtime = frozenset(days), mtime
+        return self._days
+
+    def series(self, day: date, factory_id: str = None, energy_type: str = None):
+        """逐个返回某天符合条件的归档数据（厂区、能源类型为空表示不限）"""
+        path = self.day_path(day)
+        if not os.path.isdir(path):
+            return
+        for name in sorted(os.listdir(path)):
+            series_factory, _, code = name.rpartition(".")
+            if factory_id and series_factory != factory_id:
+                continue
+            if energy_type and CODE_ENERGY_TYPES.get(code) != energy_type:
+                continue
+            yield series_factory, CODE_ENERGY_TYPES[code], ArchivedSeries(os.path.join(path, name))
+
+    def write_day(self, day: date, groups: dict) -> int:
+        """
+        整体写入（或替换）某天的归档
+        :param groups: {(厂区, 能源类型): (设备编号列表, 采集时间秒数数组, 能耗值数组, 是否核实数组)}
+        :return: 写入的读数条数
+        """
+        os.makedirs(self.root, exist_ok=True)
+        temp = os.path.join(self.root, f".tmp-{day.isoformat()}-{os.getpid()}-{threading.get_ident()}")
+        shutil.rmtree(temp, ignore_errors=True)
+        os.makedirs(temp)
+        written = 0
+        for (factory_id, energy_type), (meter_ids, times, values, verified) in sorted(groups.items()):
+            order = np.argsort(times, kind="stable")
+            dictionary, codes = np.unique(np.asarray(meter_ids, dtype=object).astype(str), return_inverse=True)
+            path = os.path.join(temp, f"{factory_id}.{ENERGY_TYPE_CODES[energy_type]}")
+            os.makedirs(path)
+            np.save(os.path.join(path, "time.npy"), np.asarray(times, dtype=np.int64)[order])
+            np.save(os.path.join(path, "value.npy"), np.asarray(values, dtype=self.value_dtype)[order])
+            np.save(os.path.join(path, "meter.npy"), codes.astype(np.uint16 if len(dictionary) < 65536 else np.int32)[order])
+            np.save(os.path.join(path, "verified.npy"), np.asarray(verified, dtype=bool)[order])
+            with open(os.path.join(path, "meters.json"), "w", encoding="utf-8") as f:
+                json.dump(dictionary.tolist(), f, ensure_ascii=False)
+            written += len(order)
+        with self._lock:
+            self.discard([day])
+            os.replace(temp, self.day_path(day))
+        return written
+
+    def discard(self, days) -> int:
+        """删除若干天的归档（先改名再删除，读取方不会看到写了一半的目录）"""
+        removed = 0
+        for day in days:
+            path = self.day_path(day)
+            trash = os.path.join(self.root, f".old-{day.isoformat()}-{os.getpid()}-{threading.get_ident()}")
+            try:
+                os.replace(path, trash)
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            removed += 1
+        return removed
+
+
+archive_store = ArchiveStore(Config.ARCHIVE_DIR, Config.ARCHIVE_VALUE_DTYPE)
+
+
+# -------------------------- 查询路由 --------------------------
+def split_range(start_time: datetime, end_time: datetime) -> tuple[list, list]:
+    """
+    把时间区间拆成读归档的日期与查数据库的时间段
+    已归档且未压缩的日期只读归档；已归档且已压缩的日期同时读归档和数据库（压缩后补录的数据）
+    :return: (归档日期列表, [(开始时间, 结束时间), ...])，数据库时间段为左闭右开
+    """
+    archived = archive_store.archived_days()
+    if not archived:
+        return [], [(start_time, end_time)]
+    cutoff = compacted_until() or date.min
+    days, ranges = [], []
+    day = start_time.date()
+    range_start = start_time
+    while datetime.combine(day, datetime.min.time()) < end_time:
+        day_start = max(start_time, datetime.combine(day, datetime.min.time()))
+        day_end = min(end_time, datetime.combine(day + timedelta(days=1), datetime.min.time()))
+        if day in archived:
+            days.append(day)
+            if day >= cutoff:
+                # 归档完整覆盖这一天，数据库时间段在此断开
+                if range_start < day_start:
+                    ranges.append((range_start, day_start))
+                range_start = day_end
+        day += timedelta(days=1)
+    if range_start < end_time:
+        ranges.append((range_start, end_time))
+    return days, ranges
+
+
+def read_archive(days: list, start_time: datetime, end_time: datetime, meter_id: str = None, factory_id: str = None,
+                 energy_type: str = None, verified_only: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    读取若干天的归档读数（时间限定在 [start_time, end_time)）
+    :return: (采集时间 datetime64[s] 数组, 能耗值 float64 数组)，未排序
+    """
+    start_epoch, end_epoch = to_epoch(start_time), to_epoch(end_time)
+    times, values = [], []
+    for day in days:
+        for _, _, series in archive_store.series(day, factory_id, energy_type):
+            lo, hi = np.searchsorted(series.time, [start_epoch, end_epoch])
+            mask = np.ones(hi - lo, dtype=bool)
+            if meter_id:
+                mask &= series.meter_mask(meter_id)[lo:hi]
+            if verified_only:
+                mask &= series.verified[lo:hi]
+            times.append(series.time[lo:hi][mask])
+            values.append(series.value[lo:hi][mask])
+    if not times:
+        return np.empty(0, dtype="datetime64[s]"), np.empty(0, dtype=np.float64)
+    return np.concatenate(times).astype("datetime64[s]"), np.concatenate(values).astype(np.float64)
+
+
+def raw_range_filter(ranges: list):
+    """数据库时间段对应的过滤条件；没有需要查询数据库的时间段时返回 None"""
+    if not ranges:
+        return None
+    return or_(*[and_(EnergyMonitor.collect_time >= start, EnergyMonitor.collect_time < end) for start, end in ranges])
+
+
+def clamp_to_source(start_date: date) -> date:
+    """
+    重算的起始日期推迟到有完整数据来源的日期：未压缩的日期有原始数据，已压缩的日期须已归档
+    """
+    cutoff = compacted_until()
+    if cutoff is None or start_date >= cutoff:
+        return start_date
+    archived = archive_store.archived_days()
+    day = cutoff - timedelta(days=1)
+    while day >= start_date and day in archived:
+        day -= timedelta(days=1)
+    return day + timedelta(days=1)
+
+
+# -------------------------- 导出 --------------------------
+def archive_days(start_date: date, end_date: date, overwrite: bool = False, progress=print) -> dict:
+    """
+    按天导出监测数据到归档（只处理今天之前、尚未压缩的日期；已归档的日期默认跳过）
+    :return: {"days": 导出天数, "skipped": 跳过天数, "readings": 导出条数}
+    """
+    if not archive_store.enabled:
+        raise ValueError("未设置归档目录（ARCHIVE_DIR）")
+    end_date = min(end_date, date.today() - timedelta(days=1))
+    start_date = max(start_date, compacted_until() or start_date)
+    summary = {"days": 0, "skipped": 0, "readings": 0}
+    day = start_date
+    while day <= end_date:
+        if not overwrite and day in archive_store.archived_days():
+            summary["skipped"] += 1
+            day += timedelta(days=1)
+            continue
+        start_time = datetime.combine(day, datetime.min.time())
+        rows = db.session.execute(select(
+            EnergyMonitor.factory_id, EnergyMeter.energy_type, EnergyMonitor.meter_id,
+            EnergyMonitor.collect_time, EnergyMonitor.energy_value, EnergyMonitor.is_verified
+        ).join(EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id).where(
+            EnergyMonitor.collect_time >= start_time, EnergyMonitor.collect_time < start_time + timedelta(days=1)
+        ).order_by(EnergyMonitor.factory_id, EnergyMeter.energy_type)).all()
+        groups = {}
+        for key, group in groupby(rows, key=lambda row: (row[0], row[1])):
+            _, _, meter_ids, times, values, verified = zip(*group)
+            groups[key] = (meter_ids, np.array(times, dtype="datetime64[s]").astype(np.int64), values, [bool(v) for v in verified])
+        written = archive_store.write_day(day, groups)
+        summary["days"] += 1
+        summary["readings"] += written
+        progress(f"{day} 已归档：{len(groups)}组，{written}条")
+        day += timedelta(days=1)
+    db.session.commit()
+    return summary
+
+
+def remove_meter(meter_id: str) -> int:
+    """从已压缩日期的归档中去掉某设备的读数（未压缩日期的归档随原始数据变更一起失效）"""
+    cutoff = compacted_until()
+    rewritten = 0
+    for day in sorted(d for d in archive_store.archived_days() if cutoff and d < cutoff):
+        groups, changed = {}, False
+        for factory_id, energy_type, series in archive_store.series(day):
+            keep = ~series.meter_mask(meter_id)
+            changed |= not keep.all()
+            if keep.any():
+                groups[(factory_id, energy_type)] = (
+                    np.asarray(series.meters, dtype=object)[series.meter[keep]], np.array(series.time[keep]),
+                    np.array(series.value[keep]), np.array(series.verified[keep])
+                )
+        if changed:
+            archive_store.write_day(day, groups)
+            rewritten += 1
+    return rewritten
+
+
+def mark_archive_stale(keys) -> None:
+    """记录当前事务修改了哪些（厂区, 能源类型, 日期）的监测数据；涉及已归档且未压缩的日期时，提交后删除这些天的归档"""
+    archived = archive_store.archived_days()
+    days = {day for _, _, day in keys if day in archived}
+    if days:
+        cutoff = compacted_until() or date.min
+        db.session.info.setdefault(_STALE_DAYS, set()).update(day for day in days if day >= cutoff)
+
+
+@event.listens_for(Session, "after_commit")
+def _discard_after_commit(session):
+    days = session.info.pop(_STALE_DAYS, None)
+    if days:
+        archive_store.discard(days)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _keep_after_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_STALE_DAYS, None)
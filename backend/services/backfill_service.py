@@ -0,0 +1,171 @@
+"""
+峰谷报表并行重算（flask --app app backfill-rollups）
+- 把（厂区, 能源类型, 日期）键空间按 厂区 × 能源类型 × 自然月 切分成任务块，
+  同一月度汇总只由一个任务块写入，块之间互不冲突
+- 任务块在进程池中执行，每个工作进程使用自己的数据库连接；每块单独提交，结果可重复覆盖
+- 已完成的任务块记录在状态文件中，中断后使用相同参数重新执行会跳过已完成的块
+  （电价方案或时段配置变化后状态文件失效，从头重算）
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from config import Config
+from database import db
+from models import EnergyMeter, EnergyMonitor, PeakValleyEnergy
+from services.rollup_hierarchy import next_month
+from services.rollup_service import recompute_peak_valley
+from services.tariff_registry import tariff_registry
+
+# 工作进程中的应用实例（由 _init_worker 创建）
+
+_worker_app = None
+
+
+def plan_chunks(start_date: date, end_date: date, factory_id: str = None, energy_type: str = None) -> list:
+    """
+    列出日期区间内需要重算的任务块（有明细数据或已有报表的 厂区/能源类型）
+    :return: [(factory_id, energy_type, 块开始日期, 块结束日期)]，按厂区、能源类型、日期排序
+    """
+    start_time = datetime.combine(start_date, datetime.min.time())
+    end_time = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+    monitor_keys = db.session.query(EnergyMonitor.factory_id, EnergyMeter.energy_type).join(
+        EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id
+    ).filter(EnergyMonitor.collect_time >= start_time, EnergyMonitor.collect_time < end_time)
+    report_keys = db.session.query(PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type).filter(
+        PeakValleyEnergy.energy_type.in_(EnergyMeter.energy_type.type.enums),
+        PeakValleyEnergy.stat_date.between(start_date, end_date)
+    )
+    if factory_id:
+        monitor_keys = monitor_keys.filter(EnergyMonitor.factory_id == factory_id)
+        report_keys = report_keys.filter(PeakValleyEnergy.factory_id == factory_id)
+    if energy_type:
+        monitor_keys = monitor_keys.filter(EnergyMeter.energy_type == energy_type)
+        report_keys = report_keys.filter(PeakValleyEnergy.energy_type == energy_type)
+    keys = sorted(set(monitor_keys.distinct()) | set(report_keys.distinct()))
+
+    chunks = []
+    for key_factory, key_type in keys:
+        day = start_date
+        while day <= end_date:
+            chunk_end = min(next_month(day) - timedelta(days=1), end_date)
+            chunks.append((key_factory, key_type, day, chunk_end))
+            day = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def chunk_id(chunk: tuple) -> str:
+    """任务块在状态文件中的标识"""
+    factory_id, energy_type, start_date, end_date = chunk
+    return f"{factory_id}|{energy_type}|{start_date.isoformat()}|{end_date.isoformat()}"
+
+
+def _init_worker(database_uri: str) -> None:
+    """工作进程初始化：使用与主进程相同的数据库配置创建应用（各进程独立建立连接）"""
+    global _worker_app
+    Config.SQLALCHEMY_DATABASE_URI = database_uri
+    from app import create_app  # 创建应用时才会按修改后的配置创建数据库引擎
+    _worker_app = create_app(web=False)
+
+
+def run_chunk(chunk: tuple) -> dict:
+    """重算一个任务块并提交（在工作进程中执行；未初始化时使用当前应用上下文）"""
+    factory_id, energy_type, start_date, end_date = chunk
+
+    def run():
+        try:
+            counts = recompute_peak_valley(energy_type, factory_id, start_date, end_date)
+            db.session.commit()
+            return counts
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+    if _worker_app is None:
+        return run()
+    with _worker_app.app_context():
+        return run()
+
+
+class BackfillState:
+    """记录已完成任务块的状态文件（每完成一块即原子写入）"""
+
+    def __init__(self, path: str, job: dict):
+        self.path = path
+        self.job_hash = hashlib.sha1(json.dumps(job, sort_keys=True).encode()).hexdigest()
+        self.completed = set()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                saved = json.load(f)
+            # 参数或时段配置变化后，之前的结果不再有效，重新开始
+            if saved.get("job_hash") == self.job_hash:
+                self.completed = set(saved.get("completed", []))
+
+    def mark_done(self, chunk: tuple) -> None:
+        self.completed.add(chunk_id(chunk))
+        if not self.path:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"job_hash": self.job_hash, "completed": sorted(self.completed)}, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def clear(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def run_backfill(start_date: date, end_date: date, factory_id: str = None, energy_type: str = None,
+                 workers: int = None, state_path: str = None, progress=print) -> dict:
+    """
+    并行重算峰谷报表（需在应用上下文中调用）
+    :param workers: 进程数，默认 CPU 核数；为 1 时在当前进程中逐块执行
+    :param state_path: 状态文件路径，为空时不支持断点续算
+    :param progress: 进度输出函数
+    :return: 汇总结果 {"chunks":..., "skipped":..., "created":..., "replaced":..., "removed":..., "seconds":...}
+    """
+    chunks = plan_chunks(start_date, end_date, factory_id, energy_type)
+    job = {
+        "start": start_date.isoformat(), "end": end_date.isoformat(),
+        "factory_id": factory_id, "energy_type": energy_type,
+        "periods": Config.PEAK_VALLEY_PERIODS, "prices": Config.PEAK_VALLEY_PRICES,
+        "tariff_version": tariff_registry.current_version(),
+        "verified_only": Config.PEAK_VALLEY_VERIFIED_ONLY,
+    }
+    state = BackfillState(state_path, job)
+    pending = [chunk for chunk in chunks if chunk_id(chunk) not in state.completed]
+    summary = {"chunks": len(chunks), "skipped": len(chunks) - len(pending), "created": 0, "replaced": 0, "removed": 0}
+    if summary["skipped"]:
+        progress(f"跳过已完成的任务块 {summary['skipped']} 个")
+    started = time.perf_counter()
+
+    def on_done(done: int, chunk: tuple, counts: dict) -> None:
+        state.mark_done(chunk)
+        for key in ("created", "replaced", "removed"):
+            summary[key] += counts[key]
+        elapsed = time.perf_counter() - started
+        eta = elapsed / done * (len(pending) - done)
+        progress(f"[{done}/{len(pending)}] {chunk_id(chunk)}：新增{counts['created']} 覆盖{counts['replaced']} "
+                 f"删除{counts['removed']}（已用{elapsed:.1f}s，预计剩余{eta:.1f}s）")
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(pending) <= 1:
+        for done, chunk in enumerate(pending, 1):
+            on_done(done, chunk, run_chunk(chunk))
+    else:
+        database_uri = db.engine.url.render_as_string(hide_password=False)
+        # spawn：工作进程不继承父进程的数据库连接
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(database_uri,)) as pool:
+            futures = {pool.submit(run_chunk, chunk): chunk for chunk in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                on_done(done, futures[future], future.result())
+
+    state.clear()
+    summary["seconds"] = round(time.perf_counter() - started, 2)
+    return summary
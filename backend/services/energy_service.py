@@ -1,11 +1,39 @@
 from datetime import datetime, date, timedelta
-from sqlalchemy import func, and_, or_
-from app import db
-from models import EnergyMeter, EnergyMonitor, PeakValleyEnergy
-from utils.common_utils import get_period_type, generate_data_id, verify_energy_value
+from sqlalchemy import and_, or_, insert, update
+from sqlalchemy.orm import contains_eager
+from flask import current_app
+from database import db, read_replica
+from models import EnergyMeter, EnergyMonitor, PeakValleyEnergy, EnergyHourly, TariffSchedule, FactoryArea
+from utils.common_utils import generate_data_id, verify_energy_value, parse_datetime, encode_cursor, decode_cursor
+from utils.tariff_engine import PERIOD_TYPES, period_ranges, rows_to_arrays
+from services.rollup_service import (
+    query_period_sums, save_daily_rollup, backfill_peak_valley,
+    counts_in_rollup, apply_readings
+)
+from services.rollup_hierarchy import apply_hourly, refresh_hourly, refresh_monthly, hour_start
+from services.meter_registry import meter_registry, MeterInfo, mark_changed as mark_meters_changed
+from services.tariff_registry import tariff_registry
+from services.ranking_service import rank_factories
+from services.archive_service import archive_store, split_range, read_archive, raw_range_filter, remove_meter as remove_archived_meter
+from services.anomaly_detector import anomaly_detector
+from services.ingest_queue import ingest_queue, IngestBusyError
+from utils.instrumentation import instrument_service
 from config import Config
 from datetime import datetime, date, time
+import logging
+import numpy as np
 
+logger = logging.getLogger(__name__)
+
+# 能源类型对应的计量单位
+UNIT_MAP = {"水": "m³", "蒸汽": "t", "天然气": "m³"}
+# 数据质量等级
+DATA_QUALITIES = ("优", "良", "中", "差")
+# 批量导入设备时可填写的字段（其余字段取默认值）
+METER_FIELDS = ("meter_id", "factory_id", "energy_type", "install_location", "pipe_spec", "comm_protocol",
+                "run_status", "calib_cycle", "manufacturer")
+
+@instrument_service
 class EnergyService:
     # -------------------------- 1. 能耗计量设备管理 --------------------------
     @staticmethod
@@ -53,15 +81,15 @@ class EnergyService:
     
     @staticmethod
     def update_meter(meter_id: str, update_data: dict) -> tuple[bool, str]:
-        """修改能耗计量设备信息"""
+        """修改能耗计量设备信息（仅更新传入的非空字段，一条 UPDATE 语句）"""
         try:
-            meter = EnergyMeter.query.filter_by(meter_id=meter_id).first()
-            if not meter:
+            columns = set(EnergyMeter.__table__.columns.keys()) - {"meter_id", "create_time"}
+            values = {key: value for key, value in update_data.items() if key in columns and value is not None}
+            if not db.session.query(EnergyMeter.meter_id).filter_by(meter_id=meter_id).first():
                 return False, f"设备编号{meter_id}不存在！"
-            # 批量更新字段（仅更新传入的非空字段）
-            for key, value in update_data.items():
-                if hasattr(meter, key) and value is not None:
-                    setattr(meter, key, value)
+            if values:
+                db.session.query(EnergyMeter).filter_by(meter_id=meter_id).update(values, synchronize_session=False)
+                mark_meters_changed(db.session)
             db.session.commit()
             return True, "设备更新成功！"
         except Exception as e:
@@ -70,87 +98,449 @@ class EnergyService:
     
     @staticmethod
     def delete_meter(meter_id: str) -> tuple[bool, str]:
-        """删除能耗计量设备（需先删除关联的监测数据）"""
+        """删除能耗计量设备及其监测数据（监测数据分批删除，见 delete_meters）"""
+        if not db.session.query(EnergyMeter.meter_id).filter_by(meter_id=meter_id).first():
+            return False, f"设备编号{meter_id}不存在！"
+        ok, msg, results = EnergyService.delete_meters([meter_id])
+        return (True, "设备删除成功！") if ok else (False, results[0]["message"])
+    
+    @staticmethod
+    def _prepare_meter_row(meter_data: dict, factory_ids: set) -> tuple[dict, str]:
+        """
+        校验批量导入的一行设备信息（不访问数据库）
+        :param factory_ids: 已存在的厂区编号
+        :return: (可直接写库的字段字典, 错误信息)
+        """
+        row = {key: meter_data.get(key) for key in METER_FIELDS}
+        for key, value in row.items():
+            if isinstance(value, str):
+                row[key] = value.strip()
+        if not row["meter_id"] or len(row["meter_id"]) > 20:
+            return None, "设备编号不能为空且不超过20个字符！"
+        if row["factory_id"] not in factory_ids:
+            return None, f"厂区{row['factory_id']}不存在！"
+        if row["energy_type"] not in EnergyMeter.energy_type.type.enums:
+            return None, "能源类型必须是'水'、'蒸汽'或'天然气'！"
+        if row["comm_protocol"] not in EnergyMeter.comm_protocol.type.enums:
+            return None, "通讯协议必须是'RS485'或'Lora'！"
+        row["run_status"] = row["run_status"] or "正常"
+        if row["run_status"] not in EnergyMeter.run_status.type.enums:
+            return None, "运行状态必须是'正常'或'故障'！"
+        if not row["install_location"]:
+            return None, "安装位置不能为空！"
         try:
-            meter = EnergyMeter.query.filter_by(meter_id=meter_id).first()
-            if not meter:
-                return False, f"设备编号{meter_id}不存在！"
-            # 删除关联的监测数据
-            EnergyMonitor.query.filter_by(meter_id=meter_id).delete()
-            # 删除设备
-            db.session.delete(meter)
+            row["calib_cycle"] = int(row["calib_cycle"])
+        except (TypeError, ValueError):
+            return None, "校准周期必须是整数！"
+        row["pipe_spec"] = row["pipe_spec"] or ""
+        row["manufacturer"] = row["manufacturer"] or ""
+        return row, None
+    
+    @staticmethod
+    def upsert_meters(meters: list) -> tuple[bool, str, list]:
+        """
+        批量导入设备：编号不存在时新增，已存在时覆盖其余字段（新建厂区时批量录入设备）
+        按 BULK_INSERT_CHUNK_SIZE 分批：每批一次查询已有设备，新增用一条多行 INSERT，修改用一条按主键的批量 UPDATE；
+        全部在同一事务内提交。已有监测数据的设备归属厂区和能源类型影响报表，不允许通过导入修改
+        :return: (是否成功, 提示信息, 逐条结果列表 [{"index", "meter_id", "success", "action"/"message"}])
+        """
+        results = []
+        rows = []
+        try:
+            factory_ids = {row[0] for row in db.session.query(FactoryArea.factory_id)}
+            seen = set()
+            for index, meter_data in enumerate(meters):
+                if not isinstance(meter_data, dict):
+                    results.append({"index": index, "success": False, "message": "数据格式错误，应为JSON对象！"})
+                    continue
+                row, msg = EnergyService._prepare_meter_row(meter_data, factory_ids)
+                if row and row["meter_id"] in seen:
+                    row, msg = None, "设备编号在本批次中重复！"
+                if not row:
+                    results.append({"index": index, "meter_id": meter_data.get("meter_id"), "success": False, "message": msg})
+                    continue
+                seen.add(row["meter_id"])
+                rows.append((index, row))
+                results.append({"index": index, "meter_id": row["meter_id"], "success": True})
+            
+            if not rows:
+                return False, "没有合法的设备数据！", results
+            
+            chunk_size = Config.BULK_INSERT_CHUNK_SIZE
+            for i in range(0, len(rows), chunk_size):
+                chunk = rows[i:i + chunk_size]
+                existing = {
+                    meter_id: (factory_id, energy_type) for meter_id, factory_id, energy_type in db.session.query(
+                        EnergyMeter.meter_id, EnergyMeter.factory_id, EnergyMeter.energy_type
+                    ).filter(EnergyMeter.meter_id.in_([row["meter_id"] for _, row in chunk]))
+                }
+                created, updated = [], []
+                for index, row in chunk:
+                    current = existing.get(row["meter_id"])
+                    if current is None:
+                        created.append(row)
+                        results[index]["action"] = "created"
+                    elif current != (row["factory_id"], row["energy_type"]):
+                        results[index].update(success=False, message="不能通过导入修改已有设备的所属厂区或能源类型！")
+                    else:
+                        updated.append(row)
+                        results[index]["action"] = "updated"
+                if created:
+                    db.session.execute(insert(EnergyMeter).values(created))
+                if updated:
+                    db.session.execute(update(EnergyMeter), updated)
+            mark_meters_changed(db.session)
             db.session.commit()
-            return True, "设备删除成功！"
         except Exception as e:
             db.session.rollback()
-            return False, f"删除失败：{str(e)}"
+            for item in results:
+                if item["success"]:
+                    item.update(success=False, message=f"写入失败：{str(e)}")
+                    item.pop("action", None)
+            return False, f"批量导入失败：{str(e)}", results
+        
+        created = sum(1 for item in results if item.get("action") == "created")
+        updated = sum(1 for item in results if item.get("action") == "updated")
+        return True, f"批量导入完成：新增{created}台，更新{updated}台，失败{len(results) - created - updated}台！", results
+    
+    @staticmethod
+    def update_meters_status(meter_ids: list, run_status: str) -> tuple[bool, str, int]:
+        """
+        批量修改设备运行状态（一条 UPDATE ... WHERE meter_id IN (...) 语句）
+        :return: (是否成功, 提示信息, 匹配到的设备数)
+        """
+        if run_status not in EnergyMeter.run_status.type.enums:
+            return False, "运行状态必须是'正常'或'故障'！", 0
+        meter_ids = sorted({meter_id for meter_id in meter_ids if meter_id})
+        if not meter_ids:
+            return False, "没有设备编号！", 0
+        try:
+            matched = db.session.execute(
+                update(EnergyMeter).where(EnergyMeter.meter_id.in_(meter_ids)).values(run_status=run_status)
+            ).rowcount
+            mark_meters_changed(db.session)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return False, f"修改失败：{str(e)}", 0
+        missing = len(meter_ids) - matched
+        return True, f"已将{matched}台设备设为{run_status}" + (f"，{missing}台设备不存在！" if missing else "！"), matched
+    
+    @staticmethod
+    def _delete_meter_readings(meter_id: str, energy_type: str, limit: int = None) -> list:
+        """
+        按采集时间从早到晚删除某设备的 limit 条监测数据（为空时删除全部），并从峰谷报表中扣减（不提交事务）
+        按设备+时间索引取出本批编号后按主键删除，每批只锁住本批数据
+        :return: 本批删除的 (data_id, collect_time) 列表（按时间排序）
+        """
+        query = db.session.query(
+            EnergyMonitor.data_id, EnergyMonitor.factory_id, EnergyMonitor.collect_time,
+            EnergyMonitor.energy_value, EnergyMonitor.is_verified
+        ).filter(EnergyMonitor.meter_id == meter_id).order_by(EnergyMonitor.collect_time)
+        rows = query.limit(limit).all() if limit else query.all()
+        if not rows:
+            return []
+        db.session.query(EnergyMonitor).filter(
+            EnergyMonitor.data_id.in_([row.data_id for row in rows])
+        ).delete(synchronize_session=False)
+        # 峰谷报表扣减本批数据（延迟汇总模式下登记待重算）
+        apply_readings([
+            (meter_id, row.factory_id, energy_type, row.collect_time, row.energy_value)
+            for row in rows if counts_in_rollup(row.is_verified)
+        ], sign=-1)
+        return [(row.data_id, row.collect_time) for row in rows]
+    
+    @staticmethod
+    def delete_meters(meter_ids: list) -> tuple[bool, str, list]:
+        """
+        批量删除设备及其监测数据、小时汇总，并从峰谷报表中扣减
+        每台设备的监测数据按 METER_DELETE_CHUNK_SIZE 分批删除、逐批提交（报表随每批一起扣减，任何时刻都与明细一致）；
+        最后不足一批的数据与设备本身在同一事务中删除。中途失败时已提交的批次保留，重新执行即可继续
+        :return: (是否全部成功, 提示信息, 逐台结果列表 [{"meter_id", "success", "readings", "message"}])
+        """
+        chunk_size = Config.METER_DELETE_CHUNK_SIZE
+        results = []
+        for meter_id in dict.fromkeys(meter_ids):
+            item = {"meter_id": meter_id, "success": False, "readings": 0}
+            results.append(item)
+            meter = db.session.query(EnergyMeter.energy_type).filter_by(meter_id=meter_id).first()
+            if meter is None:
+                item["message"] = f"设备编号{meter_id}不存在！"
+                continue
+            try:
+                while True:
+                    deleted = EnergyService._delete_meter_readings(meter_id, meter.energy_type, chunk_size)
+                    item["readings"] += len(deleted)
+                    if len(deleted) < chunk_size:
+                        break
+                    # 本批之前的整小时数据已全部删除，直接删除小时汇总；最后一个小时可能还有数据，按明细重算
+                    last_hour = hour_start(deleted[-1][1])
+                    db.session.query(EnergyHourly).filter(
+                        EnergyHourly.meter_id == meter_id, EnergyHourly.hour_start < last_hour
+                    ).delete(synchronize_session=False)
+                    refresh_hourly([(meter_id, last_hour)])
+                    db.session.commit()
+                db.session.query(EnergyHourly).filter(EnergyHourly.meter_id == meter_id).delete(synchronize_session=False)
+                db.session.query(EnergyMeter).filter(EnergyMeter.meter_id == meter_id).delete(synchronize_session=False)
+                mark_meters_changed(db.session)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                item["message"] = f"删除失败：{str(e)}"
+                continue
+            item.update(success=True, message="设备删除成功！")
+            anomaly_detector.forget(meter_id)
+            # 已压缩日期的归档中也去掉该设备（未压缩日期的归档已随数据删除失效）
+            if archive_store.enabled:
+                remove_archived_meter(meter_id)
+        
+        succeeded = [item for item in results if item["success"]]
+        readings = sum(item["readings"] for item in results)
+        msg = f"批量删除完成：删除设备{len(succeeded)}台、监测数据{readings}条，失败{len(results) - len(succeeded)}台！"
+        return len(succeeded) == len(results), msg, results
     
     # -------------------------- 2. 能耗监测数据管理 --------------------------
+    @staticmethod
+    def _prepare_monitor_row(monitor_data: dict, meter: MeterInfo) -> tuple[dict, str]:
+        """校验单条监测数据并生成待插入的行（校验失败时返回None和原因）"""
+        if not meter:
+            return None, f"关联设备{monitor_data.get('meter_id')}不存在！"
+        # 验证能耗值合法性
+        try:
+            energy_value = float(monitor_data["energy_value"])
+        except (KeyError, TypeError, ValueError):
+            return None, f"能耗值{monitor_data.get('energy_value')}不合法（非负且不超过阈值）！"
+        if not verify_energy_value(meter.energy_type, energy_value):
+            return None, f"能耗值{monitor_data['energy_value']}不合法（非负且不超过阈值）！"
+        try:
+            collect_time = datetime.strptime(monitor_data["collect_time"], "%Y-%m-%d %H:%M:%S")
+        except (KeyError, TypeError, ValueError):
+            return None, f"采集时间{monitor_data.get('collect_time')}格式错误（应为YYYY-mm-dd HH:MM:SS）！"
+        # 标记是否需要核实（数据质量为中/差时）
+        data_quality = monitor_data.get("data_quality") or "良"
+        if data_quality not in DATA_QUALITIES:
+            return None, f"数据质量{data_quality}不合法！"
+        is_verified = False if data_quality in ["中", "差"] else True
+        # 厂区编号可省略（取设备所属厂区），填写时必须与设备所属厂区一致
+        factory_id = monitor_data.get("factory_id") or meter.factory_id
+        if not isinstance(factory_id, str) or len(factory_id) > 20 or factory_id != meter.factory_id:
+            return None, f"厂区编号{factory_id}与设备{meter.meter_id}所属厂区不一致！"
+        return {
+            "meter_id": meter.meter_id,
+            "collect_time": collect_time,
+            "energy_value": energy_value,
+            # 自动设置单位（根据能源类型）
+            "unit": UNIT_MAP[meter.energy_type],
+            "data_quality": data_quality,
+            "factory_id": factory_id,
+            "is_verified": is_verified
+        }, ""
+
     @staticmethod
     def add_energy_monitor(monitor_data: dict) -> tuple[bool, str]:
         """新增能耗监测数据（含数据质量校验）"""
         try:
-            # 验证设备是否存在
-            meter = EnergyMeter.query.filter_by(meter_id=monitor_data["meter_id"]).first()
-            if not meter:
-                return False, f"关联设备{monitor_data['meter_id']}不存在！"
-            # 验证能耗值合法性
-            if not verify_energy_value(meter.energy_type, monitor_data["energy_value"]):
-                return False, f"能耗值{monitor_data['energy_value']}不合法（非负且不超过阈值）！"
+            # 验证设备是否存在（查询内存中的设备信息，不访问数据库）
+            meter = meter_registry.get(monitor_data["meter_id"])
+            row, msg = EnergyService._prepare_monitor_row(monitor_data, meter)
+            if not row:
+                return False, msg
             # 生成数据编号
             data_id = generate_data_id("monitor")
-            # 自动设置单位（根据能源类型）
-            unit_map = {"水": "m³", "蒸汽": "t", "天然气": "m³"}
-            unit = unit_map[meter.energy_type]
-            # 标记是否需要核实（数据质量为中/差时）
-            data_quality = monitor_data.get("data_quality", "良")
-            is_verified = False if data_quality in ["中", "差"] else True
+            row["data_id"] = data_id
             
-            # 创建监测数据对象
-            new_monitor = EnergyMonitor(
-                data_id=data_id,
-                meter_id=monitor_data["meter_id"],
-                collect_time=datetime.strptime(monitor_data["collect_time"], "%Y-%m-%d %H:%M:%S"),
-                energy_value=monitor_data["energy_value"],
-                unit=unit,
-                data_quality=data_quality,
-                factory_id=monitor_data["factory_id"],
-                is_verified=is_verified
-            )
-            db.session.add(new_monitor)
-            db.session.commit()
+            saved = EnergyService.save_monitor_rows([row])
+            note = f"，{row['anomaly_reason']}，已标记为待核实" if row.get("anomaly_reason") else ""
+            if saved:
+                return True, f"监测数据新增成功（编号：{data_id}{note}）！"
+            return True, f"监测数据已接收，等待写入（编号：{data_id}{note}）！"
+        except IngestBusyError:
+            raise
+        except Exception as e:
+            db.session.rollback()
+            return False, f"新增失败：{str(e)}"
+    
+    @staticmethod
+    def add_energy_monitor_batch(readings: list) -> tuple[bool, str, list]:
+        """
+        批量新增能耗监测数据（网关批量上报）
+        一次查询所有关联设备，校验后在同一事务内按批多行插入，
+        峰谷报表按（厂区, 能源类型, 日期）合并增量后每批只更新一次。
+        :return: (是否成功, 提示信息, 逐条结果列表)
+        """
+        results = []
+        rows = []
+        try:
+            # 本批次涉及的设备直接从内存中取
+            meter_ids = {r.get("meter_id") for r in readings if isinstance(r, dict) and r.get("meter_id")}
+            meters = meter_registry.get_many(meter_ids)
+            
+            # 逐条校验（纯内存操作，不访问数据库）
+            for index, reading in enumerate(readings):
+                if not isinstance(reading, dict):
+                    results.append({"index": index, "success": False, "message": "数据格式错误，应为JSON对象！"})
+                    continue
+                row, msg = EnergyService._prepare_monitor_row(reading, meters.get(reading.get("meter_id")))
+                if not row:
+                    results.append({"index": index, "success": False, "message": msg})
+                    continue
+                row["data_id"] = generate_data_id("monitor")
+                rows.append(row)
+                results.append({"index": index, "success": True, "data_id": row["data_id"]})
             
-            # 自动触发峰谷数据生成（按日统计，当天数据仅生成一次）
-            stat_date = new_monitor.collect_time.date()
-            if not PeakValleyEnergy.query.filter_by(
-                energy_type=meter.energy_type,
-                factory_id=monitor_data["factory_id"],
-                stat_date=stat_date
-            ).first():
-                EnergyService.generate_peak_valley_daily(meter.energy_type, monitor_data["factory_id"], stat_date)
+            if not rows:
+                return False, "没有合法的监测数据！", results
             
-            return True, f"监测数据新增成功（编号：{data_id}）！"
+            saved = EnergyService.save_monitor_rows(rows)
+            reasons = {row["data_id"]: row["anomaly_reason"] for row in rows if row.get("anomaly_reason")}
+            for item in results:
+                if item.get("data_id") in reasons:
+                    item["anomaly_reason"] = reasons[item["data_id"]]
+        except IngestBusyError:
+            raise
         except Exception as e:
             db.session.rollback()
-            return False, f"新增失败：{str(e)}"
+            for item in results:
+                if item["success"]:
+                    item.update(success=False, message=f"写入失败：{str(e)}")
+                    item.pop("data_id")
+            return False, f"批量新增失败：{str(e)}", results
+        
+        accepted = len(rows)
+        if not saved:
+            return True, f"批量接收完成：接收{accepted}条，失败{len(results) - accepted}条，后台写入中！", results
+        return True, f"批量新增完成：成功{accepted}条，失败{len(results) - accepted}条！", results
     
     @staticmethod
-    def get_monitor_data(filters: dict) -> list:
-        """查询能耗监测数据（支持多条件筛选）"""
-        query = EnergyMonitor.query.join(EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id)
-        # 筛选条件：设备编号、厂区、时间范围、数据质量
+    def write_monitor_rows(rows: list) -> None:
+        """
+        把已校验的监测数据写入数据库，并增量更新小时汇总和峰谷报表（不提交事务）
+        单事务内分批多行插入；汇总表整批按（设备, 小时）和（厂区, 能源类型, 日期）合并增量，每个键只更新一次
+        延迟汇总模式下峰谷报表只登记待重算的键，由后台汇总任务重算（见 rollup_worker）
+        """
+        meters = meter_registry.get_many({row["meter_id"] for row in rows})
+        if len(meters) < len({row["meter_id"] for row in rows}):
+            # 异步写入时设备可能已在排队期间被删除
+            dropped = [row["data_id"] for row in rows if row["meter_id"] not in meters]
+            logger.warning("设备已删除，丢弃%d条监测数据：%s", len(dropped), dropped[:10])
+            rows = [row for row in rows if row["meter_id"] in meters]
+        # 多行 INSERT 要求每行的列相同（只有可疑数据带 anomaly_reason）
+        for row in rows:
+            row.setdefault("anomaly_reason", None)
+        chunk_size = Config.BULK_INSERT_CHUNK_SIZE
+        for i in range(0, len(rows), chunk_size):
+            db.session.execute(insert(EnergyMonitor).values(rows[i:i + chunk_size]))
+        batch = [
+            (row["meter_id"], row["factory_id"], meters[row["meter_id"]].energy_type, row["collect_time"], row["energy_value"])
+            for row in rows
+        ]
+        apply_hourly(batch)
+        apply_readings(reading for reading, row in zip(batch, rows) if counts_in_rollup(row["is_verified"]))
+    
+    @staticmethod
+    def flush_monitor_rows(rows: list) -> None:
+        """写入一批监测数据并提交（异步写入队列的后台写入函数），失败时回滚并抛出异常"""
+        try:
+            EnergyService.write_monitor_rows(rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    @staticmethod
+    def filter_unsaved_rows(rows: list) -> list:
+        """剔除已入库的监测数据（按数据编号，从预写日志恢复时使用）"""
+        saved = set()
+        data_ids = [row["data_id"] for row in rows]
+        for i in range(0, len(data_ids), Config.BULK_INSERT_CHUNK_SIZE):
+            chunk = data_ids[i:i + Config.BULK_INSERT_CHUNK_SIZE]
+            saved.update(r[0] for r in db.session.query(EnergyMonitor.data_id).filter(EnergyMonitor.data_id.in_(chunk)))
+        return [row for row in rows if row["data_id"] not in saved]
+    
+    @staticmethod
+    def start_ingest_queue(app) -> None:
+        """启动异步写入队列的后台线程（重复调用无副作用）"""
+        ingest_queue.start(app, EnergyService.flush_monitor_rows, EnergyService.filter_unsaved_rows)
+    
+    @staticmethod
+    def save_monitor_rows(rows: list) -> bool:
+        """
+        保存已校验的监测数据：异步模式下放入写入队列，否则直接写库并提交
+        :return: 是否已写入数据库（False 表示已进入队列等待后台写入）
+        :raises IngestBusyError: 异步模式下队列已满或后台写入异常
+        """
+        # 在线异常检测：可疑数据标记为未核实并记录原因（纯内存计算）
+        # 统计量在写入成功后才更新：被拒绝（429/503）或回滚的数据不影响基线，客户端重试也不会重复计入
+        detecting = Config.ANOMALY_DETECTION_ENABLED
+        if detecting:
+            anomaly_detector.score_rows(rows, commit=False)
+        if Config.INGEST_MODE == "async":
+            if not ingest_queue.running:
+                EnergyService.start_ingest_queue(current_app._get_current_object())
+            ingest_queue.submit(rows)
+            saved = False
+        else:
+            EnergyService.write_monitor_rows(rows)
+            db.session.commit()
+            saved = True
+        if detecting:
+            anomaly_detector.learn_rows(rows)
+        return saved
+    
+    @staticmethod
+    def apply_monitor_filters(query, filters: dict):
+        """为监测数据查询追加筛选条件（列表、分页、导出共用）"""
+        # 筛选条件：设备编号（精确或模糊）、厂区、时间范围、数据质量
         if filters.get("meter_id"):
             query = query.filter(EnergyMonitor.meter_id == filters["meter_id"])
+        if filters.get("meter_keyword"):
+            query = query.filter(EnergyMonitor.meter_id.like(f"%{filters['meter_keyword']}%"))
         if filters.get("factory_id"):
             query = query.filter(EnergyMonitor.factory_id == filters["factory_id"])
-        if filters.get("start_time") and filters.get("end_time"):
-            start_time = datetime.strptime(filters["start_time"], "%Y-%m-%d %H:%M:%S")
-            end_time = datetime.strptime(filters["end_time"], "%Y-%m-%d %H:%M:%S")
-            query = query.filter(EnergyMonitor.collect_time.between(start_time, end_time))
+        if filters.get("start_time"):
+            query = query.filter(EnergyMonitor.collect_time >= parse_datetime(filters["start_time"]))
+        if filters.get("end_time"):
+            query = query.filter(EnergyMonitor.collect_time <= parse_datetime(filters["end_time"]))
         if filters.get("data_quality"):
             query = query.filter(EnergyMonitor.data_quality == filters["data_quality"])
+        return query
+    
+    @staticmethod
+    def _monitor_query(filters: dict):
+        """按筛选条件构建监测数据查询（关联设备表，并预先加载设备信息，避免模板中逐条查询设备）"""
+        query = EnergyMonitor.query.join(
+            EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id
+        ).options(contains_eager(EnergyMonitor.meter))
+        return EnergyService.apply_monitor_filters(query, filters)
+    
+    @staticmethod
+    def get_monitor_data(filters: dict) -> list:
+        """查询能耗监测数据（支持多条件筛选）"""
         # 按采集时间降序
-        return query.order_by(EnergyMonitor.collect_time.desc()).all()
+        return EnergyService._monitor_query(filters).order_by(EnergyMonitor.collect_time.desc()).all()
+    
+    @staticmethod
+    def get_monitor_page(filters: dict, cursor: str = None, limit: int = None) -> tuple[list, str]:
+        """
+        按游标分页查询监测数据（按 采集时间+编号 降序，翻页不随历史数据量变慢）
+        :param cursor: 上一页返回的游标，为空时查询第一页
+        :param limit: 每页条数（不超过 Config.MONITOR_PAGE_MAX_SIZE）
+        :return: (本页数据, 下一页游标)，没有下一页时游标为None
+        """
+        limit = max(1, min(limit or Config.MONITOR_PAGE_SIZE, Config.MONITOR_PAGE_MAX_SIZE))
+        query = EnergyService._monitor_query(filters)
+        if cursor:
+            last_time, last_id = decode_cursor(cursor)
+            query = query.filter(or_(
+                EnergyMonitor.collect_time < last_time,
+                and_(EnergyMonitor.collect_time == last_time, EnergyMonitor.data_id < last_id)
+            ))
+        # 多取一条用于判断是否还有下一页
+        rows = query.order_by(EnergyMonitor.collect_time.desc(), EnergyMonitor.data_id.desc()).limit(limit + 1).all()
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].collect_time, rows[-1].data_id)
     
     @staticmethod
     def verify_monitor_data(data_id: str) -> tuple[bool, str]:
@@ -159,6 +549,9 @@ class EnergyService:
             monitor = EnergyMonitor.query.filter_by(data_id=data_id).first()
             if not monitor:
                 return False, f"监测数据{data_id}不存在！"
+            # 只统计已核实数据时，核实通过的数据此时才计入峰谷报表
+            if not monitor.is_verified and not counts_in_rollup(False):
+                apply_readings([(monitor.meter_id, monitor.factory_id, monitor.meter.energy_type, monitor.collect_time, monitor.energy_value)])
             monitor.is_verified = True
             db.session.commit()
             return True, "数据审核通过！"
@@ -166,72 +559,82 @@ class EnergyService:
             db.session.rollback()
             return False, f"审核失败：{str(e)}"
     
+    @staticmethod
+    def delete_monitor_data(data_id: str) -> tuple[bool, str]:
+        """删除监测数据（同时从峰谷报表中扣减，并重算所在小时的汇总）"""
+        try:
+            monitor = EnergyMonitor.query.filter_by(data_id=data_id).first()
+            if not monitor:
+                return False, f"监测数据{data_id}不存在！"
+            if counts_in_rollup(monitor.is_verified):
+                apply_readings([(monitor.meter_id, monitor.factory_id, monitor.meter.energy_type, monitor.collect_time, monitor.energy_value)], sign=-1)
+            db.session.delete(monitor)
+            # 最小值/最大值无法扣减，删除后按明细重算该小时
+            refresh_hourly([(monitor.meter_id, monitor.collect_time)])
+            db.session.commit()
+            return True, "数据删除成功！"
+        except Exception as e:
+            db.session.rollback()
+            return False, f"删除失败：{str(e)}"
+    
     # -------------------------- 3. 峰谷能耗报表管理 --------------------------
     @staticmethod
-    def generate_peak_valley_daily(energy_type: str, factory_id: str, stat_date: date) -> tuple[bool, str]:
-        """生成每日峰谷能耗数据（按文档时段统计）"""
+    def generate_peak_valley_daily(energy_type: str, factory_id: str, stat_date: date, mode: str = None) -> tuple[bool, str]:
+        """
+        生成每日峰谷能耗数据（按文档时段统计，全量重算，已存在的报表会被覆盖）
+        :param mode: 汇总方式，sql=数据库内分时段求和，numpy=取出两列后数组汇总；默认取 Config.PEAK_VALLEY_ROLLUP_MODE
+        """
         try:
-            # 查询当天该厂区、该能源类型的所有监测数据
-            start_time = datetime.combine(stat_date, time(0, 0, 0))
-            end_time = datetime.combine(stat_date, time(23, 59, 59))
-            monitor_datas = EnergyMonitor.query.filter(
-                and_(
-                    EnergyMonitor.factory_id == factory_id,
-                    EnergyMonitor.collect_time.between(start_time, end_time)
-                )
-            ).join(EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id).filter(
-                EnergyMeter.energy_type == energy_type
-            ).all()
+            if (mode or Config.PEAK_VALLEY_ROLLUP_MODE) == "sql":
+                # 数据库内按时段求和，只返回四个时段的合计
+                period_sums = query_period_sums(energy_type, factory_id, stat_date, stat_date).get(stat_date)
+            else:
+                # 查询当天该厂区、该能源类型的所有监测数据（只取采集时间和能耗值两列；已归档的日期读归档文件）
+                start_time = datetime.combine(stat_date, time(0, 0, 0))
+                end_time = datetime.combine(stat_date + timedelta(days=1), time(0, 0, 0))
+                archived_days, raw_ranges = split_range(start_time, end_time)
+                times, values = read_archive(archived_days, start_time, end_time, factory_id=factory_id, energy_type=energy_type,
+                                             verified_only=not counts_in_rollup(False))
+                raw_filter = raw_range_filter(raw_ranges)
+                if raw_filter is not None:
+                    query = db.session.query(EnergyMonitor.collect_time, EnergyMonitor.energy_value).filter(
+                        EnergyMonitor.factory_id == factory_id, raw_filter
+                    ).join(EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id).filter(
+                        EnergyMeter.energy_type == energy_type
+                    )
+                    if not counts_in_rollup(False):
+                        query = query.filter(EnergyMonitor.is_verified.is_(True))
+                    raw_times, raw_values = rows_to_arrays(query.all())
+                    times, values = np.concatenate([times, raw_times]), np.concatenate([values, raw_values])
+                # 按时段统计能耗（查表 + 数组汇总，不逐条判断）
+                period_sums = tariff_registry.timeline(factory_id, energy_type).aggregate(times, values) if len(times) else None
             
-            if not monitor_datas:
+            if not period_sums:
                 return False, f"{stat_date} {factory_id} {energy_type}无监测数据，无法生成峰谷报表！"
             
-            # 按时段统计能耗
-            peak_energy = 0  # 尖峰
-            high_energy = 0  # 高峰
-            flat_energy = 0  # 平段
-            valley_energy = 0  # 低谷
-            
-            for data in monitor_datas:
-                period_type = get_period_type(data.collect_time)
-                if period_type == "peak":
-                    peak_energy += data.energy_value
-                elif period_type == "high":
-                    high_energy += data.energy_value
-                elif period_type == "flat":
-                    flat_energy += data.energy_value
-                elif period_type == "valley":
-                    valley_energy += data.energy_value
-            
-            # 计算总能耗和成本
-            total_energy = peak_energy + high_energy + flat_energy + valley_energy
-            # 取对应能源类型的电价（此处简化：统一用配置的电价，实际可按能源类型调整）
-            price = Config.PEAK_VALLEY_PRICES
-            total_cost = (peak_energy * price["peak"]) + (high_energy * price["high"]) + (flat_energy * price["flat"]) + (valley_energy * price["valley"])
-            
-            # 生成峰谷记录编号
-            record_id = generate_data_id("peak")
-            # 创建峰谷数据对象
-            new_peak_valley = PeakValleyEnergy(
-                record_id=record_id,
-                energy_type=energy_type,
-                factory_id=factory_id,
-                stat_date=stat_date,
-                peak_energy=round(peak_energy, 2),
-                high_energy=round(high_energy, 2),
-                flat_energy=round(flat_energy, 2),
-                valley_energy=round(valley_energy, 2),
-                total_energy=round(total_energy, 2),
-                peak_valley_price=round(price["peak"], 2),  # 存储尖峰电价（可扩展为多电价）
-                energy_cost=round(total_cost, 2)
-            )
-            db.session.add(new_peak_valley)
+            # 计算总能耗和成本，写入（或覆盖）峰谷数据
+            existing = PeakValleyEnergy.query.filter_by(
+                energy_type=energy_type, factory_id=factory_id, stat_date=stat_date
+            ).first()
+            save_daily_rollup(energy_type, factory_id, stat_date, period_sums, existing)
+            refresh_monthly([(factory_id, energy_type, stat_date)])
             db.session.commit()
             return True, f"{stat_date} {factory_id} {energy_type}峰谷报表生成成功！"
         except Exception as e:
             db.session.rollback()
             return False, f"报表生成失败：{str(e)}"
     
+    @staticmethod
+    def backfill_peak_valley(energy_type: str, factory_id: str, start_date: date, end_date: date, replace: bool = False) -> tuple[bool, str]:
+        """按日期区间批量补算峰谷报表（数据库内一条分组语句汇总所有日期）"""
+        try:
+            created, replaced = backfill_peak_valley(energy_type, factory_id, start_date, end_date, replace)
+            db.session.commit()
+            return True, f"{factory_id} {energy_type} {start_date}至{end_date}峰谷报表补算完成：新增{created}天，覆盖{replaced}天！"
+        except Exception as e:
+            db.session.rollback()
+            return False, f"报表补算失败：{str(e)}"
+    
     @staticmethod
     def get_peak_valley_daily(factory_id: str, stat_date: date, energy_type: str = None) -> list:
         """查询每日峰谷能耗报表"""
@@ -245,40 +648,93 @@ class EnergyService:
             query = query.filter(PeakValleyEnergy.energy_type == energy_type)
         return query.all()
     
+    @staticmethod
+    def get_factory_ranking(start_date: date, end_date: date, energy_type: str = None, metric: str = "total",
+                            baseline: str = "mean", threshold: float = None, page: int = 1, page_size: int = None) -> dict:
+        """
+        厂区能耗排名（按日期区间汇总后与同类厂区的平均值或百分位数比较，参数与返回值见 rank_factories）
+        参数错误时抛出 ValueError
+        """
+        # 报表查询走只读副本
+        with read_replica():
+            return rank_factories(start_date, end_date, energy_type, metric, baseline, threshold, page, page_size)
+    
     @staticmethod
     def get_high_consumption_factories(stat_date: date, threshold: float = 30) -> list:
-        """定位高耗能区域（能耗超平均值{threshold}%的厂区）"""
+        """定位高耗能区域（当天能耗超同类厂区平均值{threshold}%的厂区，查询失败时抛出异常）"""
+        ranking = EnergyService.get_factory_ranking(stat_date, stat_date, threshold=threshold, page_size=0)
+        return [{
+            "factory_id": item["factory_id"],
+            "energy_type": item["energy_type"],
+            "total_energy": item["total_energy"],
+            "avg_energy": item["baseline"],
+            "exceed_rate": item["exceed_rate"]  # 超平均率
+        } for item in ranking["items"]]
+
+    # -------------------------- 4. 峰谷电价方案管理 --------------------------
+    @staticmethod
+    def get_tariff_schedules(energy_type: str = None, factory_id: str = None) -> list:
+        """查询电价方案（按能源类型、厂区、生效日期排序）"""
+        query = TariffSchedule.query
+        if energy_type:
+            query = query.filter(TariffSchedule.energy_type == energy_type)
+        if factory_id:
+            query = query.filter(TariffSchedule.factory_id == factory_id)
+        return query.order_by(TariffSchedule.energy_type, TariffSchedule.factory_id, TariffSchedule.effective_date).all()
+
+    @staticmethod
+    def save_tariff_schedule(schedule_data: dict) -> tuple[bool, str]:
+        """
+        新增电价方案，同一能源类型、厂区、生效日期已有方案时覆盖
+        已生成的峰谷报表不会自动重算，需对生效日期之后的区间执行 flask --app app backfill-rollups
+        :param schedule_data: {"energy_type", "factory_id"(可选), "effective_date"(YYYY-MM-DD), "periods", "prices"}
+        """
         try:
-            # 计算当天所有厂区的平均能耗（按能源类型分组）
-            avg_subquery = db.session.query(
-                PeakValleyEnergy.energy_type,
-                func.avg(PeakValleyEnergy.total_energy).label("avg_energy")
-            ).filter(PeakValleyEnergy.stat_date == stat_date).group_by(PeakValleyEnergy.energy_type).subquery()
-            
-            # 查询超平均值的厂区
-            high_consume = db.session.query(
-                PeakValleyEnergy,
-                avg_subquery.c.avg_energy
-            ).join(
-                avg_subquery,
-                PeakValleyEnergy.energy_type == avg_subquery.c.energy_type
-            ).filter(
-                and_(
-                    PeakValleyEnergy.stat_date == stat_date,
-                    PeakValleyEnergy.total_energy > avg_subquery.c.avg_energy * (1 + threshold / 100)
+            energy_type = schedule_data.get("energy_type")
+            if energy_type not in UNIT_MAP:
+                return False, "能源类型必须是'水'、'蒸汽'或'天然气'！"
+            factory_id = schedule_data.get("factory_id") or None
+            effective_date = datetime.strptime(schedule_data["effective_date"], "%Y-%m-%d").date()
+            periods, prices = schedule_data["periods"], schedule_data["prices"]
+            for name, ranges in periods.items():
+                if name not in PERIOD_TYPES:
+                    return False, f"未知的时段类型：{name}"
+                for period in ranges:
+                    period_ranges(period)
+            if set(prices) != set(PERIOD_TYPES) or any(float(v) < 0 for v in prices.values()):
+                return False, "需为尖峰、高峰、平段、低谷分别设置非负单价！"
+
+            schedule = TariffSchedule.query.filter(
+                TariffSchedule.energy_type == energy_type,
+                TariffSchedule.factory_id.is_(None) if factory_id is None else TariffSchedule.factory_id == factory_id,
+                TariffSchedule.effective_date == effective_date
+            ).first()
+            if schedule is None:
+                schedule = TariffSchedule(
+                    schedule_id=generate_data_id("tariff"), energy_type=energy_type,
+                    factory_id=factory_id, effective_date=effective_date
                 )
-            ).all()
-            
-            # 格式化返回结果
-            result = []
-            for item, avg_energy in high_consume:
-                result.append({
-                    "factory_id": item.factory_id,
-                    "energy_type": item.energy_type,
-                    "total_energy": item.total_energy,
-                    "avg_energy": round(avg_energy, 2),
-                    "exceed_rate": round((item.total_energy - avg_energy) / avg_energy * 100, 2)  # 超平均率
-                })
-            return result
+                db.session.add(schedule)
+            schedule.periods = {name: list(ranges) for name, ranges in periods.items()}
+            schedule.prices = {name: float(prices[name]) for name in PERIOD_TYPES}
+            db.session.commit()
+            return True, f"{energy_type}电价方案（{factory_id or '全部厂区'}，{effective_date}起）保存成功！"
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            return False, f"电价方案格式错误：{str(e)}"
+        except Exception as e:
+            db.session.rollback()
+            return False, f"电价方案保存失败：{str(e)}"
+
+    @staticmethod
+    def delete_tariff_schedule(schedule_id: str) -> tuple[bool, str]:
+        """删除电价方案"""
+        try:
+            schedule = TariffSchedule.query.get(schedule_id)
+            if not schedule:
+                return False, f"电价方案{schedule_id}不存在！"
+            db.session.delete(schedule)
+            db.session.commit()
+            return True, "电价方案删除成功！"
         except Exception as e:
-            return f"查询失败：{str(e)}"
\ No newline at end of file
+            db.session.rollback()
+            return False, f"删除失败：{str(e)}"
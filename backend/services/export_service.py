@@ -0,0 +1,168 @@
+"""
+监测数据与峰谷报表的流式导出（CSV / Parquet / Arrow IPC）
+数据通过服务端游标（yield_per）分批读取，每批编码后立即输出，内存占用与导出总行数无关
+"""
+import csv
+import io
+from datetime import datetime
+from database import db
+from models import EnergyMeter, EnergyMonitor, PeakValleyEnergy
+from services.energy_service import EnergyService
+from config import Config
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 未安装 pyarrow 时只支持 CSV 导出
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+# 导出列：(列名, 查询列, 列类型)
+MONITOR_COLUMNS = [
+    ("data_id", EnergyMonitor.data_id, "string"),
+    ("meter_id", EnergyMonitor.meter_id, "string"),
+    ("energy_type", EnergyMeter.energy_type, "string"),
+    ("factory_id", EnergyMonitor.factory_id, "string"),
+    ("collect_time", EnergyMonitor.collect_time, "timestamp"),
+    ("energy_value", EnergyMonitor.energy_value, "float"),
+    ("unit", EnergyMonitor.unit, "string"),
+    ("data_quality", EnergyMonitor.data_quality, "string"),
+    ("is_verified", EnergyMonitor.is_verified, "bool"),
+]
+
+PEAK_VALLEY_COLUMNS = [
+    ("record_id", PeakValleyEnergy.record_id, "string"),
+    ("factory_id", PeakValleyEnergy.factory_id, "string"),
+    ("energy_type", PeakValleyEnergy.energy_type, "string"),
+    ("stat_date", PeakValleyEnergy.stat_date, "date"),
+    ("peak_energy", PeakValleyEnergy.peak_energy, "float"),
+    ("high_energy", PeakValleyEnergy.high_energy, "float"),
+    ("flat_energy", PeakValleyEnergy.flat_energy, "float"),
+    ("valley_energy", PeakValleyEnergy.valley_energy, "float"),
+    ("total_energy", PeakValleyEnergy.total_energy, "float"),
+    ("peak_valley_price", PeakValleyEnergy.peak_valley_price, "float"),
+    ("energy_cost", PeakValleyEnergy.energy_cost, "float"),
+]
+
+
+def monitor_export_query(filters: dict):
+    """监测数据导出查询（筛选条件与 get_monitor_data 一致，按采集时间升序）"""
+    query = db.session.query(*[column for _, column, _ in MONITOR_COLUMNS]).join(
+        EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id
+    )
+    query = EnergyService.apply_monitor_filters(query, filters)
+    return query.order_by(EnergyMonitor.collect_time, EnergyMonitor.data_id)
+
+
+def peak_valley_export_query(filters: dict):
+    """峰谷报表导出查询（按厂区、日期区间、能源类型筛选）"""
+    query = db.session.query(*[column for _, column, _ in PEAK_VALLEY_COLUMNS])
+    if filters.get("factory_id") and filters["factory_id"] != "all":
+        query = query.filter(PeakValleyEnergy.factory_id == filters["factory_id"])
+    if filters.get("start_date"):
+        query = query.filter(PeakValleyEnergy.stat_date >= datetime.strptime(filters["start_date"], "%Y-%m-%d").date())
+    if filters.get("end_date"):
+        query = query.filter(PeakValleyEnergy.stat_date <= datetime.strptime(filters["end_date"], "%Y-%m-%d").date())
+    if filters.get("energy_type"):
+        query = query.filter(PeakValleyEnergy.energy_type == filters["energy_type"])
+    return query.order_by(PeakValleyEnergy.stat_date, PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type)
+
+
+def iter_batches(query, batch_size: int = None):
+    """通过服务端游标分批读取查询结果，每次产出一批结果行"""
+    result = db.session.execute(query.statement, execution_options={"yield_per": batch_size or Config.EXPORT_BATCH_SIZE})
+    for partition in result.partitions():
+        yield partition
+
+
+def stream_csv(columns: list, batches):
+    """把结果批次编码为 CSV 文本块（带 BOM，便于 Excel 直接打开中文）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _, _ in columns])
+    yield "\ufeff" + buffer.getvalue()
+    for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+
+
+class _ChunkSink:
+    """供 pyarrow 写入的内存缓冲：每写完一批就取走已编码的字节，缓冲不会累积"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _arrow_schema(columns: list):
+    types = {"string": pa.string(), "timestamp": pa.timestamp("s"), "float": pa.float64(),
+             "bool": pa.bool_(), "date": pa.date32()}
+    return pa.schema([(name, types[kind]) for name, _, kind in columns])
+
+
+def stream_arrow(columns: list, batches, fmt: str):
+    """把结果批次编码为 Parquet（每批一个 row group）或 Arrow IPC 流"""
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema) if fmt == "parquet" else pa.ipc.new_stream(sink, schema)
+    try:
+        for rows in batches:
+            values = list(zip(*rows))
+            batch = pa.record_batch([pa.array(values[i], type=schema.field(i).type) for i in range(len(columns))], schema=schema)
+            if fmt == "parquet":
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_stream(dataset: str, fmt: str, filters: dict):
+    """
+    生成导出数据流
+    :param dataset: monitor=监测数据, peak_valley=峰谷报表
+    :param fmt: csv / parquet / arrow
+    :return: 逐块产出导出内容的生成器，格式不支持时抛出ValueError
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式：{fmt}")
+    if fmt != "csv" and pa is None:
+        raise ValueError("导出 Parquet/Arrow 需要安装 pyarrow")
+    if dataset == "monitor":
+        columns, query = MONITOR_COLUMNS, monitor_export_query(filters)
+    elif dataset == "peak_valley":
+        columns, query = PEAK_VALLEY_COLUMNS, peak_valley_export_query(filters)
+    else:
+        raise ValueError(f"不支持的导出数据：{dataset}")
+    batches = iter_batches(query)
+    return stream_csv(columns, batches) if fmt == "csv" else stream_arrow(columns, batches, fmt)
@@ -0,0 +1,398 @@
+"""
+监测数据异步写入队列（Config.INGEST_MODE = "async" 时启用）
+- 接口校验数据后放入有界队列即返回，由后台线程按批写入数据库并更新汇总表
+- 可选预写日志（INGEST_WAL_PATH）：入队前先追加到本地文件，进程异常退出后重启时补写未入库的数据
+  每个进程写自己的分段文件，分段中的数据全部入库后即删除；启动时接管已退出进程留下的分段（见 WriteAheadLog）
+- 队列已满返回 429，后台写入持续失败时返回 503，由网关稍后重试
+- 整批写入失败而数据库可用时（数据本身有问题），改为逐条写入，仍失败的行写入死信文件（INGEST_DEAD_LETTER_PATH）后丢弃，
+  不会因为一条坏数据阻塞整个队列；数据库不可用时整批间隔重试
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from queue import Queue, Empty
+from sqlalchemy import text
+from database import db
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows：不加文件锁，启动时接管全部分段（只适用于单进程部署）
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class IngestBusyError(Exception):
+    """写入队列暂时无法接收数据"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _encode_row(row: dict) -> str:
+    return json.dumps(dict(row, collect_time=row["collect_time"].isoformat()), ensure_ascii=False)
+
+
+def _decode_row(line: str) -> dict:
+    row = json.loads(line)
+    row["collect_time"] = datetime.fromisoformat(row["collect_time"])
+    return row
+
+
+class WriteAheadLog:
+    """
+    按进程分段的预写日志（调用方负责加锁）
+    - 分段文件 {path}.{进程标识}.{序号}，进程运行期间持有 {path}.{进程标识}.lock 的文件锁
+    - 分段写满 segment_rows 条后换新分段；每批数据入库后检查，数据已全部入库的分段删除（当前分段清空）
+    - 启动时接管锁文件未被持有（进程已退出）的分段：数据转写到本进程的分段后删除原文件
+    """
+
+    def __init__(self, path: str, segment_rows: int):
+        """
+        :param path: 预写日志路径前缀
+        :param segment_rows: 每个分段最多写入的条数
+        """
+        self.path = path
+        self.segment_rows = segment_rows
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock_file = None
+        self._file = None
+        self._seq = 0
+        self._rows_in_segment = 0
+        self._pending = Counter()  # 分段序号 -> 尚未入库的条数
+
+    def _lock_path(self, owner: str) -> str:
+        return f"{self.path}.{owner}.lock"
+
+    def _segment_path(self, seq: int) -> str:
+        return f"{self.path}.{self.owner}.{seq:06d}"
+
+    def _segments_of(self, owner: str) -> list:
+        return sorted(glob.glob(f"{glob.escape(self.path)}.{glob.escape(owner)}.[0-9]*"))
+
+    def open(self) -> None:
+        """创建本进程的锁文件和第一个分段"""
+        # 先以临时文件名加锁再改名：其他进程能看到的锁文件要么已被持有，要么属于已退出的进程
+        temp_path = f"{self.path}.{self.owner}.tmp"
+        self._lock_file = open(temp_path, "w")
+        if fcntl:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        os.replace(temp_path, self._lock_path(self.owner))
+        self._file = open(self._segment_path(self._seq), "a", encoding="utf-8")
+
+    def append(self, rows: list) -> int:
+        """追加一批数据并落盘，返回所在分段的序号"""
+        if self._rows_in_segment >= self.segment_rows:
+            self._rotate()
+        self._file.write("".join(_encode_row(row) + "\n" for row in rows))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._rows_in_segment += len(rows)
+        self._pending[self._seq] += len(rows)
+        return self._seq
+
+    def _rotate(self) -> None:
+        self._file.close()
+        if not self._pending[self._seq]:
+            self._remove_segment(self._seq)
+        self._seq += 1
+        self._rows_in_segment = 0
+        self._file = open(self._segment_path(self._seq), "a", encoding="utf-8")
+
+    def _remove_segment(self, seq: int) -> None:
+        self._pending.pop(seq, None)
+        os.remove(self._segment_path(seq))
+
+    def checkpoint(self, seqs) -> None:
+        """一批数据已入库（或已转入死信）：删除数据已全部入库的分段"""
+        self._pending.subtract(Counter(seqs))
+        for seq in [seq for seq, count in self._pending.items() if count <= 0]:
+            if seq == self._seq:
+                self._pending.pop(seq)
+                self._file.truncate(0)
+                self._file.seek(0)
+                self._rows_in_segment = 0
+            else:
+                self._remove_segment(seq)
+
+    def recover(self, replay_filter=None) -> list:
+        """
+        接管已退出进程留下的分段（含旧版本的单一预写日志文件），数据转写到本进程的分段后删除原文件
+        :param replay_filter: replay_filter(rows)，剔除已入库的数据
+        :return: [(本进程分段序号, 数据行)]
+        """
+        files, locks = [], []
+        if os.path.exists(self.path):
+            legacy_path = f"{self.path}.{self.owner}.legacy"
+            try:
+                os.replace(self.path, legacy_path)  # 改名是原子操作，多个进程同时启动时只有一个能接管
+                files.append(legacy_path)
+            except FileNotFoundError:
+                pass
+        for lock_path in glob.glob(f"{glob.escape(self.path)}.*.lock"):
+            owner = lock_path[len(self.path) + 1:-len(".lock")]
+            if owner == self.owner:
+                continue
+            try:
+                handle = open(lock_path, "a")
+            except FileNotFoundError:
+                continue
+            try:
+                if fcntl:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()  # 进程仍在运行
+                continue
+            if not os.path.exists(lock_path):
+                handle.close()  # 已被其他进程接管
+                continue
+            locks.append((lock_path, handle))
+            files.extend(self._segments_of(owner))
+
+        rows = []
+        for file_path in files:
+            with open(file_path, encoding="utf-8") as f:
+                rows.extend(_decode_row(line) for line in f if line.strip())
+        if rows and replay_filter:
+            rows = replay_filter(rows)
+        seq = self.append(rows) if rows else None
+        for file_path in files:
+            os.remove(file_path)
+        for lock_path, handle in locks:
+            os.remove(lock_path)
+            handle.close()
+        return [(seq, row) for row in rows]
+
+    def close(self) -> None:
+        """关闭：删除数据已全部入库的分段；仍有未入库的数据时保留分段和锁文件，留待下次启动接管"""
+        self._file.close()
+        if not self._pending[self._seq]:
+            self._remove_segment(self._seq)
+        for seq in [seq for seq, count in self._pending.items() if count <= 0]:
+            self._remove_segment(seq)
+        if not self._pending:
+            os.remove(self._lock_path(self.owner))
+        self._lock_file.close()
+
+
+class IngestQueue:
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float, wal_path: str = None,
+                 retry_delay: float = 1.0, dead_letter_path: str = None):
+        """
+        :param max_size: 队列最多容纳的待写入条数
+        :param batch_size: 每次写入数据库的最大条数
+        :param flush_interval: 凑批的最长等待时间（秒）
+        :param wal_path: 预写日志路径前缀（各进程在其后加进程标识和分段序号），为空时不落盘
+        :param retry_delay: 写入失败后的重试间隔（秒）
+        :param dead_letter_path: 无法写入的数据行追加到该文件，为空时只记录日志
+        """
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.wal_path = wal_path
+        self.retry_delay = retry_delay
+        self.dead_letter_path = dead_letter_path
+        self._queue = Queue()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._wal = None
+        self.app = self.writer = None
+        self.healthy = True
+        self.last_error = None
+        self.accepted = self.rejected = self.written = 0
+        self.batches = self.failed_batches = self.dead_lettered = 0
+        self.last_flush_ms = self.max_flush_ms = self.total_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, app, writer, replay_filter=None) -> None:
+        """
+        启动后台写入线程（先补写预写日志中的数据）
+        :param writer: writer(rows)，在应用上下文中写入一批数据并提交，失败时抛出异常
+        :param replay_filter: replay_filter(rows)，从预写日志恢复的数据中剔除已入库的部分
+        """
+        with self._start_lock:
+            if self.running:
+                return
+            self.app, self.writer = app, writer
+            self._stopping.clear()
+            if self.wal_path:
+                self._wal = WriteAheadLog(self.wal_path, self.batch_size)
+                self._wal.open()
+                self._replay(replay_filter)
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 30) -> None:
+        """停止接收并等待队列中的数据写完"""
+        if not self.running:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        with self._lock:
+            if self._wal:
+                self._wal.close()
+                self._wal = None
+
+    def submit(self, rows: list) -> None:
+        """
+        整批放入队列（要么全部接收，要么全部拒绝）
+        :param rows: 已校验、已分配编号的监测数据行
+        :raises IngestBusyError: 队列已满（429）、后台写入异常或未启动（503）
+        """
+        if not self.running or self._stopping.is_set():
+            raise IngestBusyError("数据写入服务未启动，请稍后重试", 503)
+        with self._lock:
+            if not self.healthy:
+                self.rejected += len(rows)
+                raise IngestBusyError("数据库写入异常，请稍后重试", 503, int(self.retry_delay) + 1)
+            if self._queue.qsize() + len(rows) > self.max_size:
+                self.rejected += len(rows)
+                raise IngestBusyError(f"写入队列已满（{self.max_size}条），请稍后重试", 429)
+            seq = self._wal.append(rows) if self._wal else None
+            for row in rows:
+                self._queue.put_nowait((seq, row))
+            self.accepted += len(rows)
+
+    def _replay(self, replay_filter) -> None:
+        def in_app_context(rows):
+            with self.app.app_context():
+                return replay_filter(rows)
+
+        items = self._wal.recover(in_app_context if replay_filter else None)
+        for item in items:
+            self._queue.put_nowait(item)
+        if items:
+            logger.warning("从预写日志恢复%d条未入库的监测数据", len(items))
+
+    def _next_batch(self) -> list:
+        """等待第一条数据，再在 flush_interval 内凑满一批，返回 [(预写日志分段序号, 数据行)]"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _database_ok(self) -> bool:
+        """数据库是否可用（用于区分数据库故障和数据本身有问题）"""
+        try:
+            with self.app.app_context():
+                db.session.execute(text("SELECT 1"))
+                db.session.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _dead_letter(self, row: dict, error: Exception) -> None:
+        """记录并丢弃无法写入的数据行"""
+        self.dead_lettered += 1
+        logger.error("监测数据无法写入，已丢弃（%s）：%s", row.get("data_id"), error)
+        if self.dead_letter_path:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"row": json.loads(_encode_row(row)), "error": str(error)[:500]}, ensure_ascii=False) + "\n")
+
+    def _write_each(self, batch: list) -> list:
+        """
+        逐条写入一批数据，数据库可用而仍写入失败的行进入死信
+        :return: 因数据库不可用而未写入的行（需稍后重试）
+        """
+        for i, row in enumerate(batch):
+            try:
+                with self.app.app_context():
+                    self.writer([row])
+                self.written += 1
+            except Exception as e:
+                if not self._database_ok():
+                    return batch[i:]
+                self._dead_letter(row, e)
+        return []
+
+    def _flush(self, batch: list) -> bool:
+        """写入一批数据，数据库不可用时间隔重试（数据仍在预写日志中）；停止时最多重试3次，返回是否处理完"""
+        attempts = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    self.writer(batch)
+                self.written += len(batch)
+                batch = []
+            except Exception as e:
+                self.failed_batches += 1
+                self.last_error = str(e)
+                logger.exception("监测数据批量写入失败（%d条）", len(batch))
+                # 数据库可用说明批次中有写不进去的数据：逐条写入，隔离坏数据
+                batch = self._write_each(batch) if self._database_ok() else batch
+            if batch:
+                attempts += 1
+                self.healthy = False
+                if self._stopping.is_set() and attempts >= 3:
+                    return False
+                time.sleep(self.retry_delay)
+                continue
+            elapsed = (time.perf_counter() - started) * 1000
+            self.healthy = True
+            self.last_error = None
+            self.batches += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.total_flush_ms += elapsed
+            return True
+
+    def _checkpoint(self, items: list) -> None:
+        """一批数据处理完后删除预写日志中已全部入库的分段（放弃写入的批次不删除，留待下次启动补写）"""
+        with self._lock:
+            if self._wal:
+                self._wal.checkpoint(seq for seq, _ in items)
+
+    def _run(self) -> None:
+        while not (self._stopping.is_set() and self._queue.empty()):
+            items = self._next_batch()
+            if items and self._flush([row for _, row in items]):
+                self._checkpoint(items)
+
+    def metrics(self) -> dict:
+        return {
+            "running": self.running,
+            "healthy": self.healthy,
+            "depth": self._queue.qsize(),
+            "capacity": self.max_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "dead_lettered": self.dead_lettered,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.batches, 2) if self.batches else 0,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "last_error": self.last_error,
+        }
+
+
+ingest_queue = IngestQueue(
+    Config.INGEST_QUEUE_SIZE, Config.INGEST_BATCH_SIZE, Config.INGEST_FLUSH_INTERVAL, Config.INGEST_WAL_PATH,
+    dead_letter_path=Config.INGEST_DEAD_LETTER_PATH
+)
@@ -0,0 +1,144 @@
+"""
+进程内设备信息缓存：采集数据校验时直接查内存，不再逐条查询设备表
+- 设备新增/修改/删除时，在同一事务中把 registry_version 表中的版本号加一，提交后本进程立即重新加载
+- 其他进程每隔 Config.METER_REGISTRY_CHECK_INTERVAL 秒比对一次版本号，不一致时重新加载
+- 查询到不存在的设备时提前比对一次版本号（每 METER_REGISTRY_MISS_CHECK_INTERVAL 秒最多一次，避免不存在的编号每次都查库）
+"""
+import threading
+import time
+from typing import NamedTuple
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from database import db
+from models import EnergyMeter, RegistryVersion
+from config import Config
+
+REGISTRY_NAME = "meter"
+_METER_CHANGED = "meter_registry_changed"
+_VERSION_BUMPED = "meter_registry_version_bumped"
+
+
+class MeterInfo(NamedTuple):
+    """采集校验所需的设备信息（只读）"""
+    meter_id: str
+    factory_id: str
+    energy_type: str
+    run_status: str
+
+
+class MeterRegistry:
+    def __init__(self, check_interval: float = 5, miss_check_interval: float = 1):
+        self.check_interval = check_interval
+        self.miss_check_interval = miss_check_interval
+        self.version = None
+        self._meters = {}
+        self._checked_at = None  # 为空表示尚未加载或已失效
+        self._miss_checked_at = None  # 上次因设备不存在而比对版本号的时间
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _db_version() -> int:
+        version = db.session.execute(
+            select(RegistryVersion.version).where(RegistryVersion.name == REGISTRY_NAME)
+        ).scalar()
+        return version or 0
+
+    def load(self) -> None:
+        """从数据库加载全部设备（整体替换字典，读取方不需要加锁）"""
+        with self._lock:
+            version = self._db_version()
+            rows = db.session.execute(select(
+                EnergyMeter.meter_id, EnergyMeter.factory_id, EnergyMeter.energy_type, EnergyMeter.run_status
+            ).order_by(EnergyMeter.meter_id)).all()
+            self._meters = {row[0]: MeterInfo(*row) for row in rows}
+            self.version = version
+            self._checked_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """标记为过期，下次读取时重新加载"""
+        self._checked_at = None
+
+    def ensure_fresh(self, force_check: bool = False) -> None:
+        """未加载时加载；超过检查间隔（或 force_check）时比对版本号，不一致则重新加载"""
+        checked_at = self._checked_at
+        if checked_at is None:
+            self.load()
+        elif force_check or time.monotonic() - checked_at >= self.check_interval:
+            if self._db_version() != self.version:
+                self.load()
+            else:
+                self._checked_at = time.monotonic()
+
+    def _check_on_miss(self) -> None:
+        """本地未找到设备时比对版本号（限频），避免漏掉其他进程刚新增的设备"""
+        now = time.monotonic()
+        if self._miss_checked_at is not None and now - self._miss_checked_at < self.miss_check_interval:
+            return
+        self._miss_checked_at = now
+        self.ensure_fresh(force_check=True)
+
+    def get(self, meter_id: str) -> MeterInfo:
+        """按编号查询设备，不存在时返回None"""
+        self.ensure_fresh()
+        meter = self._meters.get(meter_id)
+        if meter is None and meter_id:
+            self._check_on_miss()
+            meter = self._meters.get(meter_id)
+        return meter
+
+    def get_many(self, meter_ids) -> dict:
+        """批量查询设备：{meter_id: MeterInfo}，不存在的编号不出现"""
+        self.ensure_fresh()
+        meters = self._meters
+        if any(meter_id not in meters for meter_id in meter_ids):
+            self._check_on_miss()
+            meters = self._meters
+        return {meter_id: meters[meter_id] for meter_id in meter_ids if meter_id in meters}
+
+    def first(self) -> MeterInfo:
+        """编号最小的设备（没有设备时返回None）"""
+        self.ensure_fresh()
+        return next(iter(self._meters.values()), None)
+
+
+meter_registry = MeterRegistry(Config.METER_REGISTRY_CHECK_INTERVAL, Config.METER_REGISTRY_MISS_CHECK_INTERVAL)
+
+
+def bump_version(connection, name: str = REGISTRY_NAME) -> None:
+    """版本号加一（记录不存在时创建）"""
+    table = RegistryVersion.__table__
+    updated = connection.execute(
+        table.update().where(table.c.name == name).values(version=table.c.version + 1)
+    ).rowcount
+    if not updated:
+        connection.execute(table.insert().values(name=name, version=1))
+
+
+def mark_changed(session) -> None:
+    """用批量语句（不经过 ORM 对象）修改设备表后调用：在同一事务内更新版本号，提交后重新加载（每个事务只加一次）"""
+    if not session.info.get(_VERSION_BUMPED):
+        bump_version(session.connection())
+    session.info[_METER_CHANGED] = session.info[_VERSION_BUMPED] = True
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_on_meter_change(session, flush_context):
+    # 设备表有变更时，在同一事务内更新版本号
+    if session.info.get(_VERSION_BUMPED):
+        return
+    if any(isinstance(obj, EnergyMeter) for obj in (*session.new, *session.dirty, *session.deleted)):
+        mark_changed(session)
+
+
+@event.listens_for(Session, "after_commit")
+def _reload_after_commit(session):
+    session.info.pop(_VERSION_BUMPED, None)
+    if session.info.pop(_METER_CHANGED, None):
+        meter_registry.invalidate()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_VERSION_BUMPED, None)
+        session.info.pop(_METER_CHANGED, None)
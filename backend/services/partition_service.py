@@ -0,0 +1,198 @@
+"""
+监测数据按月分区与过期数据压缩
+- MySQL：energy_monitor 按 collect_time 做 RANGE COLUMNS 按月分区，带采集时间范围的查询（列表、报表汇总）由优化器只扫描相关分区；
+  过期月份整分区删除（DROP PARTITION），不逐行删除
+- 其他数据库（SQLite 测试库等）没有原生分区：按月份的采集时间范围分批删除，接口与 MySQL 一致
+- 过期压缩：早于保留期的整月先重建小时汇总、补齐峰谷报表（启用归档时先导出该月归档）并记入 monitor_compaction，
+  再删除该月原始数据；已压缩且未归档的月份不再重建汇总（见 archive_service.clamp_to_source）
+"""
+from datetime import date, datetime, timedelta
+from sqlalchemy import inspect, func, text
+from database import db
+from models import EnergyMonitor, EnergyHourly, PeakValleyEnergy, MonitorCompaction
+from services.rollup_hierarchy import month_start, next_month, rebuild_hourly
+from services.rollup_service import backfill_peak_valley
+from services.archive_service import archive_store, archive_days
+from config import Config
+
+TABLE = EnergyMonitor.__tablename__
+MAX_PARTITION = "pmax"
+
+
+def partition_name(month: date) -> str:
+    return f"p{month:%Y%m}"
+
+
+def supports_native_partitions() -> bool:
+    return db.engine.dialect.name == "mysql"
+
+
+def _months(start: date, end: date) -> list:
+    """start 到 end（不含）之间每月的1日"""
+    months, month = [], month_start(start)
+    while month < end:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def _partition_clause(month: date) -> str:
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{next_month(month):%Y-%m-%d} 00:00:00')"
+
+
+def list_partitions() -> list:
+    """
+    监测数据的月份分区
+    :return: [{"name":..., "month": 当月1日（pmax 为 None）, "rows": 行数（MySQL 为估算值）}]
+    """
+    if supports_native_partitions():
+        rows = db.session.execute(text(
+            "SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION"
+        ), {"table": TABLE}).all()
+        return [{
+            "name": name,
+            "month": datetime.strptime(name[1:], "%Y%m").date() if name != MAX_PARTITION else None,
+            "rows": int(table_rows or 0),
+        } for name, table_rows in rows]
+    # 没有原生分区时按数据实际覆盖的月份列出
+    first, last = db.session.query(func.min(EnergyMonitor.collect_time), func.max(EnergyMonitor.collect_time)).one()
+    if first is None:
+        return []
+    partitions = []
+    for month in _months(first.date(), last.date() + timedelta(days=1)):
+        count = _count_month(month)
+        if count:
+            partitions.append({"name": partition_name(month), "month": month, "rows": count})
+    return partitions
+
+
+def _count_month(month: date) -> int:
+    return db.session.query(func.count()).select_from(EnergyMonitor).filter(
+        EnergyMonitor.collect_time >= month, EnergyMonitor.collect_time < next_month(month)
+    ).scalar()
+
+
+def partition_table(months_ahead: int = None) -> list:
+    """
+    把 energy_monitor 转为按月分区表（仅 MySQL，已分区时只补建后续月份）
+    MySQL 分区表的主键须包含分区列且不支持外键：主键改为 (data_id, collect_time)，并删除引用/被引用的外键
+    :return: 执行过的操作说明列表
+    """
+    if not supports_native_partitions():
+        return []
+    months_ahead = Config.MONITOR_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    if list_partitions():
+        return ensure_partitions(months_ahead)
+
+    actions = []
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table_name in (PeakValleyEnergy.__tablename__, TABLE):
+            for fk in inspector.get_foreign_keys(table_name):
+                if table_name == TABLE or fk["referred_table"] == TABLE:
+                    conn.execute(text(f"ALTER TABLE {table_name} DROP FOREIGN KEY {fk['name']}"))
+                    actions.append(f"删除外键 {table_name}.{fk['name']}")
+        first = conn.execute(text(f"SELECT MIN(collect_time) FROM {TABLE}")).scalar()
+        start = (first.date() if first else date.today())
+        end = next_month(month_start(date.today()))
+        for _ in range(months_ahead):
+            end = next_month(end)
+        months = _months(start, end)
+        clauses = [_partition_clause(m) for m in months] + [f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)"]
+        conn.execute(text(f"ALTER TABLE {TABLE} DROP PRIMARY KEY, ADD PRIMARY KEY (data_id, collect_time)"))
+        conn.execute(text(f"ALTER TABLE {TABLE} PARTITION BY RANGE COLUMNS(collect_time) ({', '.join(clauses)})"))
+    actions.append(f"{TABLE} 按月分区：{partition_name(months[0])} ~ {partition_name(months[-1])}")
+    return actions
+
+
+def ensure_partitions(months_ahead: int = None) -> list:
+    """预先建好当月之后 months_ahead 个月的分区（从 pmax 中拆分，pmax 为空时不移动数据）"""
+    if not supports_native_partitions():
+        return []
+    months_ahead = Config.MONITOR_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    existing = [p["month"] for p in list_partitions() if p["month"]]
+    if not existing:
+        return []
+    end = next_month(month_start(date.today()))
+    for _ in range(months_ahead):
+        end = next_month(end)
+    months = _months(next_month(max(existing)), end)
+    if not months:
+        return []
+    clauses = [_partition_clause(m) for m in months] + [f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)"]
+    with db.engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {TABLE} REORGANIZE PARTITION {MAX_PARTITION} INTO ({', '.join(clauses)})"))
+    return [f"新增分区 {partition_name(m)}" for m in months]
+
+
+def drop_month(month: date) -> int:
+    """
+    删除某月的全部原始数据：MySQL 直接删除分区，其他数据库按天分批删除并逐批提交
+    :return: 删除的行数（MySQL 为分区的估算行数）
+    """
+    if supports_native_partitions():
+        partition = next((p for p in list_partitions() if p["month"] == month), None)
+        if partition is None:
+            return 0
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {TABLE} DROP PARTITION {partition['name']}"))
+        return partition["rows"]
+    removed = 0
+    day = month
+    while day < next_month(month):
+        removed += db.session.query(EnergyMonitor).filter(
+            EnergyMonitor.collect_time >= day, EnergyMonitor.collect_time < day + timedelta(days=1)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        day += timedelta(days=1)
+    return removed
+
+
+def compact_month(month: date) -> dict:
+    """
+    压缩某月：从原始数据重建小时汇总、补齐缺失的峰谷日报表、导出归档（启用时），并记录为已压缩（提交事务，不删除原始数据）
+    :return: {"readings": 原始数据条数, "hourly": 小时汇总条数}
+    """
+    month_end = next_month(month) - timedelta(days=1)
+    readings = _count_month(month)
+    if archive_store.enabled:
+        archive_days(month, month_end, progress=lambda message: None)
+    hourly = rebuild_hourly(month, month_end)
+    keys = db.session.query(EnergyHourly.factory_id, EnergyHourly.energy_type).filter(
+        EnergyHourly.hour_start >= month, EnergyHourly.hour_start < next_month(month)
+    ).distinct().all()
+    for factory_id, energy_type in keys:
+        backfill_peak_valley(energy_type, factory_id, month, month_end)
+    db.session.add(MonitorCompaction(stat_month=month, reading_count=readings, hourly_count=hourly))
+    db.session.commit()
+    return {"readings": readings, "hourly": hourly}
+
+
+def apply_retention(retention_days: int = None, dry_run: bool = False, progress=print) -> dict:
+    """
+    压缩并删除早于保留期的整月原始数据（中断后重新执行会继续未完成的删除，已压缩的月份不会重复压缩）
+    :param retention_days: 原始数据保留天数，默认 Config.MONITOR_RETENTION_DAYS
+    :param dry_run: 只列出将要处理的月份
+    :return: {"cutoff": 保留的第一个月, "months": [...], "readings": 删除的原始数据条数, "hourly": 生成的小时汇总条数}
+    """
+    retention_days = Config.MONITOR_RETENTION_DAYS if retention_days is None else retention_days
+    if not retention_days:
+        raise ValueError("未设置原始数据保留天数（MONITOR_RETENTION_DAYS）")
+    cutoff = month_start(date.today() - timedelta(days=retention_days))
+    months = [p["month"] for p in list_partitions() if p["month"] and p["month"] < cutoff]
+    compacted = {row[0] for row in db.session.query(MonitorCompaction.stat_month)}
+    summary = {"cutoff": cutoff.isoformat(), "months": [m.isoformat() for m in months], "readings": 0, "hourly": 0}
+    if dry_run:
+        return summary
+    for month in months:
+        if month not in compacted:
+            result = compact_month(month)
+            summary["hourly"] += result["hourly"]
+            progress(f"{month:%Y-%m} 已压缩：原始数据{result['readings']}条 -> 小时汇总{result['hourly']}条")
+        removed = drop_month(month)
+        summary["readings"] += removed
+        progress(f"{month:%Y-%m} 原始数据已删除（{removed}条）")
+    summary["partitions_added"] = len(ensure_partitions())
+    return summary
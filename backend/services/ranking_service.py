@@ -0,0 +1,108 @@
+"""
+厂区能耗排名：按日期区间、能源类型对厂区按总能耗 / 峰段占比 / 能耗成本排序，并与同类厂区的基准比较
+- 分厂区汇总由数据库一次分组查询得到（见 query_factory_totals，结果带缓存），排名、基准、百分位在内存中用数组计算
+- 不同能源类型的单位不同，基准按能源类型分别计算；混合多种能源类型时按超基准率排序
+"""
+from datetime import date
+import numpy as np
+from services.report_cache import get_factory_totals
+from config import Config
+
+# 排名指标：接口参数名 -> 说明
+RANK_METRICS = {
+    "total": "总能耗",
+    "peak_ratio": "峰段占比（尖峰+高峰，%）",
+    "cost": "能耗成本",
+}
+# 汇总数组中各列的位置（与 query_factory_totals 结果去掉前两列后一致）
+_PEAK, _HIGH, _FLAT, _VALLEY, _TOTAL, _COST = range(6)
+
+
+def parse_baseline(baseline: str) -> float:
+    """
+    解析基准参数：mean=同类厂区平均值，median=中位数，p0~p100=百分位数
+    :return: 百分位数（0~100），平均值返回 None
+    """
+    baseline = (baseline or "mean").lower()
+    if baseline == "mean":
+        return None
+    if baseline == "median":
+        return 50.0
+    try:
+        percentile = float(baseline[1:]) if baseline.startswith("p") else None
+    except ValueError:
+        percentile = None
+    if percentile is None or not 0 <= percentile <= 100:
+        raise ValueError(f"基准参数错误：{baseline}（可选 mean、median、p0~p100）")
+    return percentile
+
+
+def rank_factories(start_date: date, end_date: date, energy_type: str = None, metric: str = "total",
+                   baseline: str = "mean", threshold: float = None, page: int = 1, page_size: int = None) -> dict:
+    """
+    厂区能耗排名
+    :param metric: 排名指标，见 RANK_METRICS
+    :param baseline: 比较基准，见 parse_baseline
+    :param threshold: 只返回超基准率（%）大于该值的厂区，不设置则返回全部
+    :param page_size: 每页条数，默认 Config.RANKING_PAGE_SIZE，最多 Config.RANKING_PAGE_MAX_SIZE；0 表示不分页
+    :return: {"items": [...], "total": 符合条件的厂区数, "page":..., "page_size":..., "baselines": {能源类型: 基准值}}
+    """
+    if metric not in RANK_METRICS:
+        raise ValueError(f"排名指标错误：{metric}（可选 {'、'.join(RANK_METRICS)}）")
+    if end_date < start_date:
+        raise ValueError("结束日期不能早于开始日期")
+    percentile = parse_baseline(baseline)
+    if page_size is None:
+        page_size = Config.RANKING_PAGE_SIZE
+    page_size = min(max(page_size, 0), Config.RANKING_PAGE_MAX_SIZE) if page_size else 0
+    page = max(page, 1)
+
+    rows = get_factory_totals(start_date, end_date, energy_type)
+    result = {"items": [], "total": 0, "page": page, "page_size": page_size, "baselines": {}}
+    if not rows:
+        return result
+
+    factory_ids = np.array([row[0] for row in rows], dtype=object)
+    types = np.array([row[1] for row in rows], dtype=object)
+    sums = np.array([row[2:] for row in rows], dtype=np.float64).reshape(len(rows), -1)
+    totals = sums[:, _TOTAL]
+    peak_ratio = np.divide(
+        (sums[:, _PEAK] + sums[:, _HIGH]) * 100, totals, out=np.zeros(len(rows)), where=totals > 0
+    )
+    values = {"total": totals, "peak_ratio": peak_ratio, "cost": sums[:, _COST]}[metric]
+
+    # 按能源类型分组计算基准、组内名次和百分位（同类厂区中指标不高于本厂区的比例）
+    type_names, type_index = np.unique(types.astype(str), return_inverse=True)
+    base = np.zeros(len(rows))
+    ranks = np.zeros(len(rows), dtype=np.int64)
+    percentiles = np.zeros(len(rows))
+    for i, type_name in enumerate(type_names):
+        members = np.flatnonzero(type_index == i)
+        group = values[members]
+        group_base = float(group.mean() if percentile is None else np.percentile(group, percentile))
+        base[members] = group_base
+        result["baselines"][str(type_name)] = round(group_base, 2)
+        ordered = np.sort(group)
+        ranks[members] = len(group) - np.searchsorted(ordered, group, side="right") + 1
+        percentiles[members] = np.searchsorted(ordered, group, side="right") / len(group) * 100
+    exceed = np.divide((values - base) * 100, base, out=np.zeros(len(rows)), where=base > 0)
+
+    selected = np.flatnonzero(exceed > threshold) if threshold is not None else np.arange(len(rows))
+    # 超基准率从高到低，相同时按指标值、厂区编号排序（单一能源类型时等同于按指标值排序）
+    order = selected[np.lexsort((factory_ids[selected].astype(str), -values[selected], -exceed[selected]))]
+    result["total"] = len(order)
+    if page_size:
+        order = order[(page - 1) * page_size: page * page_size]
+    result["items"] = [{
+        "factory_id": factory_ids[i],
+        "energy_type": types[i],
+        "rank": int(ranks[i]),
+        "value": round(float(values[i]), 2),
+        "baseline": round(float(base[i]), 2),
+        "exceed_rate": round(float(exceed[i]), 2),
+        "percentile": round(float(percentiles[i]), 2),
+        "total_energy": round(float(totals[i]), 2),
+        "peak_ratio": round(float(peak_ratio[i]), 2),
+        "energy_cost": round(float(sums[i, _COST]), 2),
+    } for i in order]
+    return result
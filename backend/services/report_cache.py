@@ -0,0 +1,103 @@
+"""
+报表与下拉框数据缓存
+- 峰谷报表汇总按规范化后的（厂区, 开始日期, 结束日期, 能源类型）缓存
+- 厂区排名使用的分厂区汇总按（开始日期, 结束日期, 能源类型）缓存，失效规则与报表汇总相同
+- 写入监测数据或重算报表时记录受影响的（厂区, 能源类型, 日期），事务提交后只清除覆盖这些日期的条目
+"""
+from datetime import date
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database import db
+from models import FactoryArea
+from services.rollup_hierarchy import query_period_totals, query_factory_totals
+from utils.cache import create_cache
+from config import Config
+
+report_cache = create_cache(Config.CACHE_BACKEND, Config.CACHE_MAX_ENTRIES, Config.CACHE_TTL_SECONDS)
+
+REPORT_NAMESPACE = "peak_valley_report"
+FACTORY_TOTALS_NAMESPACE = "factory_totals"
+FACTORY_KEY = ("factory_ids",)
+# 事务内累积的待失效键，存放在 session.info 中
+_DIRTY_KEYS = "report_cache_dirty_keys"
+_DIRTY_FACTORIES = "report_cache_dirty_factories"
+
+
+def report_key(factory_id: str = None, start_date: date = None, end_date: date = None, energy_type: str = None) -> tuple:
+    """规范化报表筛选条件（空值与 all 视为不筛选），作为缓存键"""
+    return (
+        REPORT_NAMESPACE,
+        factory_id if factory_id and factory_id != "all" else None,
+        start_date.isoformat() if start_date else None,
+        end_date.isoformat() if end_date else None,
+        energy_type or None,
+    )
+
+
+def get_report_totals(factory_id: str = None, start_date: date = None, end_date: date = None, energy_type: str = None) -> dict:
+    """带缓存的峰谷报表汇总（结果同 query_period_totals）"""
+    key = report_key(factory_id, start_date, end_date, energy_type)
+    return report_cache.get_or_load(key, lambda: query_period_totals(key[1], start_date, end_date, key[4]))
+
+
+def get_factory_totals(start_date: date, end_date: date, energy_type: str = None) -> list:
+    """带缓存的分厂区峰谷汇总（结果同 query_factory_totals）"""
+    key = (FACTORY_TOTALS_NAMESPACE, None, start_date.isoformat(), end_date.isoformat(), energy_type or None)
+    return report_cache.get_or_load(key, lambda: query_factory_totals(start_date, end_date, key[4]))
+
+
+def get_factory_ids() -> list:
+    """带缓存的厂区编号列表（页面下拉框使用）"""
+    return report_cache.get_or_load(FACTORY_KEY, lambda: [f.factory_id for f in FactoryArea.query.all()])
+
+
+def _covers(key: tuple, factory_id: str, energy_type: str, stat_date: str) -> bool:
+    """缓存的报表条目是否包含该（厂区, 能源类型, 日期）的数据"""
+    _, key_factory, start, end, key_type = key
+    return (
+        key_factory in (None, factory_id)
+        and key_type in (None, energy_type)
+        and (start is None or start <= stat_date <= end)
+    )
+
+
+def invalidate_reports(keys) -> int:
+    """
+    清除包含指定数据的报表缓存
+    :param keys: 可迭代的 (factory_id, energy_type, stat_date)
+    :return: 清除的条目数
+    """
+    keys = {(f, e, d.isoformat()) for f, e, d in keys}
+    if not keys:
+        return 0
+    return report_cache.invalidate(
+        lambda key: key[0] in (REPORT_NAMESPACE, FACTORY_TOTALS_NAMESPACE) and any(_covers(key, *k) for k in keys)
+    )
+
+
+def mark_rollup_dirty(keys) -> None:
+    """记录当前事务修改了哪些（厂区, 能源类型, 日期）的报表，提交后再清除缓存"""
+    db.session.info.setdefault(_DIRTY_KEYS, set()).update(keys)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_factory_changes(session, flush_context):
+    if any(isinstance(obj, FactoryArea) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info[_DIRTY_FACTORIES] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    keys = session.info.pop(_DIRTY_KEYS, None)
+    if keys:
+        invalidate_reports(keys)
+    if session.info.pop(_DIRTY_FACTORIES, None):
+        report_cache.invalidate(lambda key: key == FACTORY_KEY)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session, previous_transaction):
+    # 只在整个事务回滚时丢弃；保存点回滚后外层事务仍可能提交
+    if not session.in_transaction():
+        session.info.pop(_DIRTY_KEYS, None)
+        session.info.pop(_DIRTY_FACTORIES, None)
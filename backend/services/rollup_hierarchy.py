@@ -0,0 +1,301 @@
+"""
+多级汇总表：设备小时汇总（energy_hourly）、厂区每日峰谷（peak_valley_energy）、厂区月度峰谷（peak_valley_monthly）
+- 新增监测数据时增量维护小时表与月表，删除或重算时按键从下一级重新汇总
+- 报表查询按时间范围自动选择能覆盖的最粗粒度表
+- 已压缩月份（见 partition_service）的原始数据已删除，重建时跳过这些月份，避免用空数据覆盖汇总
+"""
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, and_, or_, case
+from sqlalchemy.exc import IntegrityError
+from database import db
+from models import EnergyMeter, EnergyMonitor, PeakValleyEnergy, EnergyHourly, PeakValleyMonthly, MonitorCompaction
+from utils.sql_functions import time_bucket, from_epoch
+
+# 月表与日表共有的汇总列（与 TariffEngine.summarize 的结果键一一对应）
+PERIOD_COLUMNS = ("peak_energy", "high_energy", "flat_energy", "valley_energy", "total_energy", "energy_cost")
+SUM_KEYS = ("peak", "high", "flat", "valley", "total", "cost")
+
+
+def upsert_increment(model, key_filter, values: dict, new_row) -> None:
+    """
+    原子累加：先 UPDATE col = col + delta，记录不存在时插入新行
+    插入冲突说明并发请求已建好记录，重新执行累加即可（不提交事务）
+    :param values: {列: 更新表达式}
+    :param new_row: 无参函数，返回要插入的新对象；返回 None 表示不需要插入
+    """
+    if db.session.query(model).filter(key_filter).update(values, synchronize_session=False):
+        return
+    row = new_row()
+    if row is None:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(row)
+    except IntegrityError:
+        db.session.query(model).filter(key_filter).update(values, synchronize_session=False)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def compacted_until() -> date:
+    """已压缩月份之后的第一天（此前的原始数据已删除，汇总表是唯一数据来源）；没有压缩过时返回 None"""
+    last = db.session.query(func.max(MonitorCompaction.stat_month)).scalar()
+    return next_month(last) if last else None
+
+
+def clamp_to_raw(start_date: date) -> date:
+    """把重建的起始日期推迟到仍有原始数据的月份"""
+    cutoff = compacted_until()
+    return max(start_date, cutoff) if cutoff else start_date
+
+
+# -------------------------- 月度汇总 --------------------------
+def apply_monthly_deltas(daily_deltas: dict) -> None:
+    """把每日峰谷增量合并到月表（daily_deltas 为 collect_deltas 的结果）"""
+    monthly = {}
+    for (factory_id, energy_type, stat_date), sums in daily_deltas.items():
+        total = monthly.setdefault((factory_id, energy_type, month_start(stat_date)), dict.fromkeys(SUM_KEYS, 0.0))
+        for key in SUM_KEYS:
+            total[key] += sums[key]
+
+    for (factory_id, energy_type, stat_month), sums in monthly.items():
+        key_filter = and_(
+            PeakValleyMonthly.factory_id == factory_id,
+            PeakValleyMonthly.energy_type == energy_type,
+            PeakValleyMonthly.stat_month == stat_month
+        )
+        values = {
+            getattr(PeakValleyMonthly, column): func.coalesce(getattr(PeakValleyMonthly, column), 0) + sums[key]
+            for column, key in zip(PERIOD_COLUMNS, SUM_KEYS)
+        }
+        upsert_increment(PeakValleyMonthly, key_filter, values, lambda: PeakValleyMonthly(
+            factory_id=factory_id, energy_type=energy_type, stat_month=stat_month,
+            **{column: sums[key] for column, key in zip(PERIOD_COLUMNS, SUM_KEYS)}
+        ) if sums["total"] > 0 else None)
+
+
+def refresh_monthly(keys) -> None:
+    """
+    按每日峰谷报表重新汇总指定月份（日报表被整体重算或覆盖后调用，不提交事务）
+    :param keys: 可迭代的 (factory_id, energy_type, 当月任意日期)
+    """
+    db.session.flush()
+    for factory_id, energy_type, stat_month in {(f, e, month_start(d)) for f, e, d in keys}:
+        sums = db.session.query(*[func.sum(getattr(PeakValleyEnergy, column)) for column in PERIOD_COLUMNS]).filter(
+            PeakValleyEnergy.factory_id == factory_id,
+            PeakValleyEnergy.energy_type == energy_type,
+            PeakValleyEnergy.stat_date >= stat_month,
+            PeakValleyEnergy.stat_date < next_month(stat_month)
+        ).one()
+        record = db.session.get(PeakValleyMonthly, (factory_id, energy_type, stat_month))
+        if sums[-2] is None:
+            if record:
+                db.session.delete(record)
+            continue
+        if record is None:
+            record = PeakValleyMonthly(factory_id=factory_id, energy_type=energy_type, stat_month=stat_month)
+            db.session.add(record)
+        for column, value in zip(PERIOD_COLUMNS, sums):
+            setattr(record, column, value or 0)
+
+
+# -------------------------- 小时汇总 --------------------------
+def hour_start(collect_time: datetime) -> datetime:
+    return collect_time.replace(minute=0, second=0, microsecond=0)
+
+
+def apply_hourly(readings) -> None:
+    """
+    把新增的监测数据累加到设备小时表（不提交事务）
+    :param readings: 可迭代的 (meter_id, factory_id, energy_type, collect_time, energy_value)
+    """
+    hourly = {}
+    for meter_id, factory_id, energy_type, collect_time, energy_value in readings:
+        value = float(energy_value)
+        item = hourly.get((meter_id, hour_start(collect_time)))
+        if item is None:
+            hourly[(meter_id, hour_start(collect_time))] = [factory_id, energy_type, value, 1, value, value]
+        else:
+            item[2] += value
+            item[3] += 1
+            item[4] = min(item[4], value)
+            item[5] = max(item[5], value)
+
+    for (meter_id, hour), (factory_id, energy_type, total, count, low, high) in hourly.items():
+        key_filter = and_(EnergyHourly.meter_id == meter_id, EnergyHourly.hour_start == hour)
+        values = {
+            EnergyHourly.energy_sum: EnergyHourly.energy_sum + total,
+            EnergyHourly.reading_count: EnergyHourly.reading_count + count,
+            EnergyHourly.min_value: case((or_(EnergyHourly.min_value.is_(None), EnergyHourly.min_value > low), low), else_=EnergyHourly.min_value),
+            EnergyHourly.max_value: case((or_(EnergyHourly.max_value.is_(None), EnergyHourly.max_value < high), high), else_=EnergyHourly.max_value),
+        }
+        upsert_increment(EnergyHourly, key_filter, values, lambda: EnergyHourly(
+            meter_id=meter_id, hour_start=hour, factory_id=factory_id, energy_type=energy_type,
+            energy_sum=total, reading_count=count, min_value=low, max_value=high
+        ))
+
+
+def _hourly_rows(filters: list) -> list:
+    """从监测数据按（设备, 小时）分组汇总，返回可直接写入小时表的字典列表"""
+    bucket = time_bucket(EnergyMonitor.collect_time, 0, 3600).label("bucket")
+    rows = db.session.query(
+        EnergyMonitor.meter_id, EnergyMonitor.factory_id, EnergyMeter.energy_type, bucket,
+        func.sum(EnergyMonitor.energy_value), func.min(EnergyMonitor.energy_value),
+        func.max(EnergyMonitor.energy_value), func.count(EnergyMonitor.energy_value)
+    ).join(
+        EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id
+    ).filter(*filters).group_by(
+        EnergyMonitor.meter_id, EnergyMonitor.factory_id, EnergyMeter.energy_type, bucket
+    ).all()
+    return [{
+        "meter_id": meter_id, "factory_id": factory_id, "energy_type": energy_type,
+        "hour_start": from_epoch(int(b) * 3600), "energy_sum": total,
+        "min_value": low, "max_value": high, "reading_count": count
+    } for meter_id, factory_id, energy_type, b, total, low, high, count in rows]
+
+
+def refresh_hourly(keys) -> None:
+    """
+    按监测数据重新汇总指定的设备小时（删除监测数据后调用，不提交事务）
+    :param keys: 可迭代的 (meter_id, 该小时内任意时间)
+    """
+    db.session.flush()
+    for meter_id, hour in {(m, hour_start(t)) for m, t in keys}:
+        db.session.query(EnergyHourly).filter_by(meter_id=meter_id, hour_start=hour).delete(synchronize_session=False)
+        rows = _hourly_rows([
+            EnergyMonitor.meter_id == meter_id,
+            EnergyMonitor.collect_time >= hour,
+            EnergyMonitor.collect_time < hour + timedelta(hours=1)
+        ])
+        if rows:
+            db.session.execute(EnergyHourly.__table__.insert(), rows)
+
+
+def rebuild_hourly(start_date: date, end_date: date, factory_id: str = None) -> int:
+    """
+    按日期区间从监测数据重建小时表（逐天处理，控制单次结果集大小；不提交事务）
+    :return: 写入的小时记录数
+    """
+    written = 0
+    day = clamp_to_raw(start_date)
+    while day <= end_date:
+        start_time = datetime.combine(day, datetime.min.time())
+        end_time = start_time + timedelta(days=1)
+        delete = db.session.query(EnergyHourly).filter(EnergyHourly.hour_start >= start_time, EnergyHourly.hour_start < end_time)
+        filters = [EnergyMonitor.collect_time >= start_time, EnergyMonitor.collect_time < end_time]
+        if factory_id:
+            delete = delete.filter(EnergyHourly.factory_id == factory_id)
+            filters.append(EnergyMonitor.factory_id == factory_id)
+        delete.delete(synchronize_session=False)
+        rows = _hourly_rows(filters)
+        if rows:
+            db.session.execute(EnergyHourly.__table__.insert(), rows)
+        written += len(rows)
+        day += timedelta(days=1)
+    return written
+
+
+def rebuild_monthly(start_date: date, end_date: date, factory_id: str = None) -> int:
+    """按日期区间涉及的月份，从每日峰谷报表重建月表（不提交事务）"""
+    query = db.session.query(PeakValleyEnergy.factory_id, PeakValleyEnergy.energy_type, PeakValleyEnergy.stat_date).filter(
+        PeakValleyEnergy.energy_type.in_(PeakValleyMonthly.energy_type.type.enums),
+        PeakValleyEnergy.stat_date >= month_start(start_date),
+        PeakValleyEnergy.stat_date < next_month(end_date)
+    )
+    existing = db.session.query(PeakValleyMonthly.factory_id, PeakValleyMonthly.energy_type, PeakValleyMonthly.stat_month).filter(
+        PeakValleyMonthly.stat_month >= month_start(start_date),
+        PeakValleyMonthly.stat_month <= month_start(end_date)
+    )
+    if factory_id:
+        query = query.filter(PeakValleyEnergy.factory_id == factory_id)
+        existing = existing.filter(PeakValleyMonthly.factory_id == factory_id)
+    keys = {(f, e, month_start(d)) for f, e, d in query.distinct()} | {tuple(row) for row in existing}
+    refresh_monthly(keys)
+    return len(keys)
+
+
+# -------------------------- 报表查询路由 --------------------------
+def split_by_month(start_date: date, end_date: date) -> tuple[list, list]:
+    """
+    把日期区间拆分为完整月份与零散日期段
+    :return: (完整月份列表, [(起始日期, 结束日期), ...])
+    """
+    months, day_ranges = [], []
+    day = start_date
+    while day <= end_date:
+        month_end = next_month(day) - timedelta(days=1)
+        if day.day == 1 and month_end <= end_date:
+            months.append(day)
+        else:
+            day_ranges.append((day, min(month_end, end_date)))
+        day = month_end + timedelta(days=1)
+    return months, day_ranges
+
+
+def query_period_totals(factory_id: str = None, start_date: date = None, end_date: date = None, energy_type: str = None) -> dict:
+    """
+    汇总峰谷报表：完整月份读月表，零散日期读日表
+    未指定的起止日期取日表中最早/最晚的日期，同样按月拆分（最近的零散日期读日表，不依赖月表已刷新）
+    :return: {"peak":..., "high":..., "flat":..., "valley":..., "total":..., "cost":...}
+    """
+    def run(model, date_column, date_filter):
+        query = db.session.query(*[func.sum(getattr(model, column)) for column in PERIOD_COLUMNS])
+        if factory_id:
+            query = query.filter(model.factory_id == factory_id)
+        if energy_type:
+            query = query.filter(model.energy_type == energy_type)
+        if date_filter is not None:
+            query = query.filter(date_filter(date_column))
+        return query
+
+    results = []
+    if start_date is None or end_date is None:
+        first, last = run(PeakValleyEnergy, None, None).with_entities(
+            func.min(PeakValleyEnergy.stat_date), func.max(PeakValleyEnergy.stat_date)
+        ).one()
+        start_date, end_date = start_date or first, end_date or last
+    if start_date is not None and end_date is not None:
+        months, day_ranges = split_by_month(start_date, end_date)
+        if months:
+            results.append(run(PeakValleyMonthly, PeakValleyMonthly.stat_month, lambda c: c.in_(months)).one())
+        if day_ranges:
+            results.append(run(PeakValleyEnergy, PeakValleyEnergy.stat_date,
+                               lambda c: or_(*[c.between(s, e) for s, e in day_ranges])).one())
+    return {key: sum(row[i] or 0 for row in results) for i, key in enumerate(SUM_KEYS)}
+
+
+def query_factory_totals(start_date: date, end_date: date, energy_type: str = None) -> list:
+    """
+    按（厂区, 能源类型）分组汇总日期区间内的峰谷报表：完整月份读月表、零散日期读日表，
+    两部分 UNION ALL 后在数据库中一次分组求和
+    :return: [[factory_id, energy_type, peak, high, flat, valley, total, cost], ...]
+    """
+    def part(model, date_filter):
+        query = db.session.query(
+            model.factory_id.label("factory_id"), model.energy_type.label("energy_type"),
+            *[getattr(model, column).label(column) for column in PERIOD_COLUMNS]
+        ).filter(
+            date_filter, model.energy_type.in_(model.energy_type.type.enums)
+        )
+        if energy_type:
+            query = query.filter(model.energy_type == energy_type)
+        return query
+
+    months, day_ranges = split_by_month(start_date, end_date)
+    parts = []
+    if months:
+        parts.append(part(PeakValleyMonthly, PeakValleyMonthly.stat_month.in_(months)))
+    if day_ranges:
+        parts.append(part(PeakValleyEnergy, or_(*[PeakValleyEnergy.stat_date.between(s, e) for s, e in day_ranges])))
+    combined = parts[0].union_all(*parts[1:]).subquery() if len(parts) > 1 else parts[0].subquery()
+    rows = db.session.query(
+        combined.c.factory_id, combined.c.energy_type,
+        *[func.coalesce(func.sum(combined.c[column]), 0) for column in PERIOD_COLUMNS]
+    ).group_by(combined.c.factory_id, combined.c.energy_type).all()
+    return [list(row) for row in rows]
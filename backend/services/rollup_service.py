@@ -0,0 +1,283 @@
+from datetime import datetime, date, time, timedelta
+import numpy as np
+from sqlalchemy import func, and_, or_, case, extract, false
+from database import db
+from models import EnergyMeter, EnergyMonitor, PeakValleyEnergy, RollupDirtyKey
+from services.rollup_hierarchy import PERIOD_COLUMNS as ROLLUP_COLUMNS, SUM_KEYS, upsert_increment, apply_monthly_deltas, refresh_monthly
+from services.report_cache import mark_rollup_dirty
+from services.archive_service import split_range, read_archive, raw_range_filter, clamp_to_source, mark_archive_stale
+from utils.common_utils import generate_data_id
+from services.tariff_registry import tariff_registry
+from utils.tariff_engine import PERIOD_TYPES, period_ranges, TariffEngine
+from config import Config
+
+
+def minute_of_day(column):
+    """采集时间在当天的分钟数（EXTRACT 在 MySQL 与 SQLite 上都能正确编译）"""
+    return extract("hour", column) * 60 + extract("minute", column)
+
+
+def period_conditions(column, engine: TariffEngine) -> dict:
+    """
+    按电价方案的时段配置生成各时段的 SQL 判断条件
+    与 TariffEngine 的查找表保持一致：时段重叠时按 PERIOD_TYPES 顺序优先，未覆盖的分钟归入低谷
+    """
+    minute = minute_of_day(column)
+    conditions = {}
+    claimed = []
+    for name in PERIOD_TYPES[:-1]:
+        ranges = [r for p in engine.periods.get(name, []) for r in period_ranges(p)]
+        cond = or_(*[and_(minute >= start, minute < end) for start, end in ranges]) if ranges else false()
+        conditions[name] = and_(cond, *[~c for c in claimed]) if claimed else cond
+        claimed.append(cond)
+    conditions[PERIOD_TYPES[-1]] = ~or_(*claimed)
+    return conditions
+
+
+def counts_in_rollup(is_verified: bool) -> bool:
+    """监测数据是否计入峰谷报表（开启 PEAK_VALLEY_VERIFIED_ONLY 时只统计已核实数据）"""
+    return bool(is_verified) or not Config.PEAK_VALLEY_VERIFIED_ONLY
+
+
+def grouped_period_sums(filters: list, group_columns: list, engine: TariffEngine) -> list:
+    """
+    在数据库中按指定列分组、按时段汇总能耗
+    :param filters: 过滤条件列表（可引用 EnergyMonitor 与 EnergyMeter 的列）
+    :param group_columns: 分组列（带 label）
+    :param engine: 划分时段所用的电价方案
+    :return: 结果行，包含分组列与 peak/high/flat/valley 四个合计
+    """
+    conditions = period_conditions(EnergyMonitor.collect_time, engine)
+    query = db.session.query(
+        *group_columns,
+        *[func.sum(case((conditions[name], EnergyMonitor.energy_value), else_=0)).label(name) for name in PERIOD_TYPES]
+    ).join(
+        EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id
+    ).filter(*filters)
+    if Config.PEAK_VALLEY_VERIFIED_ONLY:
+        query = query.filter(EnergyMonitor.is_verified.is_(True))
+    return query.group_by(*group_columns).all()
+
+
+def versioned_period_sums(factory_id: str, energy_type: str, filters: list, group_columns: list,
+                          start_date: date = None, end_date: date = None) -> list:
+    """
+    按电价版本切分日期区间后分段汇总（区间内没有电价调整时只执行一条语句）
+    :param start_date: 开始日期（含），为空表示不限
+    :param end_date: 结束日期（含），为空表示不限
+    """
+    rows = []
+    for seg_start, seg_end, engine in tariff_registry.timeline(factory_id, energy_type).segments(start_date, end_date):
+        seg_filters = list(filters)
+        if seg_start:
+            seg_filters.append(EnergyMonitor.collect_time >= datetime.combine(seg_start, time(0, 0, 0)))
+        if seg_end:
+            seg_filters.append(EnergyMonitor.collect_time < datetime.combine(seg_end + timedelta(days=1), time(0, 0, 0)))
+        rows.extend(grouped_period_sums(seg_filters, group_columns, engine))
+    return rows
+
+
+def query_period_sums(energy_type: str, factory_id: str, start_date: date, end_date: date) -> dict:
+    """
+    按天、按时段汇总能耗：已归档的日期读归档文件查表汇总，其余日期在数据库中汇总（每个电价版本一条 GROUP BY 语句）
+    :return: {统计日期: {"peak":..., "high":..., "flat":..., "valley":...}}，无数据的日期不出现
+    """
+    start_time = datetime.combine(start_date, time(0, 0, 0))
+    end_time = datetime.combine(end_date + timedelta(days=1), time(0, 0, 0))
+    archived_days, raw_ranges = split_range(start_time, end_time)
+    result = {}
+    for day in archived_days:
+        times, values = read_archive([day], start_time, end_time, factory_id=factory_id, energy_type=energy_type,
+                                     verified_only=Config.PEAK_VALLEY_VERIFIED_ONLY)
+        if len(times):
+            engine = tariff_registry.engine_for(factory_id, energy_type, day)
+            sums = np.bincount(engine.classify(times), weights=values, minlength=len(PERIOD_TYPES))
+            result[day] = {name: float(sums[i]) for i, name in enumerate(PERIOD_TYPES)}
+
+    raw_filter = raw_range_filter(raw_ranges)
+    if raw_filter is None:
+        return result
+    stat_day = func.date(EnergyMonitor.collect_time, type_=db.Date).label("stat_day")
+    rows = versioned_period_sums(factory_id, energy_type, [
+        EnergyMonitor.factory_id == factory_id,
+        EnergyMeter.energy_type == energy_type,
+        raw_filter
+    ], [stat_day], start_date, end_date)
+    for row in rows:
+        # 已压缩日期的归档结果加上压缩后补录的数据
+        sums = result.setdefault(row.stat_day, dict.fromkeys(PERIOD_TYPES, 0.0))
+        for name in PERIOD_TYPES:
+            sums[name] += float(getattr(row, name) or 0)
+    return result
+
+
+def build_peak_valley_record(energy_type: str, factory_id: str, stat_date: date, period_sums: dict, rounded: bool = True) -> PeakValleyEnergy:
+    """
+    根据各时段能耗创建峰谷数据对象（补充总能耗与成本）
+    :param rounded: 是否保留两位小数（增量累加的初始记录不舍入，避免误差累积）
+    """
+    engine = tariff_registry.engine_for(factory_id, energy_type, stat_date)
+    sums = engine.summarize(period_sums)
+    fix = (lambda v: round(v, 2)) if rounded else (lambda v: v)
+    return PeakValleyEnergy(
+        record_id=generate_data_id("peak"),
+        energy_type=energy_type,
+        factory_id=factory_id,
+        stat_date=stat_date,
+        peak_energy=fix(sums["peak"]),
+        high_energy=fix(sums["high"]),
+        flat_energy=fix(sums["flat"]),
+        valley_energy=fix(sums["valley"]),
+        total_energy=fix(sums["total"]),
+        peak_valley_price=round(float(engine.prices[PERIOD_TYPES.index("peak")]), 2),  # 存储当天生效的尖峰电价
+        energy_cost=fix(sums["cost"])
+    )
+
+
+def save_daily_rollup(energy_type: str, factory_id: str, stat_date: date, period_sums: dict,
+                      existing: PeakValleyEnergy = None, replace: bool = True) -> str:
+    """
+    保存一天的峰谷汇总结果（不提交事务）
+    :param existing: 已存在的报表记录（为空时写入新记录）
+    :param replace: 已存在时是否用新结果覆盖
+    :return: created / replaced / skipped
+    """
+    record = build_peak_valley_record(energy_type, factory_id, stat_date, period_sums)
+    mark_rollup_dirty([(factory_id, energy_type, stat_date)])
+    if existing is None:
+        db.session.add(record)
+        return "created"
+    if not replace:
+        return "skipped"
+    for column in ROLLUP_COLUMNS + ("peak_valley_price",):
+        setattr(existing, column, getattr(record, column))
+    return "replaced"
+
+
+def existing_daily_records(energy_type: str, factory_id: str, start_date: date, end_date: date) -> dict:
+    """日期区间内已有的峰谷报表：{统计日期: 记录}"""
+    return {
+        record.stat_date: record for record in PeakValleyEnergy.query.filter(
+            PeakValleyEnergy.factory_id == factory_id,
+            PeakValleyEnergy.energy_type == energy_type,
+            PeakValleyEnergy.stat_date.between(start_date, end_date)
+        ).all()
+    }
+
+
+def backfill_peak_valley(energy_type: str, factory_id: str, start_date: date, end_date: date, replace: bool = False) -> tuple[int, int]:
+    """
+    按日期区间批量生成峰谷报表（一次汇总查询，不提交事务，由调用方提交）
+    :param replace: 是否覆盖已存在的报表；否则只补齐缺失的日期
+    :return: (新生成的天数, 覆盖的天数)
+    """
+    start_date = clamp_to_source(start_date)
+    daily_sums = query_period_sums(energy_type, factory_id, start_date, end_date)
+    existing = existing_daily_records(energy_type, factory_id, start_date, end_date)
+    created = replaced = 0
+    for stat_date, period_sums in daily_sums.items():
+        status = save_daily_rollup(energy_type, factory_id, stat_date, period_sums, existing.get(stat_date), replace)
+        created += status == "created"
+        replaced += status == "replaced"
+    # 日报表被整体写入或覆盖后，按日报表重新汇总涉及的月份
+    refresh_monthly((factory_id, energy_type, stat_date) for stat_date in daily_sums)
+    return created, replaced
+
+
+def recompute_peak_valley(energy_type: str, factory_id: str, start_date: date, end_date: date) -> dict:
+    """
+    按明细数据重算日期区间内的峰谷报表（幂等，不提交事务）
+    覆盖已有日期、补齐缺失日期，并删除已没有明细数据的日期（如时段配置变更或数据被删除后）
+    :return: {"created": 新增天数, "replaced": 覆盖天数, "removed": 删除天数}
+    """
+    start_date = clamp_to_source(start_date)
+    daily_sums = query_period_sums(energy_type, factory_id, start_date, end_date)
+    existing = existing_daily_records(energy_type, factory_id, start_date, end_date)
+    counts = {"created": 0, "replaced": 0, "removed": 0}
+    for stat_date, period_sums in daily_sums.items():
+        counts[save_daily_rollup(energy_type, factory_id, stat_date, period_sums, existing.get(stat_date))] += 1
+    for stat_date, record in existing.items():
+        if stat_date not in daily_sums:
+            db.session.delete(record)
+            counts["removed"] += 1
+    keys = [(factory_id, energy_type, stat_date) for stat_date in set(daily_sums) | set(existing)]
+    mark_rollup_dirty(keys)
+    refresh_monthly(keys)
+    return counts
+
+
+# -------------------------- 增量维护 --------------------------
+def collect_deltas(readings, sign: int = 1) -> dict:
+    """
+    把一批监测数据按（厂区, 能源类型, 日期）和时段累加成增量
+    :param readings: 可迭代的 (meter_id, factory_id, energy_type, collect_time, energy_value)
+    :param sign: 1=新增数据，-1=删除数据
+    :return: {(factory_id, energy_type, stat_date): {"peak":..., ..., "total":..., "cost":...}}
+    """
+    deltas = {}
+    engines = {}
+    for _, factory_id, energy_type, collect_time, energy_value in readings:
+        key = (factory_id, energy_type, collect_time.date())
+        sums = deltas.get(key)
+        if sums is None:
+            sums = deltas[key] = dict.fromkeys(PERIOD_TYPES, 0.0)
+            engines[key] = tariff_registry.engine_for(*key)
+        sums[engines[key].period_of(collect_time)] += sign * float(energy_value)
+    return {key: engines[key].summarize(sums) for key, sums in deltas.items()}
+
+
+def apply_deltas(deltas: dict) -> None:
+    """
+    把增量原子地累加到每日峰谷报表和月度汇总（不提交事务，由调用方与明细数据一起提交）
+    累加时不做舍入，避免多次舍入的误差累积（展示时再保留两位小数）
+    """
+    for (factory_id, energy_type, stat_date), sums in deltas.items():
+        key_filter = and_(
+            PeakValleyEnergy.factory_id == factory_id,
+            PeakValleyEnergy.energy_type == energy_type,
+            PeakValleyEnergy.stat_date == stat_date
+        )
+        values = {
+            getattr(PeakValleyEnergy, column): func.coalesce(getattr(PeakValleyEnergy, column), 0) + sums[key]
+            for column, key in zip(ROLLUP_COLUMNS, SUM_KEYS)
+        }
+        # 扣减一个不存在的报表时没有可调整的数据，不插入
+        upsert_increment(PeakValleyEnergy, key_filter, values, lambda: build_peak_valley_record(
+            energy_type, factory_id, stat_date, sums, rounded=False
+        ) if sums["total"] > 0 else None)
+    apply_monthly_deltas(deltas)
+    mark_rollup_dirty(deltas.keys())
+    mark_archive_stale(deltas.keys())
+
+
+def apply_readings(readings, sign: int = 1) -> None:
+    """按监测数据增量更新峰谷报表；延迟汇总模式下只登记待重算的键，由 rollup_worker 重算（不提交事务）"""
+    if Config.PEAK_VALLEY_UPDATE_MODE == "deferred":
+        keys = {(factory_id, energy_type, collect_time.date()) for _, factory_id, energy_type, collect_time, _ in readings}
+        mark_pending(keys)
+        mark_archive_stale(keys)
+        return
+    apply_deltas(collect_deltas(readings, sign))
+
+
+def mark_pending(keys, now: datetime = None) -> None:
+    """
+    登记待重算的（厂区, 能源类型, 日期）（不提交事务，与监测数据一起提交）
+    已登记的键只增加版本号，最早重算时间不会被推后，持续写入的日期也能按 ROLLUP_INTERVAL 定时重算
+    :param keys: 可迭代的 (factory_id, energy_type, stat_date)
+    """
+    now = now or datetime.now()
+    due_time = now + timedelta(seconds=Config.ROLLUP_INTERVAL)
+    for factory_id, energy_type, stat_date in sorted(set(keys)):
+        key_filter = and_(
+            RollupDirtyKey.factory_id == factory_id,
+            RollupDirtyKey.energy_type == energy_type,
+            RollupDirtyKey.stat_date == stat_date
+        )
+        values = {
+            RollupDirtyKey.version: RollupDirtyKey.version + 1,
+            RollupDirtyKey.due_time: case((RollupDirtyKey.due_time > due_time, due_time), else_=RollupDirtyKey.due_time),
+        }
+        upsert_increment(RollupDirtyKey, key_filter, values, lambda: RollupDirtyKey(
+            factory_id=factory_id, energy_type=energy_type, stat_date=stat_date, due_time=due_time, version=1
+        ))
@@ -0,0 +1,226 @@
+"""
+峰谷日报表后台汇总任务（PEAK_VALLEY_UPDATE_MODE=deferred 时使用）
+- 写入监测数据时只在 rollup_dirty_key 登记（厂区, 能源类型, 日期），不在请求内计算报表
+- 任务每 ROLLUP_INTERVAL 秒领取到期的键，按明细数据重算日报表（recompute_peak_valley，幂等）
+- 当天的键重算后保留，日期结束 ROLLUP_CLOSE_DELAY 分钟后再做一次最终重算，然后删除
+- 领取用条件 UPDATE 加租约实现：同一个键同一时间只会被一个任务重算；完成时核对领取者和版本号，
+  租约过期被其他任务接手的结果回滚，重算期间有新数据的键保留待下一轮
+- 重算失败（任何异常）的键释放领取并推迟重试，连续失败时间隔加倍（最长 ROLLUP_MAX_BACKOFF 秒），不影响其他键
+可在应用进程内以后台线程运行（start），也可单独运行：flask --app app run-rollups
+"""
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, time as day_time
+from sqlalchemy import and_, or_
+from database import db
+from models import RollupDirtyKey
+from services.rollup_service import recompute_peak_valley
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def close_time(stat_date) -> datetime:
+    """日期的最终重算时间：次日零点之后 ROLLUP_CLOSE_DELAY 分钟"""
+    return datetime.combine(stat_date + timedelta(days=1), day_time.min) + timedelta(minutes=Config.ROLLUP_CLOSE_DELAY)
+
+
+def _key_filter(factory_id: str, energy_type: str, stat_date):
+    return and_(
+        RollupDirtyKey.factory_id == factory_id,
+        RollupDirtyKey.energy_type == energy_type,
+        RollupDirtyKey.stat_date == stat_date
+    )
+
+
+class RollupWorker:
+    """领取并重算待汇总的峰谷日报表键"""
+
+    def __init__(self, interval: float, batch_size: int, lease_seconds: int, max_backoff: float = 3600):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.max_backoff = max_backoff
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.app = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._failures = {}  # 键 -> 连续失败次数
+        # 统计
+        self.runs = 0
+        self.recomputed = 0
+        self.closed = 0
+        self.conflicts = 0
+        self.failed = 0
+        self.last_run_ms = 0.0
+        self.last_error = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, app) -> None:
+        """在后台线程中定时运行（重复调用无副作用）"""
+        with self._lock:
+            if self.running:
+                return
+            self.app = app
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="rollup-worker", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout: float = 30) -> None:
+        """停止后台线程（正在重算的一轮会执行完）"""
+        if not self.running:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    self.run_pending()
+            except Exception as e:
+                # 领取等步骤失败（如数据库不可用）：记录后等待下一轮，线程不退出
+                self.last_error = str(e)
+                logger.exception("峰谷日报表后台汇总失败")
+            self._stopping.wait(self.interval)
+
+    def run_pending(self, now: datetime = None) -> dict:
+        """处理全部已到期的键（每轮最多 batch_size 个），返回累计结果"""
+        total = {"claimed": 0, "recomputed": 0, "closed": 0, "conflicts": 0}
+        while not self._stopping.is_set():
+            result = self.run_once(now)
+            for key in total:
+                total[key] += result[key]
+            if result["claimed"] < self.batch_size:
+                break
+        return total
+
+    def run_once(self, now: datetime = None) -> dict:
+        """
+        领取一批到期的键并逐个重算（每个键单独提交）
+        :param now: 当前时间（测试用）
+        :return: {"claimed": 领取数, "recomputed": 重算数, "closed": 其中最终重算后删除的数, "conflicts": 冲突或失效数}
+        """
+        started = time.perf_counter()
+        now = now or datetime.now()
+        result = {"claimed": 0, "recomputed": 0, "closed": 0, "conflicts": 0}
+        for factory_id, energy_type, stat_date, version in self._claim(now):
+            result["claimed"] += 1
+            status = self._process(factory_id, energy_type, stat_date, version, now)
+            if status == "conflict":
+                result["conflicts"] += 1
+                continue
+            result["recomputed"] += 1
+            result["closed"] += status == "closed"
+        self.runs += 1
+        self.recomputed += result["recomputed"]
+        self.closed += result["closed"]
+        self.conflicts += result["conflicts"]
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+        return result
+
+    def _claim(self, now: datetime) -> list:
+        """
+        领取到期且未被其他任务持有（或租约已过期）的键
+        先查候选再逐个条件更新，更新行数为0说明已被其他任务抢先领取
+        :return: [(factory_id, energy_type, stat_date, 领取时的版本号)]
+        """
+        available = or_(RollupDirtyKey.claim_until.is_(None), RollupDirtyKey.claim_until < now)
+        candidates = db.session.query(
+            RollupDirtyKey.factory_id, RollupDirtyKey.energy_type, RollupDirtyKey.stat_date
+        ).filter(RollupDirtyKey.due_time <= now, available).order_by(RollupDirtyKey.due_time).limit(self.batch_size).all()
+        db.session.rollback()
+        lease = now + timedelta(seconds=self.lease_seconds)
+        claimed = []
+        for factory_id, energy_type, stat_date in candidates:
+            if db.session.query(RollupDirtyKey).filter(_key_filter(factory_id, energy_type, stat_date), available).update(
+                {RollupDirtyKey.claimed_by: self.worker_id, RollupDirtyKey.claim_until: lease}, synchronize_session=False
+            ):
+                version = db.session.query(RollupDirtyKey.version).filter(_key_filter(factory_id, energy_type, stat_date)).scalar()
+                claimed.append((factory_id, energy_type, stat_date, version))
+            db.session.commit()
+        return claimed
+
+    def _process(self, factory_id: str, energy_type: str, stat_date, version: int, now: datetime) -> str:
+        """
+        重算一个已领取的键，与登记表的更新在同一事务中提交
+        :return: "recomputed" 保留待后续重算；"closed" 已做最终重算并删除；"conflict" 租约失效或写入冲突，已回滚
+        """
+        key_filter = and_(_key_filter(factory_id, energy_type, stat_date), RollupDirtyKey.claimed_by == self.worker_id)
+        released = {RollupDirtyKey.claimed_by: None, RollupDirtyKey.claim_until: None}
+        try:
+            recompute_peak_valley(energy_type, factory_id, stat_date, stat_date)
+            closes_at = close_time(stat_date)
+            unchanged = and_(key_filter, RollupDirtyKey.version == version)
+            if now >= closes_at and db.session.query(RollupDirtyKey).filter(unchanged).delete(synchronize_session=False):
+                status = "closed"
+            elif db.session.query(RollupDirtyKey).filter(unchanged).update(
+                {**released, RollupDirtyKey.due_time: closes_at}, synchronize_session=False
+            ):
+                status = "recomputed"
+            # 重算期间有新数据：保留，下一个间隔再重算
+            elif db.session.query(RollupDirtyKey).filter(key_filter).update(
+                {**released, RollupDirtyKey.due_time: now + timedelta(seconds=self.interval)}, synchronize_session=False
+            ):
+                status = "recomputed"
+            else:
+                # 租约已过期并被其他任务接手，放弃本次结果
+                db.session.rollback()
+                return "conflict"
+            db.session.commit()
+            self._failures.pop((factory_id, energy_type, stat_date), None)
+            return status
+        except Exception as e:
+            db.session.rollback()
+            self.failed += 1
+            self.last_error = str(e)
+            failures = self._failures[(factory_id, energy_type, stat_date)] = \
+                self._failures.get((factory_id, energy_type, stat_date), 0) + 1
+            delay = min(self.interval * 2 ** (failures - 1), self.max_backoff)
+            logger.exception("重算峰谷日报表失败（%s %s %s），第%d次，%d秒后重试",
+                             factory_id, energy_type, stat_date, failures, delay)
+            try:
+                db.session.query(RollupDirtyKey).filter(key_filter).update(
+                    {**released, RollupDirtyKey.due_time: now + timedelta(seconds=delay)}, synchronize_session=False
+                )
+                db.session.commit()
+            except Exception:
+                # 释放失败时租约到期后自然可再领取
+                db.session.rollback()
+                logger.exception("释放峰谷日报表键失败（%s %s %s）", factory_id, energy_type, stat_date)
+            return "conflict"
+
+    def pending(self, now: datetime = None) -> dict:
+        """待重算的键数：{"due": 已到期, "total": 全部}"""
+        now = now or datetime.now()
+        total = db.session.query(RollupDirtyKey).count()
+        due = db.session.query(RollupDirtyKey).filter(RollupDirtyKey.due_time <= now).count()
+        return {"due": due, "total": total}
+
+    def metrics(self) -> dict:
+        return {
+            "running": self.running,
+            "worker_id": self.worker_id,
+            "runs": self.runs,
+            "recomputed": self.recomputed,
+            "closed": self.closed,
+            "conflicts": self.conflicts,
+            "failed": self.failed,
+            "last_run_ms": round(self.last_run_ms, 2),
+            "last_error": self.last_error,
+        }
+
+
+rollup_worker = RollupWorker(
+    Config.ROLLUP_INTERVAL, Config.ROLLUP_BATCH_SIZE, Config.ROLLUP_LEASE_SECONDS, Config.ROLLUP_MAX_BACKOFF
+)
@@ -0,0 +1,121 @@
+"""
+峰谷电价方案缓存：数据库中的电价方案按（厂区, 能源类型）编译成 TariffTimeline，报表计算直接查内存
+- 某厂区有专属方案且已生效时使用专属方案，否则使用全厂区通用方案；都没有生效的方案时使用 Config 中的默认配置
+- 方案新增/修改/删除时在同一事务中把 registry_version 表中 tariff 的版本号加一，
+  本进程提交后立即重新加载，其他进程每隔 Config.METER_REGISTRY_CHECK_INTERVAL 秒比对一次版本号
+"""
+import threading
+import time
+from datetime import date
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from database import db
+from models import TariffSchedule, RegistryVersion
+from services.meter_registry import bump_version
+from utils.tariff_engine import TariffEngine, TariffTimeline, compile_tariff, get_tariff_engine
+from config import Config
+
+REGISTRY_NAME = "tariff"
+_TARIFF_CHANGED = "tariff_registry_changed"
+_VERSION_BUMPED = "tariff_registry_version_bumped"
+
+
+class TariffRegistry:
+    def __init__(self, check_interval: float = 5):
+        self.check_interval = check_interval
+        self.version = None
+        self._schedules = {}  # (factory_id 或 None, energy_type) -> [(生效日期, TariffEngine)]
+        self._timelines = {}  # (factory_id, energy_type) -> TariffTimeline
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _db_version() -> int:
+        version = db.session.execute(
+            select(RegistryVersion.version).where(RegistryVersion.name == REGISTRY_NAME)
+        ).scalar()
+        return version or 0
+
+    def load(self) -> None:
+        """从数据库加载全部电价方案并编译（内容相同的方案共用一个引擎）"""
+        with self._lock:
+            version = self._db_version()
+            schedules = {}
+            for row in db.session.execute(select(
+                TariffSchedule.factory_id, TariffSchedule.energy_type, TariffSchedule.effective_date,
+                TariffSchedule.periods, TariffSchedule.prices
+            ).order_by(TariffSchedule.effective_date)):
+                engine = compile_tariff(row.periods, row.prices)
+                schedules.setdefault((row.factory_id, row.energy_type), []).append((row.effective_date, engine))
+            self._schedules = schedules
+            self._timelines = {}
+            self.version = version
+            self._checked_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        """标记为过期，下次读取时重新加载"""
+        self._checked_at = None
+
+    def ensure_fresh(self) -> None:
+        """未加载时加载；超过检查间隔时比对版本号，不一致则重新加载"""
+        checked_at = self._checked_at
+        if checked_at is None:
+            self.load()
+        elif time.monotonic() - checked_at >= self.check_interval:
+            if self._db_version() != self.version:
+                self.load()
+            else:
+                self._checked_at = time.monotonic()
+
+    def current_version(self) -> int:
+        """数据库中的电价方案版本号"""
+        self.ensure_fresh()
+        return self.version
+
+    def timeline(self, factory_id: str, energy_type: str) -> TariffTimeline:
+        """某厂区某能源类型的电价版本序列（编译结果缓存到下次重新加载）"""
+        self.ensure_fresh()
+        timelines = self._timelines
+        key = (factory_id, energy_type)
+        timeline = timelines.get(key)
+        if timeline is None:
+            own = self._schedules.get(key, [])
+            shared = self._schedules.get((None, energy_type), [])
+            # 专属方案生效之前沿用通用方案
+            cutoff = own[0][0] if own else None
+            versions = [(date.min, get_tariff_engine())]
+            versions += [(d, e) for d, e in shared if cutoff is None or d < cutoff]
+            versions += own
+            timeline = timelines[key] = TariffTimeline(versions)
+        return timeline
+
+    def engine_for(self, factory_id: str, energy_type: str, day: date) -> TariffEngine:
+        """某厂区某能源类型在某天生效的电价"""
+        return self.timeline(factory_id, energy_type).engine_on(day)
+
+
+tariff_registry = TariffRegistry(Config.METER_REGISTRY_CHECK_INTERVAL)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_on_tariff_change(session, flush_context):
+    # 电价方案有变更时，在同一事务内更新版本号（每个事务只加一次）
+    if session.info.get(_VERSION_BUMPED):
+        return
+    if any(isinstance(obj, TariffSchedule) for obj in (*session.new, *session.dirty, *session.deleted)):
+        bump_version(session.connection(), REGISTRY_NAME)
+        session.info[_TARIFF_CHANGED] = session.info[_VERSION_BUMPED] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _reload_after_commit(session):
+    session.info.pop(_VERSION_BUMPED, None)
+    if session.info.pop(_TARIFF_CHANGED, None):
+        tariff_registry.invalidate()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_VERSION_BUMPED, None)
+        session.info.pop(_TARIFF_CHANGED, None)
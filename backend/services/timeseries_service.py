@@ -0,0 +1,186 @@
+"""
+能耗时序查询：按目标点数返回分桶聚合结果或 LTTB 降采样结果，供图表直接渲染
+明细数据查询中已归档的日期读归档文件（见 archive_service），与数据库结果合并
+"""
+import math
+from datetime import datetime
+import numpy as np
+from sqlalchemy import func
+from database import db
+from models import EnergyMeter, EnergyMonitor, EnergyHourly
+from utils.downsample import lttb
+from services.archive_service import split_range, read_archive, raw_range_filter
+from services.meter_registry import meter_registry
+from utils.tariff_engine import rows_to_arrays
+from utils.sql_functions import time_bucket, to_epoch, from_epoch
+from config import Config
+
+
+def _series_filters(meter_id: str = None, factory_id: str = None, energy_type: str = None,
+                    start_time: datetime = None, end_time: datetime = None) -> list:
+    filters = [EnergyMonitor.collect_time >= start_time, EnergyMonitor.collect_time < end_time]
+    if meter_id:
+        filters.append(EnergyMonitor.meter_id == meter_id)
+    if factory_id:
+        filters.append(EnergyMonitor.factory_id == factory_id)
+    if energy_type:
+        filters.append(EnergyMeter.energy_type == energy_type)
+    return filters
+
+
+def _hourly_filters(meter_id: str = None, factory_id: str = None, energy_type: str = None,
+                    start_time: datetime = None, end_time: datetime = None) -> list:
+    filters = [EnergyHourly.hour_start >= start_time, EnergyHourly.hour_start < end_time]
+    if meter_id:
+        filters.append(EnergyHourly.meter_id == meter_id)
+    if factory_id:
+        filters.append(EnergyHourly.factory_id == factory_id)
+    if energy_type:
+        filters.append(EnergyHourly.energy_type == energy_type)
+    return filters
+
+
+def _archive_buckets(rows: list, times: np.ndarray, values: np.ndarray, start_epoch: int, width: int) -> list:
+    """把归档读数按同样的桶宽聚合后并入数据库的分桶结果（按桶序号排序）"""
+    buckets = {int(row[0]): [row[1], row[2], row[3], row[5]] for row in rows}
+    index = (times.astype(np.int64) - start_epoch) // width
+    keys, inverse = np.unique(index, return_inverse=True)
+    sums = np.bincount(inverse, weights=values)
+    counts = np.bincount(inverse)
+    mins = np.full(len(keys), np.inf)
+    maxs = np.full(len(keys), -np.inf)
+    np.minimum.at(mins, inverse, values)
+    np.maximum.at(maxs, inverse, values)
+    for key, total, low, high, count in zip(keys.tolist(), sums, mins, maxs, counts):
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [float(total), float(low), float(high), int(count)]
+        else:
+            bucket[0] += total
+            bucket[1] = min(bucket[1], low)
+            bucket[2] = max(bucket[2], high)
+            bucket[3] += count
+    return [(key, s, lo, hi, s / c, c) for key, (s, lo, hi, c) in sorted(buckets.items())]
+
+
+def bucket_series(filters: list, start_time: datetime, end_time: datetime, points: int, hourly_filters: list = None,
+                  archive_args: dict = None) -> dict:
+    """
+    在数据库中按等宽时间桶聚合（sum/min/max/avg/count），只返回非空的桶
+    桶宽不小于一小时且起止时间按整点对齐时，桶宽取整到小时并改为读取小时汇总表
+    :param hourly_filters: 对应小时汇总表的过滤条件（为空时始终读取明细数据）
+    :param archive_args: 读取归档的筛选条件（meter_id/factory_id/energy_type），为空时不读归档
+    :return: 列式结果 {"bucket_seconds":..., "time": [...], "sum": [...], ...}
+    """
+    start_epoch = to_epoch(start_time)
+    end_epoch = to_epoch(end_time)
+    width = max(1, math.ceil((end_epoch - start_epoch) / points))
+    if hourly_filters is not None and width >= 3600 and start_epoch % 3600 == 0 and end_epoch % 3600 == 0:
+        width = math.ceil(width / 3600) * 3600
+        bucket = time_bucket(EnergyHourly.hour_start, start_epoch, width).label("bucket")
+        query = db.session.query(
+            bucket,
+            func.sum(EnergyHourly.energy_sum),
+            func.min(EnergyHourly.min_value),
+            func.max(EnergyHourly.max_value),
+            func.sum(EnergyHourly.energy_sum) / func.sum(EnergyHourly.reading_count),
+            func.sum(EnergyHourly.reading_count)
+        ).filter(*hourly_filters)
+        rows = query.group_by(bucket).order_by(bucket).all()
+    else:
+        archived_days, raw_ranges = split_range(start_time, end_time) if archive_args is not None else ([], [(start_time, end_time)])
+        raw_filter = raw_range_filter(raw_ranges)
+        bucket = time_bucket(EnergyMonitor.collect_time, start_epoch, width).label("bucket")
+        query = db.session.query(
+            bucket,
+            func.sum(EnergyMonitor.energy_value),
+            func.min(EnergyMonitor.energy_value),
+            func.max(EnergyMonitor.energy_value),
+            func.avg(EnergyMonitor.energy_value),
+            func.count(EnergyMonitor.energy_value)
+        ).join(
+            EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id
+        ).filter(*filters)
+        rows = query.filter(raw_filter).group_by(bucket).order_by(bucket).all() if raw_filter is not None else []
+        if archived_days:
+            times, values = read_archive(archived_days, start_time, end_time, **archive_args)
+            if len(times):
+                rows = _archive_buckets(rows, times, values, start_epoch, width)
+
+    columns = list(zip(*rows)) if rows else [()] * 6
+    return {
+        "bucket_seconds": width,
+        "time": [from_epoch(start_epoch + int(b) * width).strftime("%Y-%m-%d %H:%M:%S") for b in columns[0]],
+        "sum": [round(v, 2) for v in columns[1]],
+        "min": [round(v, 2) for v in columns[2]],
+        "max": [round(v, 2) for v in columns[3]],
+        "avg": [round(v, 2) for v in columns[4]],
+        "count": [int(v) for v in columns[5]],
+    }
+
+
+def lttb_series(filters: list, points: int, meter_id: str = None, start_time: datetime = None, end_time: datetime = None,
+                archive_args: dict = None) -> dict:
+    """
+    LTTB 降采样：单设备取原始读数，厂区/全部设备先按采集时间求和成一条曲线
+    :param archive_args: 读取归档的筛选条件（meter_id/factory_id/energy_type），为空时不读归档
+    :return: 列式结果 {"time": [...], "value": [...]}
+    """
+    archived_days, raw_ranges = split_range(start_time, end_time) if archive_args is not None else ([], [(start_time, end_time)])
+    raw_filter = raw_range_filter(raw_ranges)
+    if meter_id:
+        query = db.session.query(EnergyMonitor.collect_time, EnergyMonitor.energy_value)
+    else:
+        query = db.session.query(EnergyMonitor.collect_time, func.sum(EnergyMonitor.energy_value)).group_by(EnergyMonitor.collect_time)
+    rows = query.join(
+        EnergyMeter, EnergyMonitor.meter_id == EnergyMeter.meter_id
+    ).filter(*filters, raw_filter).order_by(EnergyMonitor.collect_time).all() if raw_filter is not None else []
+    timestamps, values = rows_to_arrays(rows)
+    if archived_days:
+        archived_times, archived_values = read_archive(archived_days, start_time, end_time, **archive_args)
+        timestamps = np.concatenate([timestamps, archived_times])
+        values = np.concatenate([values, archived_values])
+        if meter_id:
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[order], values[order]
+        else:
+            # 多台设备按采集时间求和（结果按时间升序）
+            timestamps, inverse = np.unique(timestamps, return_inverse=True)
+            values = np.bincount(inverse, weights=values)
+    if not len(timestamps):
+        return {"time": [], "value": []}
+
+    index = lttb(timestamps.astype(np.int64), values, points)
+    return {
+        "time": [t.replace("T", " ") for t in np.datetime_as_string(timestamps[index], unit="s")],
+        "value": np.round(values[index], 2).tolist(),
+    }
+
+
+def get_timeseries(start_time: datetime, end_time: datetime, points: int = None, mode: str = "bucket",
+                   meter_id: str = None, factory_id: str = None, energy_type: str = None) -> dict:
+    """
+    查询设备或厂区在时间段内的能耗曲线
+    :param points: 目标点数（不超过 Config.TIMESERIES_MAX_POINTS）
+    :param mode: bucket=分桶聚合，lttb=保形降采样
+    :return: 列式数据，供图表直接使用；参数不合法时抛出ValueError
+    """
+    if end_time <= start_time:
+        raise ValueError("结束时间必须晚于开始时间")
+    points = max(2, min(points or Config.TIMESERIES_DEFAULT_POINTS, Config.TIMESERIES_MAX_POINTS))
+    filters = _series_filters(meter_id, factory_id, energy_type, start_time, end_time)
+    archive_args = {"meter_id": meter_id, "factory_id": factory_id, "energy_type": energy_type}
+    if meter_id and not (factory_id and energy_type):
+        # 归档按厂区、能源类型分目录，单设备查询时只读该设备所在的目录
+        meter = meter_registry.get(meter_id)
+        if meter:
+            archive_args.update(factory_id=factory_id or meter.factory_id, energy_type=energy_type or meter.energy_type)
+    if mode == "bucket":
+        hourly_filters = _hourly_filters(meter_id, factory_id, energy_type, start_time, end_time)
+        data = bucket_series(filters, start_time, end_time, points, hourly_filters, archive_args)
+    elif mode == "lttb":
+        data = lttb_series(filters, points, meter_id, start_time, end_time, archive_args)
+    else:
+        raise ValueError(f"不支持的降采样方式：{mode}")
+    data["mode"] = mode
+    return data
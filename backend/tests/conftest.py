@@ -0,0 +1,39 @@
+"""
+测试公共设置
+- 把 backend 目录加入导入路径，在仓库根目录（pytest backend/tests）或 backend 目录下运行均可
+- app 夹具：使用临时 SQLite 文件并已建表的应用（web=False，不注册页面与接口）
+"""
+import os
+import sys
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def make_config(tmp_path, **overrides):
+    """在 Config 基础上改用临时 SQLite 文件的配置类"""
+    from config import Config
+    attrs = {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'energy.db'}", "SQLALCHEMY_BINDS": {}}
+    attrs.update(overrides)
+    return type("TestConfig", (Config,), attrs)
+
+
+@pytest.fixture
+def app(tmp_path):
+    import models  # noqa: F401  注册全部表，create_all 才会建表
+    from app import create_app
+    from database import db
+    from services.meter_registry import meter_registry
+    from services.report_cache import report_cache
+    from services.tariff_registry import tariff_registry
+    application = create_app(make_config(tmp_path), web=False)
+    with application.app_context():
+        db.create_all(bind_key=None)  # 只建主库（其他测试配置过的副本绑定名会留在 db.metadatas 中）
+        # 进程内缓存与上一个测试的数据库无关
+        meter_registry.invalidate()
+        tariff_registry.invalidate()
+        report_cache.clear()
+        yield application
+        db.session.remove()
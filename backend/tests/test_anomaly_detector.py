@@ -0,0 +1,75 @@
+"""AnomalyDetector 回归测试：工况变化（水平跳变、停机后开机）后检测器能重新适应"""
+from datetime import datetime, timedelta
+import numpy as np
+from services.anomaly_detector import AnomalyDetector
+
+
+def feed(detector: AnomalyDetector, values) -> np.ndarray:
+    """逐条送入同一设备的读数，返回每条是否可疑"""
+    start = datetime(2025, 1, 1)
+    flags = []
+    for i, value in enumerate(values):
+        _, suspicious = detector.score(["M1"], [start + timedelta(minutes=15 * i)], [value])
+        flags.append(bool(suspicious[0]))
+    return np.array(flags)
+
+
+def test_single_spike_is_flagged():
+    rng = np.random.default_rng(0)
+    values = list(100 + rng.normal(0, 5, 200))
+    values[150] = 1000
+    flags = feed(AnomalyDetector(0.05, 6.0, 30), values)
+    assert flags[150]
+    assert flags.sum() <= 2
+
+
+def test_level_shift_is_relearned():
+    rng = np.random.default_rng(1)
+    values = np.r_[100 + rng.normal(0, 5, 300), 300 + rng.normal(0, 5, 700)]
+    detector = AnomalyDetector(0.05, 6.0, 30, rebaseline_after=20)
+    flags = feed(detector, values)
+    assert flags[300:].sum() <= 25
+    assert not flags[400:].any()
+    assert abs(detector.state("M1")["mean"] - 300) < 10
+
+
+def test_idle_then_running_is_relearned():
+    rng = np.random.default_rng(2)
+    values = np.r_[np.zeros(40), 50 + rng.normal(0, 2, 960)]
+    detector = AnomalyDetector(0.05, 6.0, 30, rebaseline_after=20)
+    flags = feed(detector, values)
+    assert flags[40:].sum() <= 25
+    assert not flags[100:].any()
+    state = detector.state("M1")
+    assert abs(state["mean"] - 50) < 5
+    assert state["std"] > 0
+
+
+def test_dry_run_scoring_leaves_baseline_unchanged():
+    rng = np.random.default_rng(3)
+    detector = AnomalyDetector(0.05, 6.0, 30)
+    feed(detector, 100 + rng.normal(0, 5, 100))
+    before = detector.state("M1")
+    rows = [{"meter_id": "M1", "collect_time": datetime(2025, 2, 1), "energy_value": 1000.0}]
+    assert detector.score_rows(rows, commit=False) == 1
+    # 同一批数据重复提交（如客户端收到429后重试）不会改变统计量，判定结果也不变
+    assert detector.score_rows([dict(rows[0])], commit=False) == 1
+    assert detector.state("M1") == before
+    detector.learn_rows(rows)
+    after = detector.state("M1")
+    assert after["count"] == before["count"] + 1
+    assert after["flagged"] == before["flagged"] + 1
+
+
+def test_dry_run_matches_committed_scoring():
+    rng = np.random.default_rng(4)
+    meter_ids = [f"M{i % 7}" for i in range(700)]
+    times = [datetime(2025, 1, 1) + timedelta(minutes=15 * (i // 7)) for i in range(700)]
+    values = list(100 + rng.normal(0, 5, 700))
+    values[500] = 900
+    committed, dry = AnomalyDetector(0.05, 6.0, 30), AnomalyDetector(0.05, 6.0, 30)
+    expected = committed.score(meter_ids, times, values)
+    actual = dry.score(meter_ids, times, values, commit=False)
+    assert np.array_equal(expected[1], actual[1])
+    assert np.allclose(expected[0], actual[0])
+    assert dry.summary()["readings"] == 0
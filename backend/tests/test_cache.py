@@ -0,0 +1,19 @@
+"""查询结果缓存：加载期间发生失效时不写入旧结果"""
+import pytest
+from utils.cache import MemoryCache, SerializedCache
+
+
+@pytest.mark.parametrize("cache_class", [MemoryCache, SerializedCache])
+def test_load_overlapping_invalidation_is_not_cached(cache_class):
+    cache = cache_class(max_entries=10, ttl=60)
+
+    def stale_loader():
+        # 查询执行期间另一请求提交了新数据并失效缓存
+        cache.invalidate(lambda key: key == ("report",))
+        return {"total": 1}
+
+    assert cache.get_or_load(("report",), stale_loader) == {"total": 1}
+    assert cache.get(("report",)) is None
+    assert cache.stats()["stale_loads"] == 1
+    assert cache.get_or_load(("report",), lambda: {"total": 2}) == {"total": 2}
+    assert cache.get(("report",)) == {"total": 2}
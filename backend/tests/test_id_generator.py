@@ -0,0 +1,24 @@
+"""编号生成器：节点号保留完整进程号，编号定长且按时间有序"""
+import pytest
+from utils.id_generator import IdGenerator, MAX_HOST, MAX_PID, make_node
+
+
+def test_node_keeps_full_pid():
+    # 进程号相差 65536 的两个进程在同一主机上节点号不同
+    assert make_node(3, 70000) != make_node(3, 70000 - 65536)
+    assert make_node(MAX_HOST, MAX_PID) == (MAX_HOST << 22) | MAX_PID
+
+
+def test_out_of_range_node_is_rejected():
+    with pytest.raises(ValueError):
+        make_node(MAX_HOST + 1, 1)
+    with pytest.raises(ValueError):
+        make_node(0, MAX_PID + 1)
+
+
+def test_ids_are_fixed_length_and_ordered():
+    generator = IdGenerator(node=make_node(1, 4_000_000))
+    ids = [generator.next_id("monitor") for _ in range(10000)]
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert {len(i) for i in ids} == {len("monitor_") + 21}
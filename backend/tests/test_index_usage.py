@@ -0,0 +1,29 @@
+"""用 EXPLAIN 检查服务方法实际执行的查询是否命中预期索引"""
+from datetime import datetime
+from database import db
+from migrations import captured_selects, check_index_usage
+from services.energy_service import EnergyService
+from utils.common_utils import encode_cursor
+
+
+def test_service_queries_use_expected_indexes(app):
+    results = check_index_usage()
+    missed = [f"{name}（{index_name}）：{plan}" for name, index_name, used, plan in results if not used]
+    assert not missed, "\n".join(missed)
+
+
+def test_checked_page_query_is_the_keyset_query(app):
+    captured = captured_selects(
+        lambda: EnergyService.get_monitor_page({"meter_id": "M001"}, cursor=encode_cursor(datetime(2025, 1, 1), "~"))
+    )
+    statements = [statement for _, statement, _ in captured if "energy_monitor" in statement]
+    assert len(statements) == 1
+    assert "JOIN energy_meter" in statements[0]
+    assert "ORDER BY energy_monitor.collect_time DESC, energy_monitor.data_id DESC" in statements[0]
+
+
+def test_missing_index_is_reported(app):
+    db.session.execute(db.text("DROP INDEX idx_monitor_time"))
+    db.session.commit()
+    used = {name: used for name, _, used, _ in check_index_usage()}
+    assert not used["监测数据列表按时间分页"]
@@ -0,0 +1,32 @@
+"""数据库升级：旧版本生成的峰谷报表按明细重算一次，之后重复执行不再重算"""
+from datetime import date
+from benchmarks.datagen import generate_dataset
+from database import db
+from migrations import PEAK_VALLEY_VERSION, PEAK_VALLEY_VERSION_NAME, upgrade_schema
+from models import PeakValleyEnergy, RegistryVersion
+
+
+def report_totals() -> dict:
+    return {
+        (r.factory_id, r.energy_type, r.stat_date): round(r.total_energy, 6)
+        for r in PeakValleyEnergy.query.all()
+    }
+
+
+def test_upgrade_recomputes_legacy_reports_once(app):
+    generate_dataset(1, 3, 2, interval_minutes=60, start_date=date(2025, 1, 1))
+    expected = report_totals()
+    # 模拟旧版本留下的错误日报：一条数值错误，一条缺失
+    first, second = PeakValleyEnergy.query.order_by(PeakValleyEnergy.stat_date, PeakValleyEnergy.energy_type).limit(2).all()
+    first.total_energy *= 2
+    db.session.delete(second)
+    db.session.commit()
+
+    actions = upgrade_schema()
+    assert any(action.startswith("重算峰谷报表") for action in actions)
+    assert report_totals() == expected
+    assert db.session.get(RegistryVersion, PEAK_VALLEY_VERSION_NAME).version == PEAK_VALLEY_VERSION
+
+    PeakValleyEnergy.query.first().total_energy += 1
+    db.session.commit()
+    assert not any(action.startswith("重算峰谷报表") for action in upgrade_schema())
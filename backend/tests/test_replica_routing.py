@@ -0,0 +1,70 @@
+"""只读副本路由：read_replica 范围内的 SELECT 走副本，写入及写入之后的读取走主库"""
+import pytest
+from sqlalchemy import select
+from conftest import make_config
+from database import REPLICA_BIND, db, read_replica, replica_reads
+from models import FactoryArea
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    import models  # noqa: F401
+    from app import create_app
+    config = make_config(tmp_path, SQLALCHEMY_BINDS={REPLICA_BIND: f"sqlite:///{tmp_path / 'replica.db'}"})
+    application = create_app(config, web=False)
+    with application.app_context():
+        db.create_all(bind_key=None)
+        db.metadata.create_all(db.engines[REPLICA_BIND])
+        # 两个库放不同名称的同一厂区，按读到的名称判断查询走了哪个库
+        db.session.add(FactoryArea(factory_id="F001", factory_name="主库"))
+        db.session.commit()
+        with db.engines[REPLICA_BIND].begin() as conn:
+            conn.execute(FactoryArea.__table__.insert().values(factory_id="F001", factory_name="副本"))
+        yield application
+        db.session.remove()
+
+
+def factory_name(factory_id: str = "F001"):
+    return db.session.scalar(select(FactoryArea.factory_name).where(FactoryArea.factory_id == factory_id))
+
+
+def replica_names() -> set:
+    with db.engines[REPLICA_BIND].connect() as conn:
+        return set(conn.scalars(select(FactoryArea.factory_name)))
+
+
+def test_reads_go_to_replica_only_inside_scope(replica_app):
+    assert factory_name() == "主库"
+    with read_replica():
+        assert factory_name() == "副本"
+    assert factory_name() == "主库"
+    assert replica_reads(factory_name)() == "副本"
+
+
+def test_locking_reads_stay_on_primary(replica_app):
+    with read_replica():
+        statement = select(FactoryArea.factory_name).where(FactoryArea.factory_id == "F001").with_for_update()
+        assert db.session.scalar(statement) == "主库"
+
+
+def test_writes_and_later_reads_stay_on_primary(replica_app):
+    with read_replica():
+        db.session.add(FactoryArea(factory_id="F002", factory_name="新厂区"))
+        db.session.flush()
+        # 同一事务写入之后读主库，能读到自己刚写的数据
+        assert factory_name("F002") == "新厂区"
+        assert factory_name() == "主库"
+        db.session.commit()
+        # 提交后恢复走副本
+        assert factory_name() == "副本"
+    assert factory_name("F002") == "新厂区"
+    assert "新厂区" not in replica_names()
+
+
+def test_rollback_restores_replica_reads(replica_app):
+    with read_replica():
+        db.session.add(FactoryArea(factory_id="F002", factory_name="新厂区"))
+        db.session.flush()
+        assert factory_name() == "主库"
+        db.session.rollback()
+        assert factory_name() == "副本"
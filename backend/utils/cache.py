@@ -0,0 +1,137 @@
+"""
+查询结果缓存：带过期时间（TTL）的 LRU 缓存
+- MemoryCache：进程内缓存，直接保存 Python 对象（默认）
+- SerializedCache：按共享缓存（如 Redis）的方式保存 JSON 序列化后的字节，取出的是副本；
+  部署多进程时可把它换成真正的共享缓存实现，接口保持不变
+键为元组，失效时按条件函数筛选键，便于只清除受影响的条目
+失效只作用于当前进程的缓存实例：多进程部署时其他进程的条目要等到过期（TTL）后才会更新
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class MemoryCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 60):
+        """
+        :param max_entries: 最大条目数，超出时淘汰最久未使用的条目
+        :param ttl: 条目有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # 键 -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self._generation = 0  # 每次失效/清空时加一，加载期间发生过失效的结果不写入缓存
+        self.hits = self.misses = self.evictions = self.invalidations = self.stale_loads = 0
+
+    def _encode(self, value):
+        return value
+
+    def _decode(self, stored):
+        return stored
+
+    def get(self, key, default=None):
+        """读取缓存，未命中或已过期时返回 default"""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._decode(entry[1])
+            if entry is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, generation: int = None) -> None:
+        """
+        写入缓存
+        :param generation: 开始加载时的失效代数，其间发生过失效时不写入（结果可能是失效前的旧数据）
+        """
+        stored = self._encode(value)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self.stale_loads += 1
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        命中时直接返回缓存值，否则调用 loader() 计算并写入缓存
+        加载期间有其他线程提交并失效了缓存时，本次结果照常返回但不写入缓存
+        """
+        generation = self._generation
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, predicate) -> int:
+        """
+        删除满足条件的条目（仅当前进程），并使正在进行的加载结果作废
+        :param predicate: 参数为缓存键、返回是否删除的函数
+        :return: 删除的条目数
+        """
+        with self._lock:
+            self._generation += 1
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "backend": type(self).__name__,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_loads": self.stale_loads,
+            }
+
+
+class SerializedCache(MemoryCache):
+    """保存 JSON 字节的缓存（与共享缓存的读写语义一致：值需可 JSON 序列化，每次读取得到新对象）"""
+
+    def _encode(self, value):
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    def _decode(self, stored):
+        return json.loads(stored)
+
+
+class NullCache(MemoryCache):
+    """不缓存（CACHE_BACKEND=none 时使用），仍统计未命中次数"""
+
+    def set(self, key, value, generation: int = None) -> None:
+        pass
+
+
+CACHE_BACKENDS = {"memory": MemoryCache, "serialized": SerializedCache, "none": NullCache}
+
+
+def create_cache(backend: str, max_entries: int, ttl: float) -> MemoryCache:
+    """按名称创建缓存实例，名称不支持时抛出ValueError"""
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"不支持的缓存类型：{backend}")
+    return CACHE_BACKENDS[backend](max_entries, ttl)
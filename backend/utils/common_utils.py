@@ -1,37 +1,24 @@
-from datetime import datetime, time
+import base64
+from datetime import datetime
 from config import Config
+from utils.id_generator import id_generator
+from utils.tariff_engine import get_tariff_engine
 
 def get_period_type(collect_time: datetime) -> str:
     """
-    根据采集时间判断峰谷时段类型
+    根据采集时间判断峰谷时段类型（按 Config.PEAK_VALLEY_PERIODS 配置）
     :param collect_time: 采集时间（datetime对象）
     :return: 时段类型（peak=尖峰, high=高峰, flat=平段, valley=低谷）
     """
-    collect_hour = collect_time.hour
-    collect_minute = collect_time.minute
-    current_time = time(collect_hour, collect_minute)
-    
-    # 尖峰时段：10:00-12:00 或 16:00-18:00
-    if (time(10, 0) <= current_time < time(12, 0)) or (time(16, 0) <= current_time < time(18, 0)):
-        return "peak"
-    # 高峰时段：8:00-10:00 或 12:00-16:00 或 18:00-22:00
-    elif (time(8, 0) <= current_time < time(10, 0)) or (time(12, 0) <= current_time < time(16, 0)) or (time(18, 0) <= current_time < time(22, 0)):
-        return "high"
-    # 平段时段：6:00-8:00 或 22:00-24:00
-    elif (time(6, 0) <= current_time < time(8, 0)) or (time(22, 0) <= current_time <= time(23, 59)):
-        return "flat"
-    # 低谷时段：00:00-6:00
-    else:
-        return "valley"
+    return get_tariff_engine().period_of(collect_time)
 
 def generate_data_id(prefix: str) -> str:
     """
-    生成唯一数据编号（前缀+时间戳）
+    生成唯一数据编号（前缀+毫秒时间戳+节点号+序号，按时间有序）
     :param prefix: 前缀（如meter=设备, monitor=监测, peak=峰谷）
-    :return: 唯一编号（如monitor_20250101120000001）
+    :return: 唯一编号（如monitor_19a0b1c2d3e000f2a0000）
     """
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")[:15]  # 时间戳（精确到毫秒）
-    return f"{prefix}_{timestamp}"
+    return id_generator.next_id(prefix)
 
 def verify_energy_value(energy_type: str, value: float) -> bool:
     """
@@ -44,4 +31,37 @@ def verify_energy_value(energy_type: str, value: float) -> bool:
         return False
     # 简单阈值校验（可根据实际调整）
     max_values = {"水": 1000, "蒸汽": 500, "天然气": 2000}  # 单条数据最大能耗值
-    return value <= max_values.get(energy_type, 10000)
\ No newline at end of file
+    return value <= max_values.get(energy_type, 10000)
+
+def parse_datetime(value: str) -> datetime:
+    """
+    解析时间字符串（兼容接口格式与页面 datetime-local 控件格式）
+    :param value: 如"2025-01-01 12:00:00"、"2025-01-01T12:00"
+    :return: datetime对象，格式不合法时抛出ValueError
+    """
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"时间格式不合法：{value}")
+
+def encode_cursor(collect_time: datetime, data_id: str) -> str:
+    """
+    生成分页游标（上一页最后一条数据的采集时间+编号）
+    :return: URL安全的base64字符串
+    """
+    raw = f"{collect_time.isoformat()}|{data_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """
+    解析分页游标
+    :return: (采集时间, 数据编号)，游标不合法时抛出ValueError
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        collect_time, data_id = raw.split("|", 1)
+        return datetime.fromisoformat(collect_time), data_id
+    except Exception:
+        raise ValueError(f"分页游标不合法：{cursor}")
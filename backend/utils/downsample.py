@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    LTTB（Largest-Triangle-Three-Buckets）降采样，保留曲线形状的同时把点数降到 threshold
+    :param x: 横坐标数组（如秒数），需升序
+    :param y: 纵坐标数组
+    :param threshold: 目标点数（含首尾两点）
+    :return: 被选中点的下标数组
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # 除首尾两点外，其余点均分成 threshold-2 个桶
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # 下一个桶的平均点作为三角形的第三个顶点（最后一个桶用末尾点）
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else n)
+        next_end = max(next_end, next_start + 1)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # 当前桶中与上一个选中点、下一桶平均点构成三角形面积最大的点
+        area = np.abs((x[prev] - avg_x) * (y[start:end] - y[prev]) - (x[prev] - x[start:end]) * (avg_y - y[prev]))
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
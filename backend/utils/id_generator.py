@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from config import Config
+
+# 编号结构（定长十六进制，字符串排序即时间排序）：
+#   毫秒时间戳(11位) + 节点号(7位) + 毫秒内序号(3位)
+# 加上前缀后最长为 "monitor_" + 21 = 29 位，不超过数据表的 String(30)
+TIMESTAMP_BITS = 44
+NODE_BITS = 28
+SEQUENCE_BITS = 12
+MAX_NODE = (1 << NODE_BITS) - 1
+# 节点号 = 主机号(高6位) + 进程号(低22位)；Linux 进程号上限（PID_MAX_LIMIT）为 2^22，完整保留，同一主机上的进程互不重复
+HOST_BITS = 6
+PID_BITS = NODE_BITS - HOST_BITS
+MAX_HOST = (1 << HOST_BITS) - 1
+MAX_PID = (1 << PID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class IdGenerator:
+    """
+    时间有序、多线程/多进程安全的编号生成器
+    - 同一进程内通过锁保证单调递增，同一毫秒内用序号区分（每毫秒最多4096个）
+    - 序号用尽或系统时钟回拨时沿用上一个毫秒数继续递增，保证不重复
+    - 节点号由主机号（Config.ID_NODE，未设置时为0）与进程号组合；超出位数时报错，不截断（截断后可能与其他进程重复）
+    """
+
+    def __init__(self, node: int = None):
+        self._fixed_node = node
+        self._reset()
+
+    def _reset(self):
+        """初始化节点号、序号和锁（进程 fork 之后重新调用，fork 时锁可能正被其他线程持有）"""
+        self._lock = threading.Lock()
+        node = self._fixed_node
+        if node is None:
+            node = make_node(Config.ID_NODE or 0, os.getpid())
+        if not 0 <= node <= MAX_NODE:
+            raise ValueError(f"编号节点号超出范围（0~{MAX_NODE}）：{node}")
+        self.node = int(node)
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self, prefix: str) -> str:
+        """
+        生成下一个编号
+        :param prefix: 前缀（如monitor=监测, peak=峰谷）
+        :return: 唯一编号（如monitor_19a0b1c2d3e000f2a0000）
+        """
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                # 同一毫秒（或时钟回拨）：序号递增，用尽后借用下一毫秒
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            ms, seq = self._last_ms, self._sequence
+        return f"{prefix}_{ms:011x}{self.node:07x}{seq:03x}"
+
+
+def make_node(host: int, pid: int) -> int:
+    """
+    由主机号和进程号组合节点号
+    :raises ValueError: 主机号或进程号超出可用位数
+    """
+    if not 0 <= host <= MAX_HOST:
+        raise ValueError(f"ID_NODE 超出范围（0~{MAX_HOST}）：{host}")
+    if not 0 <= pid <= MAX_PID:
+        raise ValueError(f"进程号 {pid} 超出编号节点号的 {PID_BITS} 位，无法保证多进程编号不重复")
+    return host << PID_BITS | pid
+
+
+# 进程内共享的默认生成器
+id_generator = IdGenerator()
+
+# fork 出的子进程（如 gunicorn worker、进程池）需要使用自己的进程号作为节点号
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=id_generator._reset)
@@ -0,0 +1,294 @@
+"""
+请求与服务方法的性能统计
+- 通过 SQLAlchemy 引擎事件统计每个请求、每个服务方法执行的 SQL 条数与耗时，通过 ORM 事件统计加载的对象数
+- 同一请求内同一关系被逐条懒加载超过 Config.N_PLUS_ONE_THRESHOLD 次时记为 N+1 查询
+- render_prometheus 输出 Prometheus 文本格式；配置 Config.SLOW_REQUEST_MS 后记录慢请求日志
+"""
+import functools
+import logging
+import numbers
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from config import Config
+
+logger = logging.getLogger("energy.performance")
+
+# 请求耗时直方图的分桶上限（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class _Frame:
+    """一次请求或一次服务方法调用的统计"""
+    __slots__ = ("queries", "sql_seconds", "rows", "lazy_loads", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.lazy_loads = Counter()  # 关系名 -> 懒加载次数
+        self.statements = Counter()  # SQL 语句 -> 执行次数（仅请求级统计）
+
+
+# 当前线程/协程的统计栈：[请求, 服务方法, 嵌套的服务方法...]
+_frames = ContextVar("instrumentation_frames", default=())
+
+
+class MetricsRegistry:
+    """按接口、服务方法累计的统计值（进程内，线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(lambda: defaultdict(int))  # (endpoint, method, status) -> 累计值（次数、条数为整数）
+        self.buckets = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))  # endpoint -> 分桶计数
+        self.services = defaultdict(lambda: defaultdict(int))  # 方法名 -> 累计值
+        self.n_plus_one = Counter()  # (endpoint, 关系名) -> 次数
+
+    def record_request(self, endpoint: str, method: str, status: int, seconds: float, frame: _Frame) -> None:
+        with self._lock:
+            item = self.requests[(endpoint, method, str(status))]
+            item["count"] += 1
+            item["seconds"] += seconds
+            item["queries"] += frame.queries
+            item["sql_seconds"] += frame.sql_seconds
+            item["rows"] += frame.rows
+            buckets = self.buckets[endpoint]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            for relationship, count in frame.lazy_loads.items():
+                if count >= Config.N_PLUS_ONE_THRESHOLD:
+                    self.n_plus_one[(endpoint, relationship)] += 1
+
+    def record_service(self, name: str, seconds: float, frame: _Frame, failed: bool) -> None:
+        with self._lock:
+            item = self.services[name]
+            item["count"] += 1
+            item["errors"] += failed
+            item["seconds"] += seconds
+            item["queries"] += frame.queries
+            item["sql_seconds"] += frame.sql_seconds
+            item["rows"] += frame.rows
+
+    def snapshot(self) -> dict:
+        """当前统计值的副本（供接口查看或测试）"""
+        with self._lock:
+            return {
+                "requests": {k: dict(v) for k, v in self.requests.items()},
+                "services": {k: dict(v) for k, v in self.services.items()},
+                "n_plus_one": dict(self.n_plus_one),
+            }
+
+
+metrics = MetricsRegistry()
+
+
+# -------------------------- 数据库事件 --------------------------
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _frames.get():
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    frames = _frames.get()
+    if not frames or not conn.info.get("query_start"):
+        return
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    for frame in frames:
+        frame.queries += 1
+        frame.sql_seconds += elapsed
+    frames[0].statements[statement] += 1
+
+
+@event.listens_for(Session, "loaded_as_persistent")
+def _loaded_as_persistent(session, instance):
+    for frame in _frames.get():
+        frame.rows += 1
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _do_orm_execute(orm_execute_state):
+    frames = _frames.get()
+    if frames and orm_execute_state.is_relationship_load and orm_execute_state.lazy_loaded_from is not None:
+        relationship = str(orm_execute_state.loader_strategy_path[-1])
+        for frame in frames:
+            frame.lazy_loads[relationship] += 1
+
+
+# -------------------------- 服务方法 --------------------------
+def instrument_service(cls):
+    """
+    类装饰器：统计类中每个公开静态方法的调用次数、耗时、SQL 条数与耗时（嵌套调用分别计入各自的方法）
+    指标名为 类名.方法名
+    """
+    for attr, value in list(vars(cls).items()):
+        if isinstance(value, staticmethod) and not attr.startswith("_"):
+            setattr(cls, attr, staticmethod(_wrap(f"{cls.__name__}.{attr}", value.__func__)))
+    return cls
+
+
+def _wrap(name: str, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not Config.INSTRUMENTATION_ENABLED:
+            return func(*args, **kwargs)
+        frame = _Frame()
+        token = _frames.set(_frames.get() + (frame,))
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            # 约定返回 (是否成功, 提示信息, ...) 的方法，失败结果也计为错误
+            failed = isinstance(result, tuple) and result[:1] == (False,)
+            return result
+        finally:
+            _frames.reset(token)
+            metrics.record_service(name, time.perf_counter() - started, frame, failed)
+    return wrapper
+
+
+# -------------------------- 请求 --------------------------
+def _start_request():
+    frame = _Frame()
+    request.environ["instrumentation"] = (frame, _frames.set((frame,)), time.perf_counter())
+
+
+def _record_status(response):
+    request.environ["instrumentation_status"] = response.status_code
+    return response
+
+
+def _finish_request(exc=None):
+    state = request.environ.pop("instrumentation", None)
+    if state is None:
+        return
+    frame, token, started = state
+    try:
+        _frames.reset(token)
+    except ValueError:
+        # 流式响应在其他上下文中结束时无法还原，直接清空
+        _frames.set(())
+    seconds = time.perf_counter() - started
+    endpoint = request.endpoint or "unmatched"
+    status = request.environ.get("instrumentation_status", 500 if exc else 200)
+    metrics.record_request(endpoint, request.method, status, seconds, frame)
+    _log_if_slow(endpoint, seconds, frame)
+
+
+def _log_if_slow(endpoint: str, seconds: float, frame: _Frame) -> None:
+    suspects = {k: v for k, v in frame.lazy_loads.items() if v >= Config.N_PLUS_ONE_THRESHOLD}
+    if suspects:
+        logger.warning("疑似N+1查询 %s %s：%s", request.method, request.full_path, suspects)
+    if Config.SLOW_REQUEST_MS is None or seconds * 1000 < Config.SLOW_REQUEST_MS:
+        return
+    top = "; ".join(f"{count}× {' '.join(sql.split())[:200]}" for sql, count in frame.statements.most_common(3))
+    logger.warning(
+        "慢请求 %s %s（%s）：耗时%.1fms，SQL %d条/%.1fms，加载对象%d个；最频繁的SQL：%s",
+        request.method, request.full_path, endpoint, seconds * 1000,
+        frame.queries, frame.sql_seconds * 1000, frame.rows, top
+    )
+
+
+def init_instrumentation(app) -> None:
+    """为应用注册请求统计钩子（配置了 SLOW_REQUEST_LOG 时慢请求额外写入该文件）"""
+    if not Config.INSTRUMENTATION_ENABLED:
+        return
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_request)
+    if Config.SLOW_REQUEST_LOG:
+        handler = logging.FileHandler(Config.SLOW_REQUEST_LOG, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+# -------------------------- Prometheus 输出 --------------------------
+def _labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    """样本值：整数原样输出，浮点数输出完整精度（:g 只保留6位有效数字，累计值超过1e6后不再变化）"""
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def render_prometheus(gauges: dict = None, counters: dict = None) -> str:
+    """
+    以 Prometheus 文本格式输出全部指标
+    :param gauges: 额外的瞬时指标 {指标名: (说明, 数值)}，如缓存条目数、写入队列深度
+    :param counters: 额外的累计指标（只增不减，进程重启归零）{指标名: (说明, 数值)}，输出时加 _total 后缀
+    """
+    snapshot = metrics.snapshot()
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{labels} {_format_value(value)}" for labels, value in samples)
+
+    requests = snapshot["requests"]
+    for key, help_text, field in (
+        ("energy_http_requests_total", "请求次数", "count"),
+        ("energy_http_request_seconds_total", "请求总耗时（秒）", "seconds"),
+        ("energy_http_request_queries_total", "请求执行的SQL条数", "queries"),
+        ("energy_http_request_sql_seconds_total", "请求的SQL总耗时（秒）", "sql_seconds"),
+        ("energy_http_request_rows_total", "请求加载的ORM对象数", "rows"),
+    ):
+        metric(key, "counter", help_text, [
+            (_labels(endpoint=e, method=m, status=s), v[field]) for (e, m, s), v in sorted(requests.items())
+        ])
+
+    name = "energy_http_request_duration_seconds"
+    lines.append(f"# HELP {name} 请求耗时分布（秒）")
+    lines.append(f"# TYPE {name} histogram")
+    with metrics._lock:
+        buckets = {k: list(v) for k, v in metrics.buckets.items()}
+    for endpoint, counts in sorted(buckets.items()):
+        cumulative = 0
+        for bound, count in zip(DURATION_BUCKETS + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(endpoint=endpoint, le=bound)} {cumulative}")
+        total = sum(v["seconds"] for (e, _, _), v in requests.items() if e == endpoint)
+        lines.append(f"{name}_sum{_labels(endpoint=endpoint)} {_format_value(total)}")
+        lines.append(f"{name}_count{_labels(endpoint=endpoint)} {cumulative}")
+
+    services = snapshot["services"]
+    for key, help_text, field in (
+        ("energy_service_calls_total", "服务方法调用次数", "count"),
+        ("energy_service_errors_total", "服务方法失败次数", "errors"),
+        ("energy_service_seconds_total", "服务方法总耗时（秒）", "seconds"),
+        ("energy_service_queries_total", "服务方法执行的SQL条数", "queries"),
+        ("energy_service_sql_seconds_total", "服务方法的SQL总耗时（秒）", "sql_seconds"),
+        ("energy_service_rows_total", "服务方法加载的ORM对象数", "rows"),
+    ):
+        metric(key, "counter", help_text, [(_labels(method=name), v[field]) for name, v in sorted(services.items())])
+
+    metric("energy_n_plus_one_total", "counter", "疑似N+1懒加载的请求次数", [
+        (_labels(endpoint=e, relationship=r), v) for (e, r), v in sorted(snapshot["n_plus_one"].items())
+    ])
+
+    for name, (help_text, value) in sorted((counters or {}).items()):
+        metric(f"{name}_total", "counter", help_text, [("", value)])
+    for name, (help_text, value) in sorted((gauges or {}).items()):
+        metric(name, "gauge", help_text, [("", value)])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,75 @@
+"""
+跨数据库的时间函数（MySQL / SQLite 各自编译成对应的 SQL）
+时间列均为不带时区的 DATETIME，按"1970-01-01 00:00:00 起的秒数"换算，不受会话时区影响
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import Integer
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch(value: datetime) -> int:
+    """Python 端与 unix_epoch 一致的换算"""
+    return int((value - EPOCH).total_seconds())
+
+
+def from_epoch(seconds: int) -> datetime:
+    """秒数换算回不带时区的 datetime"""
+    return EPOCH + timedelta(seconds=int(seconds))
+
+
+class unix_epoch(FunctionElement):
+    """时间列换算为秒数：unix_epoch(EnergyMonitor.collect_time)"""
+    type = Integer()
+    inherit_cache = True
+
+
+class time_bucket(FunctionElement):
+    """
+    时间列所在的分桶序号：time_bucket(列, 起始秒数, 桶宽秒数)
+    等价于 floor((秒数 - 起始秒数) / 桶宽)，要求列值不早于起始时间
+    """
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(unix_epoch)
+def _epoch_default(element, compiler, **kw):
+    return "CAST(EXTRACT(EPOCH FROM %s) AS BIGINT)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(unix_epoch, "sqlite")
+def _epoch_sqlite(element, compiler, **kw):
+    return "CAST(STRFTIME('%%s', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(unix_epoch, "mysql")
+def _epoch_mysql(element, compiler, **kw):
+    return "TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(time_bucket)
+def _bucket_default(element, compiler, **kw):
+    column, start, width = list(element.clauses)
+    return "FLOOR((%s - %s) / %s)" % (
+        compiler.process(unix_epoch(column), **kw), compiler.process(start, **kw), compiler.process(width, **kw)
+    )
+
+
+@compiles(time_bucket, "sqlite")
+def _bucket_sqlite(element, compiler, **kw):
+    # SQLite 中整数相除即为整除
+    column, start, width = list(element.clauses)
+    return "((%s - %s) / %s)" % (
+        compiler.process(unix_epoch(column), **kw), compiler.process(start, **kw), compiler.process(width, **kw)
+    )
+
+
+@compiles(time_bucket, "mysql")
+def _bucket_mysql(element, compiler, **kw):
+    column, start, width = list(element.clauses)
+    return "((%s - %s) DIV %s)" % (
+        compiler.process(unix_epoch(column), **kw), compiler.process(start, **kw), compiler.process(width, **kw)
+    )
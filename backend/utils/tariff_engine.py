@@ -0,0 +1,202 @@
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+import numpy as np
+from config import Config
+
+# 时段类型（数组下标即时段编码，顺序同时也是时段重叠时的优先级）
+PERIOD_TYPES = ("peak", "high", "flat", "valley")
+PERIOD_INDEX = {name: i for i, name in enumerate(PERIOD_TYPES)}
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_period_range(period: str) -> tuple[int, int]:
+    """
+    解析时段字符串为当天分钟区间（左闭右开）
+    :param period: 时段字符串（如"22:00-24:00"）
+    :return: (起始分钟, 结束分钟)，如(1320, 1440)
+    """
+    start, end = period.split("-")
+    start_h, start_m = (int(x) for x in start.split(":"))
+    end_h, end_m = (int(x) for x in end.split(":"))
+    return start_h * 60 + start_m, end_h * 60 + end_m
+
+
+def period_ranges(period: str) -> list[tuple[int, int]]:
+    """
+    解析并校验时段，跨零点的时段（如"22:00-02:00"）拆成两段
+    :param period: 时段字符串
+    :return: [(起始分钟, 结束分钟)]，如"22:00-02:00"返回[(1320, 1440), (0, 120)]
+    :raises ValueError: 格式错误、时间超出 00:00~24:00 或起止时间相同
+    """
+    try:
+        start, end = parse_period_range(period)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError(f"时段格式错误（应为HH:MM-HH:MM）：{period}")
+    if not (0 <= start < MINUTES_PER_DAY and 0 <= end <= MINUTES_PER_DAY) or start == end \
+            or any(int(part.split(":")[1]) >= 60 for part in period.split("-")):
+        raise ValueError(f"时段不合法：{period}")
+    if start > end:
+        return [(start, MINUTES_PER_DAY), (0, end)]
+    return [(start, end)]
+
+
+class TariffEngine:
+    """
+    峰谷电价引擎：把时段配置编译成一天1440分钟的查找表，按数组批量分类、汇总
+    - period_table[m]：第m分钟所属时段编码（PERIOD_TYPES的下标）
+    - prices：各时段单价，下标与时段编码一致
+    - price_table[m]：第m分钟的单价
+    """
+
+    def __init__(self, periods: dict, prices: dict):
+        """
+        :param periods: 各时段的时间范围，如{"peak": ["10:00-12:00"], "flat": ["22:00-02:00"]}（可跨零点）
+        :param prices: 各时段单价
+        :raises ValueError: 时段类型未知或时段不合法
+        """
+        unknown = set(periods) - set(PERIOD_TYPES)
+        if unknown:
+            raise ValueError(f"未知的时段类型：{'、'.join(sorted(unknown))}")
+        self.periods = periods
+        # 未被任何时段覆盖的分钟按低谷处理（与原判断逻辑的else分支一致）
+        table = np.full(MINUTES_PER_DAY, PERIOD_INDEX["valley"], dtype=np.int8)
+        # 按优先级从低到高依次覆盖，重叠时尖峰优先
+        for name in reversed(PERIOD_TYPES):
+            for period in periods.get(name, []):
+                for start, end in period_ranges(period):
+                    table[start:end] = PERIOD_INDEX[name]
+        table.setflags(write=False)
+        self.period_table = table
+        self.prices = np.array([prices.get(name, 0) for name in PERIOD_TYPES], dtype=np.float64)
+        self.price_table = self.prices[table]
+        self.price_table.setflags(write=False)
+
+    @staticmethod
+    def minute_of_day(timestamps: np.ndarray) -> np.ndarray:
+        """把 datetime64 数组转换为当天分钟数（0~1439）"""
+        timestamps = np.asarray(timestamps, dtype="datetime64[s]")
+        return (timestamps.astype("datetime64[m]") - timestamps.astype("datetime64[D]")).astype(np.int64)
+
+    def classify(self, timestamps: np.ndarray) -> np.ndarray:
+        """批量判断时段，返回时段编码数组"""
+        return self.period_table[self.minute_of_day(timestamps)]
+
+    def period_of(self, collect_time: datetime) -> str:
+        """判断单个采集时间所属时段"""
+        return PERIOD_TYPES[self.period_table[collect_time.hour * 60 + collect_time.minute]]
+
+    def aggregate(self, timestamps: np.ndarray, values: np.ndarray) -> dict:
+        """
+        按时段汇总能耗与成本
+        :param timestamps: 采集时间数组（datetime64）
+        :param values: 能耗值数组
+        :return: {"peak":..., "high":..., "flat":..., "valley":..., "total":..., "cost":...}
+        """
+        values = np.asarray(values, dtype=np.float64)
+        sums = np.bincount(self.classify(timestamps), weights=values, minlength=len(PERIOD_TYPES))
+        return self.summarize({name: float(sums[i]) for i, name in enumerate(PERIOD_TYPES)})
+
+    def summarize(self, period_sums: dict) -> dict:
+        """在各时段能耗的基础上补充总能耗(total)与总成本(cost)"""
+        sums = np.array([period_sums.get(name) or 0 for name in PERIOD_TYPES], dtype=np.float64)
+        result = {name: float(sums[i]) for i, name in enumerate(PERIOD_TYPES)}
+        result["total"] = float(sums.sum())
+        result["cost"] = float(sums @ self.prices)
+        return result
+
+
+@lru_cache(maxsize=64)
+def _compile(periods_key: tuple, prices_key: tuple) -> TariffEngine:
+    return TariffEngine({k: list(v) for k, v in periods_key}, dict(prices_key))
+
+
+def compile_tariff(periods: dict, prices: dict) -> TariffEngine:
+    """编译时段与电价配置（内容相同的配置共用同一个引擎）"""
+    periods_key = tuple(sorted((k, tuple(v)) for k, v in periods.items()))
+    prices_key = tuple(sorted((k, float(v)) for k, v in prices.items()))
+    return _compile(periods_key, prices_key)
+
+
+def get_tariff_engine() -> TariffEngine:
+    """获取按当前 Config 编译好的引擎（配置不变时只编译一次）"""
+    return compile_tariff(Config.PEAK_VALLEY_PERIODS, Config.PEAK_VALLEY_PRICES)
+
+
+class TariffTimeline:
+    """
+    按生效日期排列的多个电价版本：把各版本的分钟查找表叠成二维数组，
+    跨越电价调整的时间范围也只需一次数组运算（按日期定位版本，再按分钟查表）
+    """
+
+    def __init__(self, versions: list):
+        """
+        :param versions: [(生效日期, TariffEngine)]，按生效日期升序；第一个版本的生效日期视为无下限
+        """
+        self.dates = [effective for effective, _ in versions]
+        self.engines = [engine for _, engine in versions]
+        self._day_numbers = np.array(self.dates, dtype="datetime64[D]")
+        self.period_tables = np.stack([engine.period_table for engine in self.engines])
+        self.price_tables = np.stack([engine.price_table for engine in self.engines])
+
+    def engine_on(self, day: date) -> TariffEngine:
+        """某一天生效的电价版本"""
+        return self.engines[max(bisect_right(self.dates, day) - 1, 0)]
+
+    def segments(self, start_date: date = None, end_date: date = None) -> list:
+        """
+        把日期区间按电价版本切分
+        :param start_date: 开始日期（含），为空表示不限
+        :param end_date: 结束日期（含），为空表示不限
+        :return: [(开始日期或None, 结束日期或None, TariffEngine)]，日期含两端
+        """
+        result = []
+        for i, engine in enumerate(self.engines):
+            seg_start = self.dates[i] if i else None
+            seg_end = self.dates[i + 1] - timedelta(days=1) if i + 1 < len(self.engines) else None
+            if start_date and seg_end and seg_end < start_date or end_date and seg_start and seg_start > end_date:
+                continue
+            if start_date and (seg_start is None or seg_start < start_date):
+                seg_start = start_date
+            if end_date and (seg_end is None or seg_end > end_date):
+                seg_end = end_date
+            result.append((seg_start, seg_end, engine))
+        return result
+
+    def _slots(self, timestamps: np.ndarray) -> np.ndarray:
+        """每个时间点在展平的二维查找表中的下标：版本下标 × 1440 + 当天分钟数"""
+        seconds = np.asarray(timestamps, dtype="datetime64[s]").view(np.int64)
+        day_numbers, slots = np.divmod(seconds, 86400)
+        slots //= 60
+        if len(self.engines) > 1 and len(day_numbers):
+            # 先为区间内每一天确定版本，再按天号取值（避免对每条读数二分查找）
+            first = int(day_numbers.min())
+            span = np.arange(first, int(day_numbers.max()) + 1).astype("datetime64[D]")
+            offsets = (np.searchsorted(self._day_numbers, span, side="right") - 1).clip(0) * MINUTES_PER_DAY
+            slots += offsets[day_numbers - first]
+        return slots
+
+    def classify(self, timestamps: np.ndarray) -> np.ndarray:
+        """批量判断时段（按各时间点当天生效的版本），返回时段编码数组"""
+        return self.period_tables.ravel()[self._slots(timestamps)]
+
+    def aggregate(self, timestamps: np.ndarray, values: np.ndarray) -> dict:
+        """
+        按时段汇总能耗与成本，成本按各读数当天生效的单价计算
+        :return: {"peak":..., "high":..., "flat":..., "valley":..., "total":..., "cost":...}
+        """
+        values = np.asarray(values, dtype=np.float64)
+        slots = self._slots(timestamps)
+        sums = np.bincount(self.period_tables.ravel()[slots], weights=values, minlength=len(PERIOD_TYPES))
+        result = {name: float(sums[i]) for i, name in enumerate(PERIOD_TYPES)}
+        result["total"] = float(sums.sum())
+        result["cost"] = float(values @ self.price_tables.ravel()[slots])
+        return result
+
+
+def rows_to_arrays(rows: list) -> tuple[np.ndarray, np.ndarray]:
+    """把查询得到的 (采集时间, 能耗值) 结果行转换为 numpy 数组"""
+    if not rows:
+        return np.empty(0, dtype="datetime64[s]"), np.empty(0, dtype=np.float64)
+    times, values = zip(*rows)
+    return np.array(times, dtype="datetime64[s]"), np.array(values, dtype=np.float64)
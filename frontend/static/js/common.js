@@ -8,7 +8,10 @@
  */
 function ajaxRequest(url, method, data, successCallback, errorCallback) {
     const xhr = new XMLHttpRequest();
-    xhr.open(method, url, true);
+    const isGet = method.toUpperCase() === "GET";
+    const params = new URLSearchParams(data || {}).toString();
+    // GET请求参数拼接在URL上
+    xhr.open(method, isGet && params ? `${url}?${params}` : url, true);
     
     // POST请求设置请求头
     if (method.toUpperCase() === "POST") {
@@ -30,14 +33,8 @@ function ajaxRequest(url, method, data, successCallback, errorCallback) {
         alert("网络错误，请重试！");
     };
     
-    // 处理请求数据（GET拼接在URL，POST放在请求体）
-    if (method.toUpperCase() === "GET") {
-        const params = new URLSearchParams(data).toString();
-        xhr.send(params ? `?${params}` : null);
-    } else {
-        const params = new URLSearchParams(data).toString();
-        xhr.send(params);
-    }
+    // 处理请求数据（GET已拼接在URL，POST放在请求体）
+    xhr.send(isGet ? null : params);
 }
 
 /**
@@ -1,4 +1,5 @@
 let myChart = null;
+let trendChart = null;
 
 document.addEventListener('DOMContentLoaded', function() {
     // 页面加载时若有默认日期，自动查询一次
@@ -14,6 +15,8 @@ function loadPeakValleyData() {
 
     const params = { factory_id: factory, date: date, energy_type: type };
 
+    loadTrendData();
+
     ajaxRequest('/energy/api/report/peak_valley', 'GET', params, (res) => {
         if(res.success) {
             updateDashboard(res.data, type);
@@ -31,6 +34,61 @@ function loadPeakValleyData() {
     });
 }
 
+// 近30天能耗趋势：后端按时间分桶聚合，只返回图表需要的点数
+function loadTrendData() {
+    const factory = document.getElementById('pv_factory').value;
+    const date = document.getElementById('pv_date').value;
+    const type = document.getElementById('pv_type').value;
+
+    const end = new Date(date + 'T00:00:00');
+    end.setDate(end.getDate() + 1);
+    const start = new Date(end);
+    start.setDate(start.getDate() - 30);
+    const fmt = (d) => `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}-${String(d.getDate()).padStart(2, '0')} 00:00:00`;
+
+    const params = { factory_id: factory, energy_type: type, start_time: fmt(start), end_time: fmt(end), points: 120 };
+    ajaxRequest('/energy/api/timeseries', 'GET', params, (res) => {
+        if(res.success) {
+            renderTrendChart(res.data);
+        }
+    });
+}
+
+function renderTrendChart(data) {
+    const ctx = document.getElementById('trendChart').getContext('2d');
+
+    if(trendChart) {
+        trendChart.destroy();
+    }
+
+    trendChart = new Chart(ctx, {
+        type: 'line',
+        data: {
+            labels: data.time,
+            datasets: [{
+                label: '能耗量',
+                data: data.sum,
+                borderColor: 'rgba(52, 152, 219, 1)',
+                backgroundColor: 'rgba(52, 152, 219, 0.15)',
+                fill: true,
+                pointRadius: 0,
+                tension: 0.2
+            }]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                legend: { display: false }
+            },
+            scales: {
+                x: { ticks: { maxTicksLimit: 10 } },
+                y: { beginAtZero: true }
+            }
+        }
+    });
+}
+
 function updateDashboard(data, type) {
     const unit = type === '电' ? 'kWh' : (type === '水' ? 'm³' : 'm³');
     document.getElementById('usage_unit').innerText = unit;
@@ -0,0 +1,18 @@
+-- 为已有的 MySQL 数据库补建查询索引（等价于 flask --app app upgrade-db）
+-- 执行唯一索引前需确保峰谷报表没有重复记录，可先运行下面的检查语句
+USE energy_db;
+
+-- 能耗监测数据：按厂区/设备筛选并按采集时间排序
+CREATE INDEX idx_monitor_factory_time ON energy_monitor (factory_id, collect_time);
+CREATE INDEX idx_monitor_meter_time ON energy_monitor (meter_id, collect_time);
+CREATE INDEX idx_monitor_time ON energy_monitor (collect_time);
+
+-- 峰谷报表：检查重复记录（应返回空结果）
+SELECT factory_id, energy_type, stat_date, COUNT(*) AS cnt
+FROM peak_valley_energy
+GROUP BY factory_id, energy_type, stat_date
+HAVING cnt > 1;
+
+-- 峰谷报表：每个厂区、能源类型每天唯一；按日期+能源类型汇总
+CREATE UNIQUE INDEX uq_peak_valley_factory_type_date ON peak_valley_energy (factory_id, energy_type, stat_date);
+CREATE INDEX idx_peak_valley_date_type ON peak_valley_energy (stat_date, energy_type);